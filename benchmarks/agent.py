@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from sys import argv
+from time import time, sleep
+from os import environ
+from shutil import rmtree
+from tempfile import mkdtemp
+from multiprocessing import Process
+
+from unlocker.agent import Agent
+
+from unlocker.util.secret import Secret
+from unlocker.util.log import Log
+
+from benchmarks.generator import generate, build_name
+
+
+SIZE = 1000
+SAMPLES = 1000
+
+
+def build_secrets(size):
+    """Create a keychain file with a given number of generated entries.
+
+    Args:
+        size (int): Number of entries to store.
+    """
+
+    secrets = Secret.get_secret_file()
+    generate(secrets, size)
+    secrets.close()
+
+
+def measure(agent, option, args):
+    """Time agent requests for an option.
+
+    Args:
+        agent (Agent): Agent client.
+        option  (str): Option to request.
+        args   (dict): Arguments of option.
+
+    Returns:
+        float: Average time in microseconds per request.
+    """
+
+    started = time()
+    for _ in xrange(SAMPLES):
+        if agent.request(option, args) is None:
+            raise SystemExit("Agent did not answer {}".format(option))
+    return (time() - started) / SAMPLES * 10**6
+
+
+def main():
+    """Start an agent on a temporary keychain and time its requests.
+
+    Keychain size can be set from command line, e.g. 10000.
+    """
+
+    Log.configure()
+    size = int(argv[1]) if len(argv) > 1 else SIZE
+    home = mkdtemp()
+    environ["HOME"] = home
+    try:
+        build_secrets(size)
+        server = Process(target=Agent().serve)
+        server.start()
+        sleep(0.5)
+        agent = Agent()
+        name = {"name": build_name(size / 2), "signature": ""}
+        print "{} entries".format(size)
+        print "  stdout_dump {:>10.2f} usec/req".format(
+            measure(agent, "stdout_dump", name))
+        print "  lookup      {:>10.2f} usec/req".format(
+            measure(agent, "lookup", {"name": name["name"]}))
+        print "  list        {:>10.2f} usec/req".format(
+            measure(agent, "list", {"vertical": False}))
+        server.terminate()
+        server.join()
+    finally:
+        rmtree(home)
+
+
+if __name__ == "__main__":
+    main()
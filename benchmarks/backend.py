@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from sys import argv
+from time import time
+from random import sample
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from unlocker.database import Database
+from unlocker.keychain import Keychain
+
+from benchmarks.generator import open_holder, generate
+
+
+SIZES = (10**4, 10**5, 10**6)
+BACKENDS = ("gdbm", "sqlite", "log")
+SAMPLES = 1000
+OPERATIONS = ("insert", "lookup", "signature", "list")
+
+
+def run(backend, size, tmpdir):
+    """Benchmark keychain operations on a backend for a number of entries.
+
+    Args:
+        backend (str): Name of backend.
+        size    (int): Number of entries stored.
+        tmpdir  (str): Directory to create keychain in.
+
+    Returns:
+        dict: Total seconds of insert and microseconds per other operation.
+    """
+
+    holder = open_holder(backend, tmpdir, str(size))
+    started = time()
+    entries = generate(holder, size, key_ratio=0)  # keeps large files small
+    timings = {"insert": time() - started}
+    samples = sample(entries, SAMPLES)
+    names = [name for name, _, _, _ in samples]
+    signatures = [auth.signature() for _, auth, _, _ in samples]
+    database = Database(Keychain(holder, cache_size=0))  # cold reads
+    for operation, callback, keys in (
+            ("lookup", database.lookup, names),
+            ("signature", database.find_by_signature, signatures)):
+        started = time()
+        for key in keys:
+            callback(key)
+        timings[operation] = (time() - started) / len(keys) * 10**6
+    started = time()
+    sum(1 for _ in database.query_all())
+    timings["list"] = (time() - started) / size * 10**6
+    holder.close()
+    return timings
+
+
+def main():
+    """Print a table of timings for every backend and keychain size.
+
+    Sizes can be limited from command line, e.g. 10000 100000.
+    """
+
+    sizes = [int(each) for each in argv[1:]] or SIZES
+    print " ".join(["{:>8}".format("backend"), "{:>10}".format("entries")] +
+                   ["{:>10}".format(op) for op in OPERATIONS]) + \
+        "  (insert in sec, others usec/entry)"
+    tmpdir = mkdtemp()
+    try:
+        for size in sizes:
+            for backend in BACKENDS:
+                timings = run(backend, size, tmpdir)
+                print " ".join(
+                    ["{:>8}".format(backend), "{:>10}".format(size)] +
+                    ["{:>10.2f}".format(timings[op]) for op in OPERATIONS])
+    finally:
+        rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from os import environ, devnull, wait4, path
+from sys import argv, executable
+from time import time
+from tempfile import mkdtemp
+from shutil import rmtree
+from subprocess import Popen
+
+from unlocker.util.secret import Secret
+
+from benchmarks.generator import generate
+
+
+SIZES = (10**5,)
+
+# commands run on the generated keychain; listing reads every entry without
+# exporting it, as a reference for the export overhead
+COMMANDS = (("list", ["list", "--format=null"]),
+            ("export", ["migrate", "--export"]))
+
+
+def spawn(args, home):
+    """Run unlocker in a child process with its output discarded.
+
+    Args:
+        args (list): Command line arguments of unlocker.
+        home  (str): Home directory of child process.
+
+    Returns:
+        tuple: Seconds elapsed and peak resident memory of child (KiB).
+    """
+
+    env = dict(environ, HOME=home, NOPAGER="true")
+    env["PYTHONPATH"] = path.pathsep.join(
+        [each for each in (path.abspath("."), env.get("PYTHONPATH")) if each])
+    with open(devnull, "wb") as fd:
+        started = time()
+        proc = Popen([executable, "-m", "unlocker"] + args, stdout=fd,
+                     env=env)
+        _, status, usage = wait4(proc.pid, 0)
+        elapsed = time() - started
+    if status != 0:
+        raise SystemExit("Command {} failed".format(" ".join(args)))
+    return elapsed, usage.ru_maxrss
+
+
+def run(size, home):
+    """Generate a keychain and time commands reading all of it.
+
+    Args:
+        size (int): Number of entries.
+        home (str): Home directory to create keychain in.
+
+    Returns:
+        dict: Seconds elapsed and peak memory of each command.
+    """
+
+    environ["HOME"] = home
+    holder = Secret.get_secret_file()
+    generate(holder, size)
+    holder.close()
+    keychain = path.getsize(Secret.get_secret_path())
+    results = {"keychain": keychain >> 10}
+    for name, args in COMMANDS:
+        results[name] = spawn(args, home)
+    return results
+
+
+def main():
+    """Print time and peak memory of exporting generated keychains.
+
+    Sizes can be limited from command line, e.g. 1000 10000. The backend is
+    the configured one (see UNLOCKER_KEYCHAIN_BACKEND).
+    """
+
+    sizes = [int(each) for each in argv[1:]] or SIZES
+    print " ".join(["{:>10}".format("entries"), "{:>12}".format("keychain")] +
+                   ["{:>10} {:>10}".format(name, "peak")
+                    for name, _ in COMMANDS]) + "  (sec, KiB)"
+    old_home = environ.get("HOME")
+    for size in sizes:
+        home = mkdtemp()
+        try:
+            results = run(size, home)
+        finally:
+            environ["HOME"] = old_home
+            rmtree(home)
+        print " ".join(
+            ["{:>10}".format(size), "{:>12}".format(results["keychain"])] +
+            ["{:>10.2f} {:>10}".format(*results[name])
+             for name, _ in COMMANDS])
+
+
+if __name__ == "__main__":
+    main()
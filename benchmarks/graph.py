@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from sys import argv
+from time import time
+from random import Random
+
+from unlocker.util.graph import JumpGraph
+
+from benchmarks.generator import generate
+
+
+SIZES = (10**3, 10**4, 10**5)
+JUMP_RATIO = 0.3
+
+
+def build_rows(size, seed=42):
+    """Create list entries where a fraction of them bounce off others.
+
+    Args:
+        size (int): Number of entries.
+        seed (int): Random seed for reproducible graphs.
+
+    Returns:
+        list: Entries as (name, auth, host, jump) tuples.
+    """
+
+    rows = generate({}, size, jump_ratio=JUMP_RATIO, key_ratio=0, seed=seed)
+    Random(seed).shuffle(rows)
+    return rows
+
+
+def main():
+    """Print time to order entries for every size.
+
+    Sizes can be set from command line, e.g. 100000.
+    """
+
+    sizes = [int(each) for each in argv[1:]] or SIZES
+    for size in sizes:
+        rows = build_rows(size)
+        started = time()
+        ordered = JumpGraph(rows).order()
+        elapsed = time() - started
+        assert len(ordered) == size
+        print "{:>10} entries {:>10.3f} sec".format(size, elapsed)
+
+
+if __name__ == "__main__":
+    main()
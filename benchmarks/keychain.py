@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from sys import argv
+from time import time
+from random import sample
+
+from unlocker.database import Database
+from unlocker.keychain import Keychain
+
+from benchmarks.generator import generate
+
+
+SIZES = (10**3, 10**4, 10**5, 10**6)
+SAMPLES = 1000
+
+
+def build_keychain(size):
+    """Create a dict-backed keychain with a given number of entries.
+
+    Entries store passwords only, so that the largest keychains fit in
+    memory.
+
+    Args:
+        size (int): Number of entries to store.
+
+    Returns:
+        tuple: Keychain instance and record keys of sampled entries.
+    """
+
+    holder = {}
+    entries = generate(holder, size, key_ratio=0)
+    database = Database(Keychain(holder))
+    keys = [database.get_record_key(name)
+            for name, _, _, _ in sample(entries, SAMPLES)]
+    return Keychain(holder), keys
+
+
+def measure(callback, keys):
+    """Time a callback over a list of keys.
+
+    Args:
+        callback (callable): Keychain operation to run for each key.
+        keys         (list): Keys to pass to callback.
+
+    Returns:
+        float: Average time in microseconds per call.
+    """
+
+    started = time()
+    for key in keys:
+        callback(key)
+    return (time() - started) / len(keys) * 10**6
+
+
+def run(size):
+    """Benchmark exact-key and prefix operations for a keychain size.
+
+    Args:
+        size (int): Number of keys stored in keychain.
+
+    Returns:
+        dict: Average microseconds per operation.
+    """
+
+    keychain, keys = build_keychain(size)
+    new_keys = ["R!new{}".format(i) for i in xrange(SAMPLES)]
+    keychain.get_index()  # first prefix lookup builds index
+    return {
+        "has": measure(keychain.has, keys),
+        "get": measure(keychain.get, keys),
+        "add": measure(lambda k: keychain.add(k, "value"), new_keys),
+        "remove": measure(keychain.remove, new_keys),
+        "lookup": measure(lambda k: list(keychain.lookup(k[:-1])), keys),
+    }
+
+
+def main():
+    """Print a table of timings for every keychain size.
+
+    Sizes can be limited from command line, e.g. 1000 10000.
+    """
+
+    sizes = [int(each) for each in argv[1:]] or SIZES
+    operations = ("has", "get", "add", "remove", "lookup")
+    print " ".join(["{:>10}".format("keys")] +
+                   ["{:>10}".format(op) for op in operations]) + "  (usec/op)"
+    for size in sizes:
+        timings = run(size)
+        print " ".join(["{:>10}".format(size)] +
+                       ["{:>10.2f}".format(timings[op]) for op in operations])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import logging
+import sys
+
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from json import dump, load
+from os import environ
+from platform import python_version
+from random import Random
+from shutil import rmtree
+from StringIO import StringIO
+from tempfile import mkdtemp
+from time import time
+
+from unlocker.manager import Manager
+from unlocker.display import Display
+
+from unlocker.util.log import Log
+
+from benchmarks.generator import open_holder, generate, build_entry, \
+    build_password
+
+
+SIZES = (10**3, 10**4, 10**5)
+BACKENDS = ("dict", "gdbm")
+SAMPLES = 200
+THRESHOLD = 0.25
+
+# options timed for each sampled entry, and once for the whole keychain
+SAMPLED_OPTIONS = ("append", "lookup", "recall", "stdout_dump", "forget")
+WHOLE_OPTIONS = ("list", "export", "import")
+OPTIONS = SAMPLED_OPTIONS + WHOLE_OPTIONS
+
+# modules writing to or reading from standard streams
+STREAM_MODULES = ("unlocker.migrate",)
+
+
+@contextmanager
+def redirect(source=""):
+    """Capture output and provide input of options.
+
+    Args:
+        source (str): Content to read from stdin.
+
+    Yields:
+        StringIO: Captured stdout and display output.
+    """
+
+    target = StringIO()
+    streams = [sys] + [sys.modules[each] for each in STREAM_MODULES
+                       if each in sys.modules]
+    saved = [(each, each.stdin, each.stdout) for each in streams
+             if hasattr(each, "stdin") and hasattr(each, "stdout")]
+    for each, _, _ in saved:
+        each.stdin, each.stdout = StringIO(source), target
+    Display.output = target
+    try:
+        yield target
+    finally:
+        Display.output = None
+        for each, stdin, stdout in saved:
+            each.stdin, each.stdout = stdin, stdout
+
+
+@contextmanager
+def isolated_home(home):
+    """Run options with a home directory of their own.
+
+    Configuration, DNS cache, journal and agent socket of the user are not
+    used, so they don't change timings.
+
+    Args:
+        home (str): Temporary home directory.
+    """
+
+    old_home = environ.get("HOME")
+    environ["HOME"] = home
+    try:
+        yield
+    finally:
+        environ["HOME"] = old_home
+
+
+@contextmanager
+def quiet_log(level=logging.ERROR):
+    """Hide log messages below a level, so only the report is printed.
+
+    Warnings of options (e.g. progress of the seeded import) would otherwise
+    be mixed with the timings on the terminal.
+
+    Args:
+        level (int): Lowest logging level still shown.
+    """
+
+    logger = logging.getLogger()
+    old_level = logger.level
+    logger.setLevel(max(level, old_level))
+    try:
+        yield
+    finally:
+        logger.setLevel(old_level)
+
+
+def call(option, args, source=""):
+    """Run a manager option.
+
+    Args:
+        option (str): Manager option.
+        args  (dict): Arguments of option.
+        source (str): Content to read from stdin.
+
+    Returns:
+        str: Output of option.
+    """
+
+    with redirect(source) as target:
+        Manager(option, args).call()
+    return target.getvalue()
+
+
+def measure(option, samples):
+    """Time an option over a list of arguments.
+
+    Args:
+        option   (str): Manager option.
+        samples (list): Arguments of each call.
+
+    Returns:
+        float: Average seconds per call.
+    """
+
+    started = time()
+    for args in samples:
+        call(option, args)
+    return (time() - started) / len(samples)
+
+
+def close(holder):
+    """Close keychain storage, if it can be closed.
+
+    Args:
+        holder (object): Dict-like storage.
+    """
+
+    if hasattr(holder, "close"):
+        holder.close()
+
+
+def run(backend, size, tmpdir, samples=SAMPLES):
+    """Benchmark manager options on a generated keychain.
+
+    Options run with tmpdir as home directory, so files of the user (e.g.
+    configuration and DNS cache) are neither read nor written, and their
+    warnings are not logged.
+
+    Args:
+        backend (str): "dict" or a keychain backend name.
+        size    (int): Number of entries.
+        tmpdir  (str): Directory to create keychain files and home in.
+        samples (int): Number of entries sampled for each option.
+
+    Returns:
+        dict: Average seconds per call of each option, and seconds to
+              generate the keychain.
+    """
+
+    with isolated_home(tmpdir), quiet_log():
+        return run_options(backend, size, tmpdir, samples)
+
+
+def run_options(backend, size, tmpdir, samples):
+    """Benchmark manager options on a generated keychain (see run).
+
+    Args:
+        backend (str): "dict" or a keychain backend name.
+        size    (int): Number of entries.
+        tmpdir  (str): Directory to create keychain files in.
+        samples (int): Number of entries sampled for each option.
+
+    Returns:
+        dict: Average seconds per call of each option, and seconds to
+              generate the keychain.
+    """
+
+    holder = open_holder(backend, tmpdir, "bench_{}".format(size))
+    started = time()
+    entries = generate(holder, size)
+    timings = {"generate": time() - started}
+    Manager.initialize(holder)
+    random = Random(size)
+    picked = random.sample(entries, min(samples, size))
+    new_entries = [build_entry(random, size + i) for i in xrange(samples)]
+    timings["append"] = measure("append", [{
+        "host": host, "port": auth.get_port(), "user": auth.get_user(),
+        "auth": "password", "name": name, "scheme": auth.get_scheme(),
+        "passkey": build_password(random)}
+        for name, auth, host in new_entries])
+    timings["lookup"] = measure("lookup", [{"name": name}
+                                           for name, _, _, _ in picked])
+    timings["recall"] = measure("recall", [{"signature": auth.signature()}
+                                           for _, auth, _, _ in picked])
+    timings["stdout_dump"] = measure("stdout_dump", [
+        {"name": name, "signature": ""} for name, _, _, _ in picked])
+    timings["forget"] = measure("forget", [{"signature": name}
+                                           for name, _, _ in new_entries])
+    timings["list"] = measure("list", [{"vertical": False}])
+    started = time()
+    exported = call("migrate", {"export_secrets": []})
+    timings["export"] = time() - started
+    close(holder)
+    holder = open_holder(backend, tmpdir, "bench_{}_import".format(size))
+    Manager.initialize(holder)
+    started = time()
+    call("migrate", {"import_secrets": True}, exported)
+    timings["import"] = time() - started
+    close(holder)
+    return timings
+
+
+def compare(results, baseline, threshold):
+    """Find options slower than in a baseline run.
+
+    Args:
+        results  (dict): Results of this run.
+        baseline (dict): Results of a previous run.
+        threshold (float): Allowed slowdown (e.g. 0.25 for 25%).
+
+    Returns:
+        list: Description of each regression.
+    """
+
+    regressions = []
+    for backend, sizes in sorted(results.get("results").iteritems()):
+        for size, timings in sorted(sizes.iteritems()):
+            old = baseline.get("results", {}).get(backend, {}).get(size, {})
+            for option in OPTIONS:
+                if option not in timings or not old.get(option):
+                    continue
+                ratio = timings[option] / old[option]
+                if ratio > 1 + threshold:
+                    regressions.append("{} {} {}: {:.2f}x slower".format(
+                        backend, size, option, ratio))
+    return regressions
+
+
+def get_args():
+    """Parse command line arguments.
+
+    Returns:
+        Namespace: Parsed arguments.
+    """
+
+    psr = ArgumentParser(description="Time unlocker options on generated "
+                                     "keychains")
+    psr.add_argument("--sizes", type=int, nargs="+", default=SIZES,
+                     help="Numbers of entries (default: %(default)s)")
+    psr.add_argument("--backends", nargs="+", default=BACKENDS,
+                     help="Keychain backends, or dict for an in-memory "
+                          "keychain (default: %(default)s)")
+    psr.add_argument("--samples", type=int, default=SAMPLES,
+                     help="Entries sampled per option (default: %(default)s)")
+    psr.add_argument("--output", help="Write results as JSON to a file")
+    psr.add_argument("--baseline", help="Compare with results of a "
+                                        "previous run")
+    psr.add_argument("--threshold", type=float, default=THRESHOLD,
+                     help="Allowed slowdown against baseline "
+                          "(default: %(default)s)")
+    return psr.parse_args()
+
+
+def main():
+    """Print a table of timings, write them as JSON and check regressions.
+
+    Exits with an error if any option is slower than in the baseline run by
+    more than the threshold.
+    """
+
+    Log.configure()
+    args = get_args()
+    results = {"python": python_version(), "samples": args.samples,
+               "started": time(), "results": {}}
+    print " ".join(["{:>8}".format("backend"), "{:>8}".format("entries")] +
+                   ["{:>11}".format(op) for op in OPTIONS]) + "  (msec)"
+    tmpdir = mkdtemp()
+    try:
+        for backend in args.backends:
+            for size in args.sizes:
+                timings = run(backend, size, tmpdir, args.samples)
+                results["results"].setdefault(backend, {})[str(size)] = \
+                    timings
+                print " ".join(
+                    ["{:>8}".format(backend), "{:>8}".format(size)] +
+                    ["{:>11.3f}".format(timings[op] * 1000)
+                     for op in OPTIONS])
+    finally:
+        rmtree(tmpdir)
+    if args.output is not None:
+        with open(args.output, "w") as fd:
+            dump(results, fd, indent=2, sort_keys=True)
+    if args.baseline is None:
+        return
+    with open(args.baseline) as fd:
+        regressions = compare(results, load(fd), args.threshold)
+    for regression in regressions:
+        print "Regression: {}".format(regression)
+    if len(regressions) > 0:
+        raise SystemExit("{} regression(s) over {:.0%} threshold".format(
+            len(regressions), args.threshold))
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,7 @@ setup(name="unlocker",
     packages=[
         "unlocker",
         "unlocker.util",
+        "unlocker.backend",
         "unlocker.data",
     ],
     include_package_data=True,
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from unlocker.backend.base import Backend
+
+
+class MemoryBackend(Backend, dict):
+    """In-memory keychain storage counting every operation.
+
+    Used by tests to assert how many storage operations an operation
+    performs, independently of the counters kept by Keychain. It is not
+    persisted, so it is not shipped as a keychain backend.
+
+    Arguments:
+        operations (dict): Number of calls by operation name.
+
+    Args:
+        data (dict): Initial keys and stored values (optional).
+    """
+
+    OPERATIONS = ("contains", "gets", "puts", "deletes", "iterations",
+                  "syncs")
+
+    def __init__(self, data=None):
+        dict.__init__(self, data or {})
+        self.operations = dict.fromkeys(self.OPERATIONS, 0)
+
+    @classmethod
+    def open(cls, fullpath=None, mode=None):
+        """Create an empty storage.
+
+        Returns:
+            MemoryBackend: Empty storage.
+        """
+
+        return cls()
+
+    def __contains__(self, key):
+        self.operations["contains"] += 1
+        return dict.__contains__(self, key)
+
+    def __getitem__(self, key):
+        self.operations["gets"] += 1
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        self.operations["puts"] += 1
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self.operations["deletes"] += 1
+        dict.__delitem__(self, key)
+
+    def __iter__(self):
+        self.operations["iterations"] += 1
+        return dict.__iter__(self)
+
+    def iterkeys(self):
+        """Iterate over all stored keys (counted as a full iteration).
+
+        Returns:
+            iterator: Stored keys.
+        """
+
+        self.operations["iterations"] += 1
+        return dict.iterkeys(self)
+
+    def keys(self):
+        """All stored keys getter (counted as a full iteration).
+
+        Returns:
+            list: Stored keys.
+        """
+
+        self.operations["iterations"] += 1
+        return dict.keys(self)
+
+    def sync(self):
+        """Count a sync (nothing to persist).
+        """
+
+        self.operations["syncs"] += 1
+
+    def close(self):
+        """Nothing to close.
+        """
+
+    def reset(self):
+        """Reset operation counters.
+        """
+
+        self.operations = dict.fromkeys(self.OPERATIONS, 0)
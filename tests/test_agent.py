@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from unittest import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree
+from json import dumps, loads
+from os import environ
+
+from unlocker.agent import Agent
+from unlocker.authority import Authority
+from unlocker.database import Database
+from unlocker.keychain import Keychain
+
+from unlocker.util.secret import Secret
+
+
+class TestAgent(TestCase):
+
+    def setUp(self):
+        self.home, self.old_home = mkdtemp(), environ.get("HOME")
+        environ["HOME"] = self.home
+        self.add_entry("agent_test_1", ".password1")
+        self.agent = Agent(socket_path="{}/agent.sock".format(self.home))
+
+    def tearDown(self):
+        environ["HOME"] = self.old_home
+        rmtree(self.home)
+
+    def add_entry(self, name, passkey, host="localhost"):
+        secrets = Secret.get_secret_file()
+        auth = Authority.new("127.0.0.1", 22, "root", "ssh")
+        Database(Keychain(secrets)).add(name, passkey, auth, host)
+        secrets.close()
+
+    def dump(self, name):
+        request = {"option": "stdout_dump",
+                   "args": {"name": name, "signature": ""}}
+        return self.agent.handle(dumps(request))
+
+    def test_dump(self):
+        self.assertEqual(self.dump("agent_test_1"), "password\ncGFzc3dvcmQx")
+        self.assertEqual(self.agent.handle(dumps({
+            "option": "stdout_dump",
+            "args": {"stdin": "ssh://root@127.0.0.1:22"}
+        })), "password\ncGFzc3dvcmQx")
+
+    def test_reload(self):
+        self.assertEqual(self.dump("agent_test_1"), "password\ncGFzc3dvcmQx")
+        stamp = self.agent.stamp
+        self.add_entry("agent_test_2", ".password2")
+        self.assertEqual(self.dump("agent_test_2"), "password\ncGFzc3dvcmQy")
+        self.assertNotEqual(stamp, self.agent.stamp)
+
+    def test_list_formats(self):
+        self.add_entry("agent_test_2", ".password2")
+
+        def stream(fmt):
+            return self.agent.handle(dumps({
+                "option": "list", "args": {"format": fmt}
+            }))
+
+        tsv = stream("tsv").splitlines()
+        self.assertEqual(len(tsv), 2)
+        fields = tsv[1].split("\t")
+        self.assertEqual(fields[1:], ["~", "ssh", "127.0.0.1", "22",
+                                      "localhost", "root", "agent_test_2"])
+        records = [loads(each) for each in stream("jsonl").splitlines()]
+        self.assertEqual([each["name"] for each in records],
+                         ["agent_test_1", "agent_test_2"])
+        self.assertIsNone(records[0]["jump"])
+        self.assertEqual(records[0]["sig"], tsv[0].split("\t")[0])
+        self.assertEqual(stream("null"), "")
+
+    def test_list_without_host(self):
+        self.add_entry("agent_test_2", ".password2", host=None)
+        tsv = self.agent.handle(dumps({
+            "option": "list", "args": {"format": "tsv"}
+        })).splitlines()
+        self.assertEqual(tsv[1].split("\t")[5:], ["", "root",
+                                                  "agent_test_2"])
+        records = [loads(each) for each in self.agent.handle(dumps({
+            "option": "list", "args": {"format": "jsonl"}
+        })).splitlines()]
+        self.assertEqual(records[1]["host"], "")
+
+    def test_read_only(self):
+        with self.assertRaises(SystemExit):
+            self.agent.handle(dumps({"option": "remove", "args": {
+                "name": "agent_test_1"
+            }}))
+
+    def test_not_running(self):
+        self.assertIsNone(self.agent.request("list", {"vertical": False}))
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from unittest import TestCase
+from StringIO import StringIO
+from base64 import b64encode, b64decode
+from zipfile import ZipFile
+
+from unlocker.util.archive import Base64Writer, ZipStream, copy_base64
+
+
+class TestArchive(TestCase):
+
+    def test_base64(self):
+        content = "".join(chr(i % 256) for i in xrange(1000))
+        for size in (3, 12, 999, 3000):
+            target = StringIO()
+            encoder = Base64Writer(target, size)
+            for offset in xrange(0, len(content), 7):
+                encoder.write(content[offset:offset + 7])
+                self.assertLess(len(encoder.buffer), size + 7)
+            encoder.close()
+            self.assertEqual(target.getvalue(), b64encode(content))
+        with self.assertRaises(SystemExit):
+            Base64Writer(StringIO(), 4)
+
+    def test_copy_base64(self):
+        content = "".join(chr(i % 256) for i in xrange(1000))
+        encoded = b64encode(content)
+        wrapped = "\n".join([encoded[i:i + 76]
+                             for i in xrange(0, len(encoded), 76)])
+        for size in (1, 5, 64, 4096):
+            target = StringIO()
+            self.assertEqual(copy_base64(StringIO(wrapped), target, size),
+                             len(content))
+            self.assertEqual(target.getvalue(), content)
+        with self.assertRaises(SystemExit):
+            copy_base64(StringIO("abc"), StringIO())
+
+    def test_zip(self):
+        target = StringIO()
+        archive = ZipStream(Base64Writer(target, 6))
+        archive.start("list")
+        for i in xrange(100):
+            archive.write("line {}\n".format(i))
+        archive.writestr(u"key\u0103.pk", "secret")
+        archive.writestr("empty", "")
+        archive.close()
+        archive.target.close()
+        zf = ZipFile(StringIO(b64decode(target.getvalue())))
+        self.assertIsNone(zf.testzip())
+        self.assertEqual(zf.namelist(), ["list", u"key\u0103.pk", "empty"])
+        self.assertEqual(zf.read("list").splitlines()[-1], "line 99")
+        self.assertEqual(zf.read(u"key\u0103.pk"), "secret")
+        self.assertEqual(zf.read("empty"), "")
+
+    def test_zip64_count(self):
+        target = StringIO()
+        archive = ZipStream(target)
+        archive.MAX_COUNT = 2
+        for i in xrange(3):
+            archive.writestr("member{}".format(i), str(i))
+        archive.close()
+        zf = ZipFile(StringIO(target.getvalue()))
+        self.assertEqual(len(zf.namelist()), 3)
+        self.assertEqual(zf.read("member2"), "2")
@@ -23,6 +23,7 @@
 from unittest import TestCase
 from ipaddress import ip_address
 
+from unlocker import authority
 from unlocker.authority import Authority
 
 
@@ -86,3 +87,22 @@ class TestAuthority(TestCase):
     def test_signature(self):
         auth = Authority.new("127.0.0.1", 22, "root", "ssh")
         self.assertEqual(auth.signature(), self.localhost_signature)
+
+    def test_recover_without_resolver(self):
+        calls = []
+
+        def resolver(host):
+            calls.append(host)
+            return host
+
+        dump = "{}:22:root:ssh".format(self.localhost_as_int)
+        gethostbyname, authority.gethostbyname = \
+            authority.gethostbyname, resolver
+        try:
+            auth = Authority.recover(dump)
+        finally:
+            authority.gethostbyname = gethostbyname
+        self.assertEqual(calls, [])
+        self.assertEqual(auth.read(), dump)
+        self.assertEqual(auth.get_host_ip4(), u"127.0.0.1")
+        self.assertEqual(auth.signature(), self.localhost_signature)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from unittest import TestCase
+from zlib import compress
+from base64 import b64encode
+from tempfile import mkdtemp
+from shutil import rmtree
+from os import environ, path
+
+from unlocker.authority import Authority
+from unlocker.database import Database
+from unlocker.keychain import Keychain
+
+from unlocker.backend.base import get_backend
+from unlocker.backend.sqlite import SqliteBackend
+from unlocker.util.secret import Secret
+
+from tests.memory import MemoryBackend
+
+
+class TestSqliteBackend(TestCase):
+
+    def setUp(self):
+        self.home, self.old_home = mkdtemp(), environ.get("HOME")
+        environ["HOME"] = self.home
+        self.path = "{}/secrets.db".format(self.home)
+        self.backend = SqliteBackend.open(self.path, SqliteBackend.WRITER)
+        self.database = Database(Keychain(self.backend))
+
+    def tearDown(self):
+        self.backend.close()
+        environ["HOME"] = self.old_home
+        environ.pop("UNLOCKER_KEYCHAIN_BACKEND", None)
+        rmtree(self.home)
+
+    def add_entries(self, database):
+        auth = Authority.new("127.0.0.1", 22, "root", "ssh")
+        jump = Authority.new("127.0.0.1", 2222, "admin", "ssh")
+        database.add("backend_jump", ".password", jump, "localhost")
+        database.add("backend_test", ">private key", auth, "localhost", jump)
+        database.add_passkey("backend_legacy", ".password")
+        database.add_auth("backend_legacy", auth)
+        return auth, jump
+
+    def test_columns(self):
+        auth, jump = self.add_entries(self.database)
+        row = self.backend.conn.execute(
+            "SELECT signature, ip, port, user, scheme, host, jump_signature, "
+            "passkey FROM entries WHERE name = ?", ("backend_test",)).fetchone()
+        self.assertEqual(row[:7], (auth.signature(), 2130706433, 22, "root",
+                                   "ssh", "localhost", jump.signature()))
+        self.assertEqual(str(row[7]), ">private key")
+        self.assertEqual(self.backend.find_by_signature(auth.signature()),
+                         ["backend_test"])
+        self.assertTrue("A!backend_legacy" in self.backend)
+        self.assertFalse("R!backend_legacy" in self.backend)
+        _, host, secret = self.database.lookup("backend_test")
+        self.assertEqual((host, secret), ("localhost", ">private key"))
+
+    def test_prefix_queries(self):
+        _, jump = self.add_entries(self.database)
+        self.backend["R!broken"] = b64encode(compress("not a record"))
+        self.backend[u"h!\u0103_legacy"] = "localhost"
+        keys = self.backend.keys()
+        for prefix in ("", "R", "R!", "R!backend_t", "$!", "s!", "h!",
+                       "z!"):
+            self.assertEqual(sorted(self.backend.iterprefix(prefix)),
+                             sorted(k for k in keys if k.startswith(prefix)))
+        storage = Keychain(self.backend)
+        database = Database(storage)
+        self.assertEqual(database.find_dependents(jump.signature()),
+                         ["backend_test"])
+        self.assertEqual(database.find_by_signature(jump.signature()),
+                         ["backend_jump"])
+        metrics = storage.metrics()
+        self.assertEqual((metrics["scans"], metrics["queries"]), (0, 2))
+
+    def test_indexed_columns(self):
+        auth, jump = self.add_entries(self.database)
+        self.database.rebuild_indexes()
+        # records are indexed through columns only, legacy entries by keys
+        self.assertEqual([self.backend.layout.split_names(self.backend[k])
+                          for k in self.backend.iterprefix("s!")],
+                         [["backend_legacy"]])
+        self.assertEqual(list(self.backend.iterprefix("d!")), [])
+        storage = Keychain(self.backend)
+        database = Database(storage)
+        # legacy entry is found through index keys, record through columns
+        self.assertEqual(database.find_by_signature(auth.signature()),
+                         ["backend_legacy", "backend_test"])
+        self.assertEqual(database.find_dependents(jump.signature()),
+                         ["backend_test"])
+        plan = " ".join(str(row) for row in self.backend.conn.execute(
+            "EXPLAIN QUERY PLAN SELECT name FROM entries WHERE signature = ?",
+            (auth.signature(),)))
+        self.assertTrue("entries_signature" in plan)
+        with database.transaction():
+            database.remove("backend_test")
+            self.assertEqual(database.find_by_signature(auth.signature()),
+                             ["backend_legacy"])
+        self.assertEqual(database.find_dependents(jump.signature()), [])
+        self.assertEqual(storage.metrics()["queries"], 3)
+        # copies lack index keys of records, so they are not trusted
+        copy = Database(Keychain(dict((k, self.backend[k])
+                                      for k in self.backend.keys())))
+        self.assertFalse(copy.has_indexes())
+        self.assertEqual(copy.find_by_signature(auth.signature()),
+                         ["backend_legacy"])
+
+    def test_lossless(self):
+        holder = {}
+        self.add_entries(Database(Keychain(holder)))
+        holder["R!broken"] = b64encode(compress("not a record"))
+        holder["$!undecodable"] = "not base64"
+        for key, value in holder.iteritems():
+            self.backend[key] = value
+        self.backend.sync()
+        self.assertEqual(sorted(self.backend.keys()), sorted(holder))
+        self.assertEqual(len(self.backend), len(holder))
+        for key, value in holder.iteritems():
+            self.assertEqual(self.backend[key], value)
+        del self.backend["R!backend_test"]
+        del self.backend["$!backend_test"]
+        self.assertEqual(self.backend.conn.execute(
+            "SELECT COUNT(*) FROM entries WHERE name = ?",
+            ("backend_test",)).fetchone()[0], 0)
+        with self.assertRaises(KeyError):
+            self.backend["R!backend_test"]
+
+    def test_convert(self):
+        environ["UNLOCKER_KEYCHAIN_BACKEND"] = "gdbm"
+        holder = {}
+        database = Database(Keychain(holder))
+        with database.transaction():
+            auth, _ = self.add_entries(database)
+            database.ensure_indexes()
+        entries = dict((k, v) for k, v in holder.iteritems()
+                       if not k.startswith(("s!", "d!", "#!")))
+        self.assertEqual(Database(Keychain(MemoryBackend(holder)))
+                         .convert_backend("sqlite"), len(entries))
+        del environ["UNLOCKER_KEYCHAIN_BACKEND"]
+        self.assertEqual(Secret.get_backend_name(), "sqlite")
+        self.assertEqual(get_backend(Secret.get_backend_name()),
+                         SqliteBackend)
+        secrets = Secret.get_secret_file(read_only=True)
+        try:
+            self.assertEqual(dict((k, secrets[k]) for k in entries), entries)
+            storage = Keychain(secrets)
+            database = Database(storage)
+            self.assertTrue(database.has_indexes())
+            self.assertEqual(storage.get_stats(scan=False),
+                             storage.build_stats())
+            storage.reset_metrics()
+            self.assertEqual(database.find_by_signature(auth.signature()),
+                             ["backend_legacy", "backend_test"])
+            self.assertEqual(storage.metrics()["scans"], 0)
+            self.assertEqual(storage.metrics()["decodes"], 0)
+        finally:
+            secrets.close()
+
+    def test_convert_removes_old_keychain(self):
+        environ["UNLOCKER_KEYCHAIN_BACKEND"] = "sqlite"
+        secrets = Secret.get_secret_file()
+        self.add_entries(Database(Keychain(secrets)))
+        secrets.sync()
+        old_paths = [Secret.get_secret_path()] + Secret.get_sidecar_paths()
+        self.assertTrue(path.exists(old_paths[0]))
+        self.assertTrue(any(path.exists(each) for each in old_paths[1:]))
+        keys = secrets.keys()
+        self.assertEqual(Secret.convert_secrets(secrets, "log"), len(keys))
+        self.assertEqual([each for each in old_paths if path.exists(each)],
+                         [])
+        environ["UNLOCKER_KEYCHAIN_BACKEND"] = "log"
+        secrets = Secret.get_secret_file(read_only=True)
+        try:
+            self.assertEqual(sorted(secrets.keys()), sorted(keys))
+        finally:
+            secrets.close()
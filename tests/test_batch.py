@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from unittest import TestCase
+from tempfile import mkdtemp
+from StringIO import StringIO
+from shutil import rmtree
+from json import dumps, loads
+from os import environ
+
+from unlocker.batch import Batch
+from unlocker.database import Database
+from unlocker.keychain import Keychain
+
+from unlocker.util.secret import Secret
+
+
+class TestBatch(TestCase):
+
+    def setUp(self):
+        self.home, self.old_home = mkdtemp(), environ.get("HOME")
+        environ["HOME"] = self.home
+
+    def tearDown(self):
+        environ["HOME"] = self.old_home
+        rmtree(self.home)
+
+    def run_batch(self, commands, transaction=False):
+        source = StringIO("\n".join(dumps(each) for each in commands))
+        target = StringIO()
+        batch = Batch(transaction, source, target)
+        try:
+            batch.start()
+        except SystemExit:
+            pass
+        results = [loads(each) for each in target.getvalue().splitlines()]
+        return batch, results
+
+    def get_names(self):
+        secrets = Secret.get_secret_file()
+        try:
+            database = Database(Keychain(secrets))
+            return sorted(name for name, _, _, _ in database.query_all())
+        finally:
+            secrets.close()
+
+    def append(self, name, password):
+        return {"option": "append", "args": {
+            "name": name, "host": "127.0.0.1", "port": 22, "user": "root",
+            "auth": "password", "passkey": password}}
+
+    def test_batch(self):
+        batch, results = self.run_batch([
+            self.append("batch_test_1", "password1"),
+            {"option": "stdout_dump", "args": {
+                "name": "batch_test_1", "signature": ""}},
+            {"option": "remove", "args": {"name": "missing_name"}},
+            {"option": "migrate", "args": {}},
+        ])
+        self.assertEqual([r.get("ok") for r in results],
+                         [True, True, False, False])
+        self.assertEqual([r.get("line") for r in results], [1, 2, 3, 4])
+        self.assertEqual(results[1].get("output"),
+                         "password\ncGFzc3dvcmQx")
+        self.assertEqual((batch.total, batch.failures), (4, 2))
+        self.assertEqual(self.get_names(), ["batch_test_1"])
+
+    def test_missing_passkey(self):
+        command = self.append("batch_test_1", None)
+        del command["args"]["passkey"]
+        batch, results = self.run_batch([
+            command,
+            self.append("batch_test_2", "password2"),
+        ])
+        self.assertEqual([r.get("ok") for r in results], [False, True])
+        self.assertIn("Missing passkey", results[0].get("error"))
+        self.assertEqual(self.get_names(), ["batch_test_2"])
+
+    def test_transaction(self):
+        batch, results = self.run_batch([
+            self.append("batch_test_1", "password1"),
+            self.append("batch_test_2", "password2"),
+        ], transaction=True)
+        self.assertEqual(batch.failures, 0)
+        self.assertEqual(self.get_names(), ["batch_test_1", "batch_test_2"])
+        batch, results = self.run_batch([
+            {"option": "remove", "args": {"name": "batch_test_1"}},
+            self.append("batch_test_2", "password2"),
+            {"option": "remove", "args": {"name": "batch_test_2"}},
+        ], transaction=True)
+        self.assertEqual([r.get("ok") for r in results], [True, False])
+        self.assertEqual(self.get_names(), ["batch_test_1", "batch_test_2"])
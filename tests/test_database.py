@@ -21,13 +21,23 @@
 # THE SOFTWARE.
 
 from unittest import TestCase
+from StringIO import StringIO
+from tempfile import mkdtemp
+from shutil import rmtree
 
+from unlocker import authority
 from unlocker.database import Database
 from unlocker.keychain import Keychain
 from unlocker.authority import Authority
+from unlocker.display import Display
+from unlocker.manager import Manager
+
+from unlocker.backend.base import get_backend
 
 from unlocker.util.passkey import Passkey
 
+from tests.memory import MemoryBackend
+
 
 class TestService(TestCase):
 
@@ -129,3 +139,237 @@ class TestService(TestCase):
         with self.assertRaises(SystemExit) as context:
             self.database.fetch_host(self.test_key)
             self.assertTrue("Cannot fetch unexisting" in context.exception)
+
+    def test_add_record(self):
+        auth = Authority.new("127.0.0.1", 22, "root", "ssh")
+        jump = Authority.new("127.0.0.1", 2222, "root", "ssh")
+        self.database.add(self.test_key, ".password", auth, "localhost", jump)
+        self.assertTrue(self.database.storage.has("R!" + self.test_key))
+        self.assertFalse(self.database.storage.has("A!" + self.test_key))
+        self.assertEqual(self.database.fetch_host(self.test_key), "localhost")
+        self.assertEqual(self.database.fetch_jump(self.test_key).signature(),
+                         jump.signature())
+        name, auth_, host, jump_ = next(self.database.query_all())
+        self.assertEqual(name, self.test_key)
+        self.assertEqual(auth_.signature(), auth.signature())
+        self.assertEqual(jump_.signature(), jump.signature())
+        self.database.remove(self.test_key)
+        self.assertEqual(list(self.database.query_all()), [])
+
+    def test_convert(self):
+        auth = Authority.new("127.0.0.1", 22, "root", "ssh")
+        self.database.add_passkey(self.test_key, ".password")
+        self.database.add_auth(self.test_key, auth)
+        self.database.add_host(self.test_key, "localhost")
+        legacy = list(self.database.query_all())
+        self.assertEqual(self.database.convert_all(), 1)
+        self.assertFalse(self.database.storage.has("A!" + self.test_key))
+        self.assertFalse(self.database.storage.has("h!" + self.test_key))
+        converted = list(self.database.query_all())
+        self.assertEqual(len(converted), 1)
+        self.assertEqual(converted[0][0], legacy[0][0])
+        self.assertEqual(converted[0][1].read(), legacy[0][1].read())
+        self.assertEqual(converted[0][2], legacy[0][2])
+        _, _, secret = self.database.lookup(self.test_key)
+        self.assertEqual(secret, ".password")
+
+    def test_update_legacy_jump_auth(self):
+        auth = Authority.new("127.0.0.1", 22, "root", "ssh")
+        jump = Authority.new("127.0.0.1", 2222, "root", "ssh")
+        self.database.add_passkey(self.test_key, ".password")
+        self.database.add_auth(self.test_key, auth)
+        self.database.add_host(self.test_key, "localhost")
+        self.database.update_jump_auth(self.test_key, jump)
+        self.assertFalse(self.database.storage.has("A!" + self.test_key))
+        self.assertFalse(self.database.storage.has("h!" + self.test_key))
+        self.assertEqual(self.database.fetch_jump(self.test_key).read(),
+                         jump.read())
+        self.database.remove(self.test_key)
+        self.database.add(self.test_key, ".password", auth, "localhost")
+        self.assertTrue(self.database.exists(self.test_key))
+
+    def test_remove_leftover_legacy_keys(self):
+        auth = Authority.new("127.0.0.1", 22, "root", "ssh")
+        self.database.add(self.test_key, ".password", auth, "localhost")
+        self.database.storage.add("A!" + self.test_key, auth.read())
+        self.database.storage.add("h!" + self.test_key, "localhost")
+        self.database.remove(self.test_key)
+        self.assertFalse(self.database.storage.has("A!" + self.test_key))
+        self.assertFalse(self.database.storage.has("h!" + self.test_key))
+        self.database.add(self.test_key, ".password", auth, "localhost")
+
+    def test_query_all_without_resolver(self):
+        auth = Authority.new("127.0.0.1", 22, "root", "ssh")
+        jump = Authority.new("127.0.0.1", 2222, "root", "ssh")
+        self.database.add(self.test_key, ".password", auth, "localhost", jump)
+        self.database.add_passkey("legacy_key_123", ".password")
+        self.database.add_auth("legacy_key_123", auth)
+        self.database.add_jump("legacy_key_123", jump)
+        calls = []
+
+        def resolver(host):
+            calls.append(host)
+            return host
+
+        gethostbyname, authority.gethostbyname = \
+            authority.gethostbyname, resolver
+        try:
+            entries = list(self.database.query_all())
+            self.database.lookup(self.test_key)
+        finally:
+            authority.gethostbyname = gethostbyname
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(calls, [])
+
+    def test_find_by_signature(self):
+        auth = Authority.new("127.0.0.1", 22, "root", "ssh")
+        jump = Authority.new("127.0.0.1", 2222, "root", "ssh")
+        self.database.add(self.test_key, ".password", auth, "localhost")
+        self.database.add("other_key_123", ".password", auth, "localhost")
+        self.database.add("jump_key_123", ".password", jump, "localhost")
+        self.assertTrue(self.database.has_indexes())
+        self.assertEqual(sorted(self.database.find_by_signature(
+            auth.signature())), ["other_key_123", self.test_key])
+        self.database.remove("other_key_123")
+        self.assertEqual(self.database.find_by_signature(auth.signature()),
+                         [self.test_key])
+        self.assertEqual(self.database.find_by_signature("missing"), [])
+        self.assertEqual(self.database.verify_indexes(), [])
+
+    def test_rebuild_indexes(self):
+        auth = Authority.new("127.0.0.1", 22, "root", "ssh")
+        self.database.add_passkey(self.test_key, ".password")
+        self.database.add_auth(self.test_key, auth)
+        self.assertFalse(self.database.has_indexes())
+        self.assertEqual(self.database.find_by_signature(auth.signature()),
+                         [self.test_key])
+        self.assertEqual(len(self.database.verify_indexes()), 1)
+        self.assertEqual(self.database.rebuild_indexes(), 1)
+        self.assertEqual(self.database.verify_indexes(), [])
+        self.database.storage.remove("s!{}".format(auth.signature()))
+        self.assertEqual(len(self.database.verify_indexes()), 1)
+        self.database.remove(self.test_key)
+        self.assertEqual(self.database.find_by_signature(auth.signature()),
+                         [])
+
+    def test_find_dependents(self):
+        root = Authority.new("127.0.0.1", 22, "root", "ssh")
+        middle = Authority.new("127.0.0.1", 2222, "root", "ssh")
+        leaf = Authority.new("127.0.0.1", 2223, "root", "ssh")
+        self.database.add("root_key_123", ".password", root, "localhost")
+        self.database.add("middle_key_123", ".password", middle, "localhost",
+                          root)
+        self.database.add("leaf_key_123", ".password", leaf, "localhost",
+                          middle)
+        self.assertEqual(self.database.find_dependents(root.signature()),
+                         ["middle_key_123"])
+        walk = [(depth, name, cycle) for depth, name, _, cycle
+                in self.database.walk_dependents("root_key_123")]
+        self.assertEqual(walk, [(1, "middle_key_123", False),
+                                (2, "leaf_key_123", False)])
+        self.database.update_jump_auth("leaf_key_123", root)
+        self.assertEqual(self.database.find_dependents(middle.signature()),
+                         [])
+        self.assertEqual(sorted(self.database.find_dependents(
+            root.signature())), ["leaf_key_123", "middle_key_123"])
+        self.database.remove("leaf_key_123")
+        self.assertEqual(self.database.find_dependents(root.signature()),
+                         ["middle_key_123"])
+        self.assertEqual(self.database.verify_indexes(), [])
+
+    def test_decode_once(self):
+        auth = Authority.new("127.0.0.1", 22, "root", "ssh")
+        jump = Authority.new("127.0.0.1", 2222, "root", "ssh")
+        self.database.add(self.test_key, ".password", auth, "localhost", jump)
+        storage = Keychain(holder=self.database.storage.keychain)
+        database = Database(storage=storage)
+        for _ in xrange(3):
+            list(database.query_all())
+            database.lookup(self.test_key)
+        self.assertEqual(storage.misses, 2)  # record and passkey
+
+    def test_add_transaction(self):
+        auth = Authority.new("127.0.0.1", 22, "root", "ssh")
+        self.database.add(self.test_key, ".password", auth, "localhost")
+        keys = dict(self.database.storage.keychain)
+        with self.assertRaises(SystemExit):
+            with self.database.transaction():
+                self.database.add("other_key_123", ".password", auth, "host")
+                self.database.add(self.test_key, ".password", auth, "host")
+        self.assertEqual(self.database.storage.keychain, keys)
+        self.assertEqual(self.database.find_by_signature(auth.signature()),
+                         [self.test_key])
+
+    def test_operation_budgets(self):
+        holder = MemoryBackend()
+        self.check_operation_budgets(holder)
+        storage = Keychain(holder)
+        database = Database(storage)
+        self.assertEqual(len(list(database.query_all())), 50)
+        self.assertEqual(storage.metrics()["scans"], 1)
+        self.assertEqual(storage.metrics()["keys_iterated"], len(holder))
+
+    def test_operation_budgets_backends(self):
+        tmpdir = mkdtemp()
+        try:
+            for name in ("log", "gdbm"):
+                backend = get_backend(name)
+                try:
+                    holder = backend.open("{}/{}".format(
+                        tmpdir, backend.SECRETS_FILE), backend.WRITER)
+                except SystemExit:
+                    continue  # backend dependency is not installed
+                try:
+                    self.check_operation_budgets(holder)
+                finally:
+                    holder.close()
+        finally:
+            rmtree(tmpdir)
+
+    def check_operation_budgets(self, holder):
+        database = Database(Keychain(holder))
+        jump = Authority.new("127.0.0.1", 2222, "root", "ssh")
+        database.add("budget_jump_1", ".password", jump, "localhost")
+        for i in xrange(50):
+            auth = Authority.new("127.0.0.1", 3000 + i, "root", "ssh")
+            database.add("budget_key_{:03d}".format(i), ".password", auth,
+                         "localhost", jump if i % 2 else None)
+        storage = Keychain(holder)
+        database = Database(storage)
+        database.lookup("budget_key_007")
+        metrics = storage.metrics()
+        self.assertLessEqual(metrics["gets"], 3)
+        self.assertEqual(metrics["scans"], 0)
+        auth = database.fetch_auth("budget_key_007")
+        storage.reset_metrics()
+        self.assertEqual(database.find_by_signature(auth.signature()),
+                         ["budget_key_007"])
+        self.assertEqual(database.find_dependents(jump.signature())[:1],
+                         ["budget_key_001"])
+        # each index is a single key, so no backend scans its keys
+        self.assertEqual(storage.metrics()["scans"], 0)
+        self.assertLessEqual(storage.metrics()["gets"], 3)
+        storage.reset_metrics()
+        self.assertEqual(len(database.find_dependents(jump.signature())), 25)
+        self.assertEqual(storage.metrics()["scans"], 0)
+        with database.transaction():
+            database.remove("budget_key_007")
+        metrics = storage.metrics()
+        self.assertEqual(metrics["scans"], 0)
+        # record, passkey, signature and dependency indexes, statistics
+        self.assertLessEqual(metrics["puts"] + metrics["deletes"], 5)
+        storage.reset_metrics()
+        with database.transaction():
+            database.add("budget_key_007", ".password", auth, "localhost",
+                         jump)
+        # a dependent more writes the same keys, however many there are
+        self.assertLessEqual(storage.metrics()["puts"], 5)
+        # removing checks dependents first, without scanning keys either
+        storage = Manager.initialize(holder)
+        Display.output = StringIO()
+        try:
+            Manager("remove", {"name": "budget_key_008"}).call()
+        finally:
+            Display.output = None
+        self.assertFalse(Manager("", {}).get_db().exists("budget_key_008"))
+        self.assertEqual(storage.metrics()["scans"], 0)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from unittest import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree
+from os import environ, stat, path, listdir
+from threading import Thread
+
+from unlocker import authority
+from unlocker.authority import Authority
+from unlocker.util.dnscache import DnsCache
+from unlocker.util.resolver import Resolver
+
+
+class CountingLookup(object):
+
+    def __init__(self):
+        self.calls = []
+        self.address = "10.0.0.1"
+
+    def __call__(self, host):
+        self.calls.append(host)
+        if host.startswith("missing"):
+            raise IOError("Name or service not known")
+        return self.address
+
+
+class TestDnsCache(TestCase):
+
+    def setUp(self):
+        self.home, self.old_home = mkdtemp(), environ.get("HOME")
+        environ["HOME"] = self.home
+        self.filepath = path.join(self.home, "dns-cache")
+        self.lookup = CountingLookup()
+
+    def tearDown(self):
+        environ["HOME"] = self.old_home
+        rmtree(self.home)
+
+    def age(self, cache, host, seconds):
+        address, stamp, negative = cache.entries[host]
+        cache.entries[host] = (address, stamp - seconds, negative)
+
+    def test_hits(self):
+        cache = DnsCache(self.filepath)
+        self.assertEqual(cache.resolve("host", self.lookup), "10.0.0.1")
+        writes, cache.write = [], lambda: writes.append(1)
+        self.assertEqual(cache.resolve("host", self.lookup), "10.0.0.1")
+        self.assertEqual(writes, [])
+        self.assertEqual(self.lookup.calls, ["host"])
+        stats = cache.get_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["hit_rate"], 50.0)
+
+    def test_ttl(self):
+        cache = DnsCache(self.filepath, ttl=10)
+        cache.resolve("host", self.lookup)
+        self.age(cache, "host", 11)
+        self.assertEqual(cache.get_stats()["expired"], 1)
+        self.lookup.address = "10.0.0.2"
+        self.assertEqual(cache.resolve("host", self.lookup), "10.0.0.2")
+        self.assertEqual(len(self.lookup.calls), 2)
+
+    def test_negative(self):
+        cache = DnsCache(self.filepath, negative_ttl=5)
+        for _ in xrange(2):
+            with self.assertRaises(IOError):
+                cache.resolve("missing", self.lookup)
+        self.assertEqual(self.lookup.calls, ["missing"])
+        self.assertEqual(cache.get_stats()["negative"], 1)
+        self.age(cache, "missing", 6)
+        with self.assertRaises(IOError):
+            cache.resolve("missing", self.lookup)
+        self.assertEqual(len(self.lookup.calls), 2)
+
+    def test_eviction(self):
+        cache = DnsCache(self.filepath, size=3)
+        for i in xrange(5):
+            cache.put("host{}".format(i), "10.0.0.{}".format(i))
+            self.age(cache, "host{}".format(i), 5 - i)
+            cache.changed.update(cache.entries)
+        cache.save()
+        self.assertEqual(sorted(cache.entries),
+                         ["host2", "host3", "host4"])
+
+    def test_persistence(self):
+        cache = DnsCache(self.filepath)
+        cache.resolve("host", self.lookup)
+        cache.resolve("host", self.lookup)
+        self.assertEqual(stat(self.filepath).st_mode & 0777, 0600)
+        with open(self.filepath, "ab") as fd:
+            fd.write("malformed line\n")
+        other = DnsCache(self.filepath)
+        self.assertEqual((other.hits, other.misses), (0, 1))
+        other.put("other", "10.0.0.9")
+        other.save()
+        cache.put("third", "10.0.0.3")
+        cache.save()  # hit counted by first cache is saved with its answer
+        cache = DnsCache(self.filepath)
+        self.assertEqual(sorted(cache.entries), ["host", "other", "third"])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(cache.resolve("host", self.lookup), "10.0.0.1")
+        mtime = stat(self.filepath).st_mtime
+        cache.save()  # only a hit counted, nothing written
+        self.assertEqual(stat(self.filepath).st_mtime, mtime)
+        self.assertEqual(DnsCache(self.filepath).hits, 1)
+        self.assertEqual(cache.flush(), 3)
+        self.assertEqual(DnsCache(self.filepath).get_stats()["entries"], 0)
+        self.assertEqual(sorted(listdir(self.home)),
+                         ["dns-cache", "dns-cache.lock"])
+
+    def test_concurrent_saves(self):
+        caches = [DnsCache(self.filepath) for _ in xrange(8)]
+        for i, cache in enumerate(caches):
+            cache.put("host{}".format(i), "10.0.0.{}".format(i))
+        threads = [Thread(target=cache.save) for cache in caches]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        cache = DnsCache(self.filepath)
+        self.assertEqual(sorted(cache.entries),
+                         ["host{}".format(i) for i in xrange(8)])
+
+    def test_set_host(self):
+        gethostbyname, authority.gethostbyname = \
+            authority.gethostbyname, self.lookup
+        try:
+            first = Authority.new("example.test", 22, "root", "ssh")
+            second = Authority.new("example.test", 22, "root", "ssh")
+            Authority.new("10.1.1.1", 22, "root", "ssh")
+        finally:
+            authority.gethostbyname = gethostbyname
+        self.assertEqual(self.lookup.calls, ["example.test"])
+        self.assertEqual(first.get_host_ip4(), second.get_host_ip4())
+        self.assertEqual(DnsCache.get_instance().get_stats()["entries"], 1)
+
+    def test_resolver(self):
+        cache = DnsCache(self.filepath)
+        cache.put("host1", "10.1.1.1")
+        resolver = Resolver(lookup=self.lookup, cache=cache)
+        answers = resolver.resolve_all(["host1", "host2", "missing"])
+        self.assertEqual(answers, {"host1": "10.1.1.1", "host2": "10.0.0.1",
+                                   "missing": None})
+        self.assertEqual(sorted(self.lookup.calls), ["host2", "missing"])
+        self.assertEqual(DnsCache(self.filepath).get_stats()["entries"], 3)
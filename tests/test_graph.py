@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from unittest import TestCase
+
+from unlocker.authority import Authority
+
+from unlocker.util.graph import JumpGraph
+
+
+class TestJumpGraph(TestCase):
+
+    def setUp(self):
+        self.auths = [Authority.load(2130706433 + i, 22, "root", "ssh")
+                      for i in xrange(6)]
+
+    def row(self, index, jump=None):
+        jump_auth = self.auths[jump] if jump is not None else None
+        return "name{}".format(index), self.auths[index], "host", jump_auth
+
+    def names(self, rows):
+        return [name for name, _, _, _ in rows]
+
+    def test_order(self):
+        rows = [self.row(3, 1), self.row(0), self.row(2, 1), self.row(1, 0),
+                self.row(4)]
+        graph = JumpGraph(rows)
+        self.assertEqual(self.names(graph.order()),
+                         ["name0", "name1", "name3", "name2", "name4"])
+        self.assertEqual(graph.get_dangling_names(), [])
+        self.assertEqual(graph.get_cycles_names(), [])
+
+    def test_dangling(self):
+        rows = [self.row(1, 5), self.row(0), self.row(2, 1)]
+        graph = JumpGraph(rows)
+        self.assertEqual(self.names(graph.order()), ["name1", "name2", "name0"])
+        self.assertEqual(graph.get_dangling_names(), ["name1"])
+
+    def test_cycles(self):
+        rows = [self.row(0), self.row(1, 2), self.row(2, 1), self.row(3, 2),
+                self.row(4, 4)]
+        graph = JumpGraph(rows)
+        ordered = self.names(graph.order())
+        self.assertEqual(len(ordered), len(rows))
+        self.assertEqual(set(ordered), set(self.names(rows)))
+        self.assertEqual(ordered[0], "name0")
+        cycles = sorted(sorted(each) for each in graph.get_cycles_names())
+        self.assertEqual(cycles, [["name1", "name2"], ["name4"]])
+
+    def test_deep_chain(self):
+        auths = [Authority.load(i + 1, 22, "root", "ssh") for i in xrange(5000)]
+        rows = [("name{}".format(i), auths[i], "host",
+                 auths[i - 1] if i > 0 else None) for i in xrange(5000)]
+        graph = JumpGraph(reversed(rows))
+        self.assertEqual(self.names(graph.order()), self.names(rows))
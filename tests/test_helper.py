@@ -21,13 +21,53 @@
 # THE SOFTWARE.
 
 from unittest import TestCase
+from subprocess import Popen, PIPE
+from re import findall, M
 
 from unlocker.util.helper import read_helper_script
 
 
+RECORDS = "\n".join("\t".join(each) for each in (
+    ("17fdca41", "~", "ssh", "10.0.0.5", "22", "example.com", "root",
+     "server_one"),
+    ("9723f743", "~", "ssh", "10.0.0.6", "2222", "other.com", "admin",
+     "server_two"),
+    ("5a1b2c3d", "~", "mysql", "10.0.0.5", "3306", "example.com", "root",
+     "server_db"),
+))
+
+
+def run_function(script, name, *args):
+    start = script.index("\n{}() {{\n".format(name)) + 1
+    end = script.index("\n}\n", start) + 3
+    setup = "\n".join(findall(r"^(?:POS_\w+|TAB)=.*$", script, M))
+    code = "{}\nUNLOCKER_LIST=\"$1\"\nshift\n{}{} \"$@\"".format(
+        setup, script[start:end], name)
+    proc = Popen(["sh", "-c", code, "sh", RECORDS] + list(args),
+                 stdout=PIPE)
+    return [line.split("\t")[-1] for line in
+            proc.communicate()[0].splitlines()]
+
+
 class TestHelper(TestCase):
 
     def test_read_scripts(self):
         with self.assertRaises(SystemExit) as context:
             read_helper_script("unlocker/data/unlocka")
             self.assertTrue("Cannot find helper script" in context.exception)
+
+    def test_find_records(self):
+        script = read_helper_script("data/shell/unlock.sh")
+        self.assertEqual(run_function(script, "find_records", "ssh",
+                                      "10.0.0.5"), ["server_one"])
+        self.assertEqual(run_function(script, "find_records", "ssh",
+                                      "example.com", "root"), ["server_one"])
+        self.assertEqual(run_function(script, "find_records", "ssh",
+                                      "10.0.0.6", "", "2222"), ["server_two"])
+        self.assertEqual(run_function(script, "find_records", "mysql",
+                                      "10.0.0.5", "root", "3306"),
+                         ["server_db"])
+        self.assertEqual(run_function(script, "find_records", "ssh",
+                                      "10.0.0.5", "admin"), [])
+        self.assertEqual(run_function(script, "find_records", "ssh",
+                                      "10.0.0"), [])
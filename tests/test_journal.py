@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from unittest import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from unlocker.keychain import Keychain
+
+from unlocker.util.journal import Journal
+
+
+class CrashingHolder(dict):
+
+    def __setitem__(self, key, value):
+        if key == "crash":
+            raise IOError("Disk is gone")
+        dict.__setitem__(self, key, value)
+
+
+class TestJournal(TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.journal = Journal("{}/journal".format(self.tmpdir))
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def test_replay(self):
+        self.journal.write({"key1": "val1", u"key\u0103": "val2", "old": None})
+        holder = {"old": "value"}
+        self.assertEqual(self.journal.replay(holder), 3)
+        self.assertEqual(holder, {"key1": "val1", "key\xc4\x83": "val2"})
+        self.assertFalse(self.journal.exists())
+        self.assertEqual(self.journal.replay(holder), 0)
+
+    def test_incomplete(self):
+        self.journal.write({"key1": "val1", "key2": "val2"})
+        with open(self.journal.journal_path, "rb") as fd:
+            content = fd.read()
+        with open(self.journal.journal_path, "wb") as fd:
+            fd.write(content[:content.index("END")])
+        holder = {}
+        self.assertEqual(self.journal.replay(holder), 0)
+        self.assertEqual(holder, {})
+        self.assertFalse(self.journal.exists())
+
+    def test_crash_during_commit(self):
+        holder = CrashingHolder()
+        keychain = Keychain(holder, journal=self.journal)
+        with self.assertRaises(IOError):
+            with keychain.batch():
+                keychain.update("a", "val1")
+                keychain.update("crash", "val2")
+                keychain.update("z", "val3")
+        self.assertTrue(self.journal.exists())
+        recovered = {}
+        self.assertEqual(self.journal.replay(recovered), 3)
+        keychain = Keychain(recovered)
+        self.assertEqual([keychain.get_value(k) for k in ("a", "crash", "z")],
+                         ["val1", "val2", "val3"])
@@ -62,7 +62,8 @@ class TestKeychain(TestCase):
         self.keychain.update("key1", "val1")
         self.assertNotEqual(self.keychain.get("key1"), "val1")
         self.assertEqual(self.keychain.get_value("key1"), "val1")
-        self.assertEqual(self.keychain.get("key1"), b64encode(compress("val1")))
+        self.assertEqual(self.keychain.get("key1"),
+                         "4:" + b64encode(compress("val1")))
 
     def test_generator(self):
         for i in xrange(10):
@@ -74,3 +75,103 @@ class TestKeychain(TestCase):
             self.assertTrue(i.startswith("secret"))
             counter += 1
         self.assertEqual(counter, 3)
+
+    def test_lookup_index(self):
+        for key in ("b!one", "a!one", "b!two", "c!one"):
+            self.keychain.update(key, "value")
+        self.assertEqual(list(self.keychain.lookup("b!")), ["b!one", "b!two"])
+        self.keychain.update("b!three", "value")
+        self.keychain.remove("b!one")
+        self.assertEqual(list(self.keychain.lookup("b!")), ["b!three", "b!two"])
+        self.assertEqual(list(self.keychain.lookup("b!two", False)), ["b!two"])
+        self.assertEqual(list(self.keychain.lookup("b!", False)), [])
+        self.assertEqual(self.keychain.get_index(), sorted(self.keychain.keychain))
+
+    def test_transaction(self):
+        self.keychain.update("key1", "val1")
+        self.keychain.begin()
+        self.keychain.update("key2", "val2")
+        self.keychain.remove("key1")
+        self.assertFalse(self.keychain.has("key1"))
+        self.assertEqual(list(self.keychain.lookup("key")), ["key2"])
+        self.assertEqual(self.keychain.keychain.keys(), ["key1"])
+        self.assertEqual(self.keychain.rollback(), 2)
+        self.assertEqual(list(self.keychain.lookup("key")), ["key1"])
+        self.keychain.begin()
+        self.keychain.update("key2", "val2")
+        self.keychain.remove("key1")
+        self.assertEqual(self.keychain.commit(), 2)
+        self.assertEqual(self.keychain.keychain.keys(), ["key2"])
+        self.assertEqual(self.keychain.get_value("key2"), "val2")
+
+    def test_cache(self):
+        keychain = Keychain(holder={}, cache_size=2)
+        for i in xrange(3):
+            keychain.update("key{}".format(i), "val{}".format(i))
+        self.assertEqual(keychain.get_value("key0"), "val0")
+        self.assertEqual(keychain.get_value("key0"), "val0")
+        self.assertEqual((keychain.hits, keychain.misses), (1, 1))
+        keychain.update("key0", "new0")
+        self.assertEqual(keychain.get_value("key0"), "new0")
+        keychain.get_value("key1")
+        keychain.get_value("key2")  # evicts key0
+        self.assertEqual(list(keychain.cache), ["key1", "key2"])
+        keychain.remove("key1")
+        self.assertIsNone(keychain.read("key1"))
+        self.assertEqual(keychain.cache_info(), {
+            "hits": 1, "misses": 4, "size": 1, "max_size": 2})
+        keychain = Keychain(holder={"key": keychain.get("key2")},
+                            cache_size=0)
+        keychain.get_value("key")
+        keychain.get_value("key")
+        self.assertEqual((keychain.hits, keychain.misses), (0, 2))
+
+    def test_batch(self):
+        with self.keychain.batch():
+            self.keychain.update("key1", "val1")
+            with self.keychain.batch():
+                self.keychain.update("key2", "val2")
+            self.assertEqual(self.keychain.keychain, {})
+        self.assertEqual(sorted(self.keychain.keychain), ["key1", "key2"])
+        with self.assertRaises(SystemExit):
+            with self.keychain.batch():
+                self.keychain.remove("key1")
+                self.keychain.add("key2", "val3")
+        self.assertEqual(sorted(self.keychain.keychain), ["key1", "key2"])
+        self.assertEqual(self.keychain.get_value("key2"), "val2")
+
+    def test_older_values(self):
+        holder = {"$!old": b64encode(compress("secret"))}
+        keychain = Keychain(holder)
+        self.assertEqual(keychain.get_value("$!old"), "secret")
+        self.assertEqual(keychain.raw_size(holder["$!old"]), 6)
+        keychain.update("$!old", "new secret")
+        self.assertEqual(holder["$!old"],
+                         "10:" + b64encode(compress("new secret")))
+
+    def test_stats(self):
+        holder = {"?": "0.0.0", "$!old": b64encode(compress("secret"))}
+        keychain = Keychain(holder)
+        keychain.track_stats("#!stats")
+        self.assertEqual(keychain.get_stats(scan=False), None)
+        keychain.update("A!key1", "value1")  # missing stats are built first
+        self.assertEqual(keychain.get_stats(scan=False),
+                         {"$": [1, 5, 6, len(holder["$!old"])],
+                          "A": [1, 6, 6, len(holder["A!key1"])]})
+        self.assertEqual(keychain.store_stats(), keychain.build_stats())
+        keychain.reset_metrics()
+        keychain.update("A!key1", "longer value")
+        self.assertEqual(keychain.metrics()["decodes"], 0)
+        with keychain.batch():
+            keychain.update("$!key2", "passkey")
+            keychain.remove("$!old")
+        keychain.begin()
+        keychain.update("h!dropped", "host")
+        keychain.rollback()
+        reloaded = Keychain(holder)
+        reloaded.track_stats("#!stats")
+        self.assertEqual(reloaded.get_stats(scan=False),
+                         reloaded.build_stats())
+        self.assertEqual(reloaded.get_stats()["A"][2], len("longer value"))
+        self.assertEqual(sorted(reloaded.get_stats()), ["$", "A"])
+        self.assertEqual(repr(reloaded), "[2 key(s) stored]")
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from unittest import TestCase
+import logging
+
+from unlocker.util.log import Log
+
+
+class Formatted(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def __str__(self):
+        self.calls += 1
+        return "formatted"
+
+
+class TestLog(TestCase):
+
+    def setUp(self):
+        self.logger = logging.getLogger()
+        self.level = self.logger.level
+        Log.spans.clear()
+
+    def tearDown(self):
+        self.logger.setLevel(self.level)
+        Log.spans.clear()
+
+    def test_lazy_format(self):
+        value = Formatted()
+        self.logger.setLevel(logging.WARNING)
+        Log.debug("Skipped {v}", v=value)
+        Log.info("Skipped {v}", v=value)
+        self.assertEqual(value.calls, 0)
+        self.logger.setLevel(logging.DEBUG)
+        Log.debug("Logged {v}", v=value)
+        self.assertEqual(value.calls, 1)
+
+    def test_span(self):
+        self.logger.setLevel(logging.WARNING)
+        with Log.span("disabled"):
+            pass
+        self.assertEqual(len(Log.spans), 0)
+        self.logger.setLevel(logging.DEBUG)
+        for _ in xrange(3):
+            with Log.span("enabled"):
+                pass
+        with self.assertRaises(KeyError):
+            with Log.span("failed"):
+                raise KeyError("still recorded")
+        self.assertEqual(list(Log.spans), ["enabled", "failed"])
+        self.assertEqual(Log.spans["enabled"][0], 3)
+        Log.report_spans()
+        self.assertEqual(len(Log.spans), 0)
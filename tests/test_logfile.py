@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from unittest import TestCase
+from random import Random
+from tempfile import mkdtemp
+from shutil import rmtree
+from os import path
+
+from unlocker.authority import Authority
+from unlocker.database import Database
+from unlocker.keychain import Keychain
+
+from unlocker.backend.logfile import LogBackend
+
+
+class TestLogBackend(TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.path = "{}/secrets.log".format(self.tmpdir)
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def open(self, mode=LogBackend.WRITER):
+        return LogBackend.open(self.path, mode)
+
+    def test_roundtrip(self):
+        backend = self.open()
+        database = Database(Keychain(backend))
+        auth = Authority.new("127.0.0.1", 22, "root", "ssh")
+        database.add("log_test", ".password", auth, "localhost")
+        backend.close()
+        backend = self.open(LogBackend.READER)
+        _, host, secret = Database(Keychain(backend)).lookup("log_test")
+        self.assertEqual((host, secret), ("localhost", ".password"))
+        with self.assertRaises(IOError):
+            backend["other"] = "value"
+        with self.assertRaises(IOError):
+            self.open()  # writer waits for reader
+        backend.close()
+
+    def test_sidecar_index(self):
+        backend = self.open()
+        for i in xrange(100):
+            backend["key{}".format(i)] = "value{}".format(i)
+        backend.sync()
+        backend["late"] = "appended after index"
+        del backend["key0"]
+        backend.fd.flush()
+        self.assertTrue(backend.dirty)
+        backend.release()  # crash: index does not cover last records
+        backend = self.open(LogBackend.READER)
+        self.assertEqual(len(backend), 100)
+        self.assertEqual(backend["late"], "appended after index")
+        self.assertFalse("key0" in backend)
+        self.assertEqual(backend["key99"], "value99")
+        backend.close()
+        with open(backend.get_index_path(), "r+b") as fd:
+            fd.seek(30)
+            fd.write("garbage")  # damaged index is rebuilt from log
+        backend = self.open(LogBackend.READER)
+        self.assertEqual(sorted(backend.keys()),
+                         sorted(["late"] + ["key{}".format(i)
+                                            for i in xrange(1, 100)]))
+        backend.close()
+
+    def test_compact(self):
+        backend = self.open()
+        for i in xrange(50):
+            backend["key{}".format(i % 10)] = "value{}".format(i)
+        del backend["key9"]
+        size, garbage = backend.stats()
+        reclaimed = backend.compact()
+        self.assertEqual(reclaimed, garbage)
+        self.assertEqual(backend.stats(), (size - garbage, 0))
+        self.assertEqual(path.getsize(self.path), size - garbage)
+        backend["key0"] = "after compact"
+        backend.close()
+        backend = self.open(LogBackend.READER)
+        self.assertEqual(len(backend), 9)
+        self.assertEqual(backend["key0"], "after compact")
+        self.assertEqual(backend["key8"], "value48")
+        backend.close()
+
+    def test_truncated_log(self):
+        random = Random(42)
+        backend = self.open()
+        ends, states, state = [], [], {}
+        for i in xrange(200):
+            key = "key{}".format(random.randint(0, 30))
+            if key in state and random.random() < 0.3:
+                del backend[key]
+                del state[key]
+            else:
+                state[key] = "value{}".format(i) * random.randint(1, 20)
+                backend[key] = state[key]
+            if i % 50 == 0:
+                backend.sync()  # sidecar index covers part of the log
+            ends.append(backend.size)
+            states.append(dict(state))
+        backend.close()
+        with open(self.path, "rb") as fd:
+            data = fd.read()
+        with open(backend.get_index_path(), "rb") as fd:
+            index = fd.read()
+        for offset in random.sample(xrange(len(data)), 50):
+            with open(self.path, "wb") as fd:
+                fd.write(data[:offset])
+            if offset % 2 == 0:  # otherwise keep index of last recovery
+                with open(backend.get_index_path(), "wb") as fd:
+                    fd.write(index)
+            if offset < LogBackend.HEADER_SIZE:
+                continue
+            backend = self.open()
+            complete = [i for i, end in enumerate(ends) if end <= offset]
+            expected = states[complete[-1]] if complete else {}
+            self.assertEqual(dict((k, backend[k]) for k in backend.keys()),
+                             expected)
+            self.assertLessEqual(path.getsize(self.path), offset)
+            backend["recovered"] = "yes"
+            backend.close()
+            backend = self.open(LogBackend.READER)
+            self.assertEqual(backend["recovered"], "yes")
+            self.assertEqual(len(backend), len(expected) + 1)
+            backend.close()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from unittest import TestCase
+from StringIO import StringIO
+from tempfile import mkdtemp
+from shutil import rmtree
+from os import environ
+
+from unlocker.authority import Authority
+from unlocker.display import Display
+from unlocker.manager import Manager
+
+from tests.memory import MemoryBackend
+
+
+class TestManager(TestCase):
+
+    def setUp(self):
+        self.home, self.old_home = mkdtemp(), environ.get("HOME")
+        environ["HOME"] = self.home
+        Display.output = StringIO()
+
+    def tearDown(self):
+        Display.output = None
+        environ["HOME"] = self.old_home
+        rmtree(self.home)
+
+    def test_stats_new_keychain(self):
+        holder = MemoryBackend()
+        Manager.initialize(holder)
+        auth = Authority.new("127.0.0.1", 22, "root", "ssh")
+        Manager("", {}).get_db().add("manager_test", ".password", auth)
+        Manager("", {}).get_db().add_passkey("manager_other", ".password")
+        # statistics are stored with the first entries, no scan is needed
+        storage = Manager.initialize(holder, read_only=True)
+        self.assertEqual(Manager("stats", {}).call(), None)
+        self.assertEqual(storage.metrics()["scans"], 0)
+        self.assertIn("total", Display.output.getvalue())
+        rows = Manager("", {}).get_db().get_stats(scan=False)
+        self.assertEqual(rows, Manager("", {}).get_db().get_stats())
+        self.assertEqual(storage.get_stats(scan=False),
+                         storage.build_stats())
+
+    def test_stats_read_only(self):
+        holder = MemoryBackend()
+        Manager.initialize(holder)
+        auth = Authority.new("127.0.0.1", 22, "root", "ssh")
+        Manager("", {}).get_db().add("manager_test", ".password", auth)
+        del holder["#!stats"]  # keychain of an older version
+        puts = holder.operations["puts"]
+        Manager.initialize(holder, read_only=True)
+        self.assertEqual(Manager("stats", {}).call(), Manager.NEEDS_WRITE)
+        self.assertEqual(holder.operations["puts"], puts)
+        self.assertEqual(Display.output.getvalue(), "")
+        Manager.initialize(holder)
+        self.assertEqual(Manager("stats", {}).call(), None)
+        self.assertEqual(holder.operations["puts"], puts + 1)
+        Manager.initialize(holder, read_only=True)
+        self.assertEqual(Manager("stats", {}).call(), None)
+        self.assertEqual(holder.operations["puts"], puts + 1)
+        self.assertIn("total", Display.output.getvalue())
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from unittest import TestCase
+from StringIO import StringIO
+from tempfile import mkdtemp
+from shutil import rmtree
+from os import urandom, environ, path
+
+import logging
+import unlocker.migrate
+
+from unlocker.authority import Authority
+from unlocker.manager import Manager
+from unlocker.migrate import Migrate
+
+from unlocker.util.passkey import Passkey
+from unlocker.util.resolver import Resolver
+from unlocker.util.dnscache import DnsCache
+
+from tests.memory import MemoryBackend
+
+
+def unresolvable(host):
+    raise IOError("Name or service not known")
+
+
+class LocalResolver(Resolver):
+
+    @classmethod
+    def from_config(cls, lookup=None):
+        cache = DnsCache(path.join(environ["HOME"], "dns-cache"))
+        return cls(lookup=lambda host: "127.0.0.1", cache=cache)
+
+
+class Collector(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestMigrate(TestCase):
+
+    def setUp(self):
+        self.home, self.old_home = mkdtemp(), environ.get("HOME")
+        environ["HOME"] = self.home
+        self.stdin, self.stdout = unlocker.migrate.stdin, \
+            unlocker.migrate.stdout
+        unlocker.migrate.Resolver = LocalResolver
+        Manager.initialize({})
+
+    def tearDown(self):
+        unlocker.migrate.stdin, unlocker.migrate.stdout = self.stdin, \
+            self.stdout
+        unlocker.migrate.Resolver = Resolver
+        environ["HOME"] = self.old_home
+        rmtree(self.home)
+
+    def add_entry(self, name, ptype, passkey, port=22):
+        auth = Authority.new("127.0.0.1", port, "root", "ssh")
+        secret = Passkey.SUPPORTED_TYPES.get(ptype) + passkey
+        Manager("", {}).get_db().add(name, secret, auth, "localhost")
+
+    def migrate(self, args, source=""):
+        unlocker.migrate.stdin = StringIO(source)
+        unlocker.migrate.stdout = StringIO()
+        Manager("migrate", args).call()
+        return unlocker.migrate.stdout.getvalue()
+
+    def get_entries(self):
+        database = Manager("", {}).get_db()
+        return [(name, auth.signature(), database.lookup(name)[2])
+                for name, auth, _, _ in database.query_all()]
+
+    def test_roundtrip(self):
+        self.add_entry("migrate_test_1", "password", "password1")
+        self.add_entry("migrate_test_2", "privatekey", "-----KEY-----\n",
+                       2222)
+        entries = self.get_entries()
+        exported = self.migrate({"export_secrets": []})
+        Manager.initialize({})
+        self.migrate({"import_secrets": True}, exported)
+        self.assertEqual(self.get_entries(), entries)
+        exported = self.migrate({"export_secrets": ["migrate_test_1"]})
+        Manager.initialize({})
+        self.migrate({"import_secrets": True}, exported)
+        self.assertEqual(self.get_entries(), entries[:1])
+
+    def test_batches(self):
+        for i in xrange(5):
+            self.add_entry("migrate_test_{}".format(i), "password",
+                           "password{}".format(i), 3000 + i)
+        for i in xrange(40):
+            self.add_entry("migrate_test_key_{:02d}".format(i), "privatekey",
+                           urandom(1024).encode("hex"), 4000 + i)
+        for i in xrange(100):
+            self.add_entry("migrate_test_pw_{:03d}".format(i), "password",
+                           urandom(32).encode("hex"), 5000 + i)
+        entries = self.get_entries()
+        exported = self.migrate({"export_secrets": []})
+        lines = [exported[i:i + 76] for i in xrange(0, len(exported), 76)]
+        wrapped = "\n".join(lines)
+        holder = MemoryBackend()
+        Manager.initialize(holder)
+        self.migrate({"import_secrets": True, "batch_size": 2}, wrapped)
+        self.assertEqual(self.get_entries(), entries)
+        self.assertEqual(holder.operations["syncs"], 73)
+        stats = Manager("", {}).get_db().get_stats(scan=False)
+        counts = dict((row[1], row[2]) for row in stats)
+        self.assertEqual(counts["R"], 145)  # built once import is done
+        Manager.initialize(holder)
+        for name in ("migrate_test_0", "migrate_test_1", "migrate_test_2"):
+            Manager("", {}).get_db().remove(name)
+        self.add_entry("migrate_test_2", "password", "password2", 3999)
+        with self.assertRaises(SystemExit):
+            self.migrate({"import_secrets": True, "batch_size": 2}, exported)
+        # first batch is written, second one has a conflict and is dropped
+        self.assertEqual(len(self.get_entries()), 145)
+        self.assertIn(entries[0], self.get_entries())
+        Manager("", {}).get_db().remove("migrate_test_2")
+        syncs = holder.operations["syncs"]
+        self.migrate({"import_secrets": True, "batch_size": 2}, exported)
+        # entries imported by the failed run are skipped on resume, so only
+        # the batch with the missing entry is synced
+        self.assertEqual(self.get_entries(), entries)
+        self.assertEqual(holder.operations["syncs"] - syncs, 1)
+
+    def test_progress(self):
+        for i in xrange(25):
+            self.add_entry("migrate_test_{:02d}".format(i), "password",
+                           "password{}".format(i), 3000 + i)
+        exported = self.migrate({"export_secrets": []})
+        Manager.initialize({})
+        logger, collector = logging.getLogger(), Collector()
+        level = logger.level
+        logger.setLevel(logging.WARNING)
+        logger.addHandler(collector)
+        try:
+            self.migrate({"import_secrets": True, "batch_size": 2}, exported)
+        finally:
+            logger.removeHandler(collector)
+            logger.setLevel(level)
+        # progress of every tenth batch is shown at the default level
+        progress = [each for each in collector.messages
+                    if each.startswith("Imported ")]
+        self.assertEqual([each.split(" (")[0] for each in progress],
+                         ["Imported 20 entries", "Imported 25 entries"])
+        self.assertTrue(progress[0].endswith("entries/sec)..."))
+
+    def test_resolve(self):
+        self.add_entry("migrate_test_1", "password", "password1")
+        self.add_entry("migrate_test_2", "password", "password2", 2222)
+        exported = self.migrate({"export_secrets": []})
+        Manager.initialize({})
+        unlocker.migrate.stdin = StringIO(exported)
+        resolver = Resolver(lookup=lambda host: "10.0.0.1")
+        Migrate(Manager("migrate", {}), resolver).import_secrets()
+        self.assertEqual(resolver.lookups, 1)
+        auth = Manager("", {}).get_db().fetch_auth("migrate_test_2")
+        self.assertEqual(auth.get_host_ip4(), "10.0.0.1")
+        Manager.initialize({})
+        unlocker.migrate.stdin = StringIO(exported)
+        resolver = Resolver(lookup=unresolvable)
+        Migrate(Manager("migrate", {}), resolver).import_secrets()
+        auth = Manager("", {}).get_db().fetch_auth("migrate_test_2")
+        self.assertEqual(auth.get_host_ip4(), "127.0.0.1")
+
+    def test_export_without_resolver(self):
+        self.add_entry("migrate_test_1", "password", "password1")
+        unlocker.migrate.Resolver = None  # exports don't resolve hostnames
+        self.assertTrue(len(self.migrate({"export_secrets": []})) > 0)
+
+    def test_nothing_to_export(self):
+        with self.assertRaises(SystemExit):
+            self.migrate({"export_secrets": []})
+        self.assertEqual(unlocker.migrate.stdout.getvalue(), "")
+
+    def test_linear_reads(self):
+        reads = []
+        for size in (20, 80):
+            holder = MemoryBackend()
+            Manager.initialize(holder)
+            for i in xrange(size):
+                ptype = "privatekey" if i % 4 == 0 else "password"
+                self.add_entry("migrate_test_{:03d}".format(i), ptype,
+                               "secret{}".format(i), 3000 + i)
+            Manager.initialize(holder)  # cold cache
+            holder.reset()
+            self.migrate({"export_secrets": []})
+            self.assertEqual(holder.operations["iterations"], 1)
+            reads.append(holder.operations["gets"])
+        # record and passkey of each entry, again passkey of private keys
+        self.assertLessEqual(reads[0], 20 * 2 + 5 + 3)
+        self.assertLessEqual(reads[1] - reads[0], (80 - 20) * 2 + 15)
+
+    def test_local_resolver(self):
+        self.add_entry("migrate_test_1", "password", "password1")
+        exported = self.migrate({"export_secrets": []})
+        Manager.initialize({})
+        self.migrate({"import_secrets": True}, exported)
+        cache = DnsCache(path.join(self.home, "dns-cache"))
+        self.assertEqual(cache.entries["localhost"][0], "127.0.0.1")
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from unittest import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree
+from pstats import Stats
+from os import environ
+import sys
+
+from unlocker.util.profiler import Profiler
+
+
+def exiting_command():
+    sorted(xrange(1000), reverse=True)
+    raise SystemExit
+
+
+class TestProfiler(TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.argv = list(sys.argv)
+
+    def tearDown(self):
+        sys.argv[:] = self.argv
+        for each in (Profiler.ENV, Profiler.MODE_ENV, Profiler.SUMMARY_ENV):
+            environ.pop(each, None)
+        rmtree(self.tmpdir)
+
+    def test_from_argv(self):
+        sys.argv[:] = ["unlocker", "list", "--vertical"]
+        self.assertEqual(Profiler.from_argv(), None)
+        sys.argv[:] = ["unlocker", "--profile", "list", "--profile-summary"]
+        profiler = Profiler.from_argv()
+        self.assertEqual(sys.argv, ["unlocker", "list"])
+        self.assertEqual((profiler.path, profiler.mode, profiler.summary),
+                         ("unlocker.pstats", Profiler.CPU, True))
+        environ[Profiler.ENV] = "/tmp/env.alloc"
+        environ[Profiler.MODE_ENV] = Profiler.ALLOC
+        profiler = Profiler.from_argv()
+        self.assertEqual((profiler.path, profiler.mode, profiler.summary),
+                         ("/tmp/env.alloc", Profiler.ALLOC, False))
+        for value in ("", "0", "false", "False"):
+            environ[Profiler.ENV] = value
+            self.assertEqual(Profiler.from_argv(), None)
+        environ[Profiler.ENV] = "true"
+        self.assertEqual(Profiler.from_argv().path,
+                         Profiler.DEFAULT_PATHS[Profiler.ALLOC])
+        with self.assertRaises(SystemExit):
+            Profiler(mode="wall")
+
+    def test_cpu(self):
+        path = "{}/profile.pstats".format(self.tmpdir)
+        with self.assertRaises(SystemExit):
+            Profiler(path).run(exiting_command)
+        stats = Stats(path)
+        self.assertTrue(any(func[2] == "exiting_command"
+                            for func in stats.stats))
+
+    def test_alloc(self):
+        path = "{}/profile.alloc".format(self.tmpdir)
+        values = Profiler(path, Profiler.ALLOC).run(
+            lambda: [dict() for _ in xrange(1000)])
+        self.assertEqual(len(values), 1000)
+        with open(path) as fd:
+            report = fd.read()
+        self.assertTrue(report.startswith("Peak"))
+        self.assertTrue("dict" in report)
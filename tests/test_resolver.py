@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from unittest import TestCase
+from threading import Lock, active_count
+from time import sleep, time
+from tempfile import mkdtemp
+from shutil import rmtree
+from os import path
+
+from unlocker.util.resolver import Resolver
+from unlocker.util.dnscache import DnsCache
+
+
+class StubResolver(object):
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = []
+        self.lock = Lock()
+
+    def __call__(self, host):
+        with self.lock:
+            self.calls.append(host)
+        sleep(self.latency)
+        if host.startswith("missing"):
+            raise IOError("Name or service not known")
+        return "10.0.0.{}".format(int(host[4:]) % 256)
+
+
+class TestResolver(TestCase):
+
+    def resolve(self, workers, hosts, latency=0.02, timeout=1.0):
+        stub = StubResolver(latency)
+        resolver = Resolver(workers, timeout, stub)
+        started = time()
+        answers = resolver.resolve_all(hosts)
+        return answers, stub, time() - started
+
+    def test_concurrency(self):
+        hosts = ["host{}".format(i) for i in xrange(32)]
+        answers, _, serial = self.resolve(1, hosts)
+        self.assertEqual(answers["host7"], "10.0.0.7")
+        answers, _, parallel = self.resolve(8, hosts)
+        self.assertEqual(len(answers), 32)
+        self.assertGreaterEqual(serial, 32 * 0.02)
+        self.assertLess(parallel, serial / 3)
+
+    def test_unique(self):
+        hosts = ["host1", "host2", "host1", "10.1.1.1", "host2", "missing"]
+        answers, stub, _ = self.resolve(4, hosts)
+        self.assertEqual(sorted(stub.calls), ["host1", "host2", "missing"])
+        self.assertEqual(answers, {"host1": "10.0.0.1", "host2": "10.0.0.2",
+                                   "10.1.1.1": "10.1.1.1", "missing": None})
+
+    def test_timeout(self):
+        answers, _, elapsed = self.resolve(2, ["host1", "host2"], latency=1,
+                                           timeout=0.05)
+        self.assertEqual(answers, {"host1": None, "host2": None})
+        self.assertLess(elapsed, 0.5)
+
+    def test_timeout_not_cached(self):
+        tmpdir = mkdtemp()
+        try:
+            cache = DnsCache(path.join(tmpdir, "dns-cache"))
+            stub = StubResolver(latency=0.3)
+            resolver = Resolver(2, 0.05, stub, cache)
+            answers = resolver.resolve_all(["host1", "missing"])
+            self.assertEqual(answers, {"host1": None, "missing": None})
+            self.assertEqual(cache.entries, {})
+            stub.latency = 0
+            with resolver.cond:
+                while resolver.outstanding > 0:
+                    resolver.cond.wait(0.1)
+            answers = resolver.resolve_all(["host1", "missing"])
+            self.assertEqual(answers, {"host1": "10.0.0.1", "missing": None})
+            self.assertEqual(cache.entries["host1"][0], "10.0.0.1")
+            self.assertTrue(cache.entries["missing"][2])
+        finally:
+            rmtree(tmpdir)
+
+    def test_bounded_threads(self):
+        stub = StubResolver(latency=1)
+        resolver = Resolver(2, 0.05, stub)
+        threads = active_count()
+        for i in xrange(5):
+            hosts = ["host{}".format(i * 4 + j) for j in xrange(4)]
+            answers = resolver.resolve_all(hosts)
+            self.assertEqual(set(answers.values()), {None})
+            self.assertLessEqual(active_count(), threads + 2)
+        self.assertEqual(len(stub.calls), 2)  # later lookups never started
@@ -21,13 +21,112 @@
 # THE SOFTWARE.
 
 from unittest import TestCase
-from os import path
+from multiprocessing import Process, Queue
+from tempfile import mkdtemp
+from shutil import rmtree
+from os import path, environ
 from os.path import expanduser
+from time import sleep
+
+from unlocker.authority import Authority
+from unlocker.database import Database
+from unlocker.keychain import Keychain
+
+import unlocker.util.secret
 
 from unlocker.util.secret import Secret
 
 
+def append_entries(total, results):
+    auth = Authority.new("127.0.0.1", 2222, "root", "ssh")
+    for i in xrange(total):
+        secrets = Secret.get_secret_file()
+        try:
+            name = "secret_append_{}".format(i)
+            Database(Keychain(secrets)).add(name, ".password", auth, "host")
+        finally:
+            secrets.close()
+    results.put("done")
+
+
+def lookup_entry(name, results):
+    secrets = Secret.get_secret_file(read_only=True)
+    try:
+        _, host, _ = Database(Keychain(secrets)).lookup(name)
+        results.put(host)
+    finally:
+        secrets.close()
+
+
 class TestSecret(TestCase):
 
     def test_secret_dir(self):
         self.assertEqual(Secret.get_secret_dir(), path.join(expanduser("~"), ".unlocker"))
+
+    def test_concurrent_readers(self):
+        home, old_home = mkdtemp(), environ.get("HOME")
+        environ["HOME"] = home
+        try:
+            secrets = Secret.get_secret_file()
+            auth = Authority.new("127.0.0.1", 22, "root", "ssh")
+            Database(Keychain(secrets)).add("secret_lookup", ".password",
+                                            auth, "localhost")
+            secrets.close()
+            results = Queue()
+            writer = Process(target=append_entries, args=(20, results))
+            readers = [Process(target=lookup_entry,
+                               args=("secret_lookup", results))
+                       for _ in xrange(50)]
+            writer.start()
+            for each in readers:
+                each.start()
+            for each in [writer] + readers:
+                each.join()
+                self.assertEqual(each.exitcode, 0)
+            outcome = sorted(results.get() for _ in xrange(51))
+            self.assertEqual(outcome, ["done"] + ["localhost"] * 50)
+            secrets = Secret.get_secret_file(read_only=True)
+            names = [n for n, _, _, _ in Database(Keychain(secrets)).query_all()]
+            secrets.close()
+            self.assertEqual(len(names), 21)
+        finally:
+            environ["HOME"] = old_home
+            rmtree(home)
+
+    def test_older_version(self):
+        home, old_home = mkdtemp(), environ.get("HOME")
+        environ["HOME"] = home
+        try:
+            secrets = Secret.get_secret_file()
+            secrets[Secret.VERSION] = "2.2.0"
+            secrets.close()
+            with self.assertRaises(SystemExit) as error:
+                Secret.get_secret_file()
+            self.assertIn("unlocker migrate", str(error.exception))
+            Secret.migrate_secrets()
+            Secret.get_secret_file().close()
+        finally:
+            environ["HOME"] = old_home
+            rmtree(home)
+
+    def test_retry_locked_only(self):
+        home = mkdtemp()
+        delays = []
+        unlocker.util.secret.sleep = delays.append
+        try:
+            fullpath = path.join(home, "secrets.log")
+            writer = Secret.open_secret_file(fullpath, Secret.WRITER, "log")
+            with self.assertRaises(IOError):
+                Secret.open_secret_file(fullpath, Secret.READER, "log")
+            self.assertEqual(len(delays), Secret.LOCK_RETRIES - 1)
+            writer.close()
+            del delays[:]
+            fullpath = path.join(home, "secrets.db")
+            with open(fullpath, "wb") as fd:
+                fd.write("not a database" * 100)
+            with self.assertRaises(Exception):
+                Secret.open_secret_file(fullpath, Secret.WRITER, "sqlite")
+            self.assertEqual(delays, [])
+        finally:
+            unlocker.util.secret.sleep = sleep
+            rmtree(home)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from unittest import TestCase
+from tempfile import mkdtemp
+from subprocess import Popen, PIPE
+from shutil import rmtree
+from time import time
+from os import environ, path
+from sys import executable
+
+import unlocker
+
+from unlocker.authority import Authority
+from unlocker.database import Database
+from unlocker.keychain import Keychain
+
+from unlocker.util.secret import Secret
+
+
+# runs unlocker and writes names of loaded modules to stderr on exit
+STARTUP_SCRIPT = """
+import sys, atexit
+atexit.register(lambda: sys.stderr.write("\\n".join(sys.modules)))
+sys.argv[0] = "unlocker"
+from unlocker.bootstrap import main
+main()
+"""
+
+# modules a lookup or a piped dump should never load
+HEAVY_MODULES = ("uuid", "zipfile", "shutil", "click", "json", "socket",
+                 "unlocker.migrate", "unlocker.agent", "unlocker.batch",
+                 "unlocker.util.helper")
+
+# cold start budget in seconds (best of a few runs)
+STARTUP_BUDGET = float(environ.get("UNLOCKER_STARTUP_BUDGET", 0.5))
+STARTUP_RUNS = 3
+
+
+class TestStartup(TestCase):
+
+    def setUp(self):
+        self.home, self.old_home = mkdtemp(), environ.get("HOME")
+        environ["HOME"] = self.home
+        secrets = Secret.get_secret_file()
+        auth = Authority.new("127.0.0.1", 22, "root", "ssh")
+        Database(Keychain(secrets)).add("startup_test", ".password", auth,
+                                        "localhost")
+        secrets.close()
+        self.env = dict(environ, NOPAGER="true")
+        self.env.pop("DEBUG", None)
+        root = path.dirname(path.dirname(path.abspath(unlocker.__file__)))
+        paths = [root] + filter(None, [environ.get("PYTHONPATH")])
+        self.env.update({"PYTHONPATH": ":".join(paths)})
+
+    def tearDown(self):
+        environ["HOME"] = self.old_home
+        rmtree(self.home)
+
+    def start(self, args=(), stdin=None):
+        best, modules = None, None
+        for _ in xrange(STARTUP_RUNS):
+            started = time()
+            proc = Popen([executable, "-c", STARTUP_SCRIPT] + list(args),
+                         stdin=PIPE, stdout=PIPE, stderr=PIPE, env=self.env)
+            out, err = proc.communicate(stdin)
+            elapsed = time() - started
+            self.assertEqual(proc.returncode, 0, err)
+            best = elapsed if best is None else min(best, elapsed)
+            modules = set(err.splitlines())
+        return out, modules, best
+
+    def assert_startup(self, modules, elapsed):
+        self.assertEqual(sorted(modules.intersection(HEAVY_MODULES)), [])
+        self.assertLess(elapsed, STARTUP_BUDGET)
+
+    def test_lookup(self):
+        out, modules, elapsed = self.start(["lookup", "-n", "startup_test"])
+        self.assertTrue("password" in out)
+        self.assert_startup(modules, elapsed)
+
+    def test_stdout_dump(self):
+        out, modules, elapsed = self.start(stdin="startup_test")
+        self.assertEqual(out, "password\ncGFzc3dvcmQ=")
+        self.assertFalse("argparse" in modules)
+        self.assert_startup(modules, elapsed)
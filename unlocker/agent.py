@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from os import path, stat, remove, umask
+from sys import stdout
+from json import dumps, loads
+from errno import ENOENT
+from signal import signal, SIGTERM
+from StringIO import StringIO
+from socket import socket, AF_UNIX, SOCK_STREAM, error as SocketError
+
+from unlocker.manager import Manager
+from unlocker.display import Display
+from unlocker.stream import StreamData
+
+from unlocker.util.secret import Secret
+from unlocker.util.log import Log
+
+
+class Agent(object):
+    """Unlocker agent serving read-only requests over a Unix socket.
+
+    The agent loads the keychain in memory and answers the same read-only
+    options the CLI does, without paying the start up cost of a new process
+    for each request. The keychain file is not kept open because it would
+    lock out writers; instead, every request compares the file's status with
+    the one from the last load and reloads the keychain when it changed.
+
+    Requests are JSON objects on a single line with an option and arguments:
+      {"option": "list", "args": {"vertical": false}}
+
+    Piped dumps can send the raw input instead of parsed arguments:
+      {"option": "stdout_dump", "args": {"stdin": "ssh://root@localhost"}}
+
+    Responses are the output of the option prefixed with "+" on success, or
+    an error message prefixed with "-" on failure.
+
+    Arguments:
+        socket_path  (str): Path to the Unix socket.
+        secrets_path (str): Path to the keychain file.
+        stamp      (tuple): Keychain file status from the last load.
+        responses   (dict): Cached responses since the last load.
+
+    Args:
+        socket_path (str): Path to the Unix socket (optional).
+    """
+
+    SUPPORTED_OPTIONS = ("list", "lookup", "recall", "stdout_dump")
+    OK, ERROR = "+", "-"
+    BUFFER_SIZE = 2**16
+    TIMEOUT = 2.0
+    WAL_SUFFIX = "-wal"
+
+    def __init__(self, socket_path=None):
+        if socket_path is None:
+            socket_path = self.get_socket_path()
+        self.socket_path = socket_path
+        self.secrets_path = Secret.get_secret_path()
+        self.stamp = None
+        self.responses = {}
+
+    @classmethod
+    def get_socket_path(cls):
+        """Agent socket path getter.
+
+        Returns:
+            str: Path to the Unix socket inside secret directory.
+        """
+
+        return Secret.get_agent_socket()
+
+    def get_stamp(self):
+        """Keychain file status getter.
+
+        Backends writing ahead to a log file (e.g. SQLite in WAL mode) can
+        change it without touching the keychain file, so it is checked too.
+
+        Returns:
+            tuple: Inode, size and modification time of keychain file and
+                   log file (if any) or None if keychain file is missing.
+        """
+
+        stamp = ()
+        for each in (self.secrets_path, self.secrets_path + self.WAL_SUFFIX):
+            try:
+                st = stat(each)
+            except OSError as e:
+                if e.errno == ENOENT:
+                    continue
+                raise
+            stamp += (st.st_ino, st.st_size, st.st_mtime)
+        return stamp or None
+
+    def refresh(self):
+        """Reload keychain in memory if the keychain file changed.
+
+        Raises:
+            Exception: If the keychain cannot be loaded (e.g. it is locked).
+        """
+
+        stamp = self.get_stamp()
+        if stamp is not None and stamp == self.stamp:
+            return
+        Log.debug("Keychain changed, reloading...")
+        self.stamp, self.responses = None, {}
+        Manager.initialize({})  # forget everything before reloading
+        secrets = Secret.get_secret_file(read_only=True)
+        try:
+            snapshot = dict((k, secrets[k]) for k in secrets.keys())
+        finally:
+            secrets.close()
+        Manager.initialize(snapshot)
+        self.stamp = self.get_stamp()
+        Log.debug("Loaded {n} keys in memory...", n=len(snapshot))
+
+    def handle(self, request):
+        """Run a request against the keychain loaded in memory.
+
+        Args:
+            request (str): JSON encoded option and arguments.
+
+        Raises:
+            Exception: If request is invalid or option fails.
+
+        Returns:
+            str: Output of the requested option.
+        """
+
+        self.refresh()
+        if request in self.responses:
+            return self.responses.get(request)
+        data = loads(request)
+        option, args = data.get("option"), data.get("args") or {}
+        if option not in self.SUPPORTED_OPTIONS:
+            Log.fatal("Unsupported agent option {o}", o=option)
+        if option == StreamData.OPTION and "stdin" in args:
+            StreamData.buf_in = unicode(args.get("stdin")).strip()
+            args = StreamData.parse()
+        Display.output = StringIO()
+        try:
+            Manager(option, args).call()
+            response = Display.output.getvalue()
+        finally:
+            Display.output = None
+        self.responses[request] = response
+        return response
+
+    def serve(self):
+        """Listen on the Unix socket and answer requests until interrupted.
+
+        Raises:
+            Exception: If another agent is already running.
+        """
+
+        if path.exists(self.socket_path):
+            if self.connect() is not None:
+                Log.fatal("Agent is already running: {p}", p=self.socket_path)
+            remove(self.socket_path)  # stale socket
+        server = socket(AF_UNIX, SOCK_STREAM)
+        mask = umask(0177)
+        try:
+            server.bind(self.socket_path)
+        finally:
+            umask(mask)
+        server.listen(16)
+        signal(SIGTERM, self.stop)
+        Log.warn("Agent listening on {p}", p=self.socket_path)
+        try:
+            while True:
+                conn, _ = server.accept()
+                try:
+                    self.reply(conn)
+                finally:
+                    conn.close()
+        except KeyboardInterrupt:
+            Log.warn("Agent stopped...")
+        finally:
+            server.close()
+            remove(self.socket_path)
+
+    def stop(self, *args):
+        """Signal handler to stop serving.
+
+        Raises:
+            KeyboardInterrupt: Always, to close agent as on ^C.
+        """
+
+        raise KeyboardInterrupt
+
+    def reply(self, conn):
+        """Read one request from connection and send back the response.
+
+        Args:
+            conn (socket): Client connection.
+        """
+
+        conn.settimeout(self.TIMEOUT)
+        request = self.read_line(conn)
+        try:
+            response = self.OK + self.handle(request)
+        except (Exception, SystemExit) as e:
+            Log.debug("Agent request failed: {e}", e=str(e))
+            response = self.ERROR + str(e).strip()
+        try:
+            conn.sendall(response)
+        except SocketError as e:
+            Log.debug("Agent cannot reply: {e}", e=str(e))
+
+    def read_line(self, conn):
+        """Read from connection until end of line or end of stream.
+
+        Args:
+            conn (socket): Opened connection.
+
+        Returns:
+            str: Line read without the new line character.
+        """
+
+        chunks = []
+        while True:
+            try:
+                chunk = conn.recv(self.BUFFER_SIZE)
+            except SocketError:
+                break
+            if not chunk:
+                break
+            chunks.append(chunk)
+            if "\n" in chunk:
+                break
+        return "".join(chunks).split("\n", 1)[0]
+
+    def connect(self):
+        """Connect to a running agent.
+
+        Returns:
+            socket: Connected socket or None if agent is not running.
+        """
+
+        conn = socket(AF_UNIX, SOCK_STREAM)
+        conn.settimeout(self.TIMEOUT)
+        try:
+            conn.connect(self.socket_path)
+        except SocketError:
+            conn.close()
+            return None
+        return conn
+
+    def request(self, option, args):
+        """Send a request to a running agent.
+
+        Args:
+            option (str): Manager option to run.
+            args  (dict): Arguments of option.
+
+        Returns:
+            str: Output of the option or None if agent cannot answer.
+        """
+
+        if option not in self.SUPPORTED_OPTIONS:
+            return None
+        if not path.exists(self.socket_path):
+            return None
+        conn = self.connect()
+        if conn is None:
+            return None
+        chunks = []
+        try:
+            conn.sendall(dumps({"option": option, "args": args}) + "\n")
+            while True:
+                chunk = conn.recv(self.BUFFER_SIZE)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        except SocketError as e:
+            Log.debug("Agent request failed: {e}", e=str(e))
+            return None
+        finally:
+            conn.close()
+        response = "".join(chunks)
+        if not response.startswith(self.OK):
+            Log.debug("Agent cannot answer: {e}", e=response[1:])
+            return None
+        return response[len(self.OK):]
+
+    @classmethod
+    def forward(cls, option, args):
+        """Run an option through a running agent and print its output.
+
+        Args:
+            option (str): Manager option to run.
+            args  (dict): Arguments of option.
+
+        Returns:
+            bool: True if agent answered, otherwise False.
+        """
+
+        if option not in cls.SUPPORTED_OPTIONS:
+            return False
+        output = cls().request(option, args)
+        if output is None:
+            return False
+        Log.debug("Got response from agent...")
+        if option == StreamData.OPTION:
+            stdout.write(output)
+        else:
+            Display.show(output.decode("utf-8"))
+        return True
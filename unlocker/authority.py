@@ -20,13 +20,52 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-from socket import gethostbyname
-from ipaddress import ip_address, IPv4Address, IPv6Address, AddressValueError
+from ipaddress import ip_address, IPv4Address, IPv6Address
 from zlib import crc32
 
 from unlocker.util.log import Log
 
 
+def gethostbyname(host):
+    """Resolve hostname to IPv4 address.
+
+    The socket module is loaded on first use, only when a hostname must be
+    resolved (stored authorities are recovered without resolving).
+
+    Args:
+        host (str): Hostname to resolve.
+
+    Returns:
+        str: IPv4 address.
+    """
+
+    from socket import gethostbyname as resolve
+    return resolve(host)
+
+
+def resolve(host):
+    """Resolve hostname to IPv4 address through the DNS cache.
+
+    IPv4 addresses are answered as they are, without touching the cache.
+
+    Args:
+        host (str): Hostname or IPv4 address to resolve.
+
+    Raises:
+        Exception: If hostname cannot be resolved (also if cached).
+
+    Returns:
+        str: IPv4 address.
+    """
+
+    try:
+        return str(IPv4Address(unicode(host)))
+    except ValueError:
+        pass
+    from unlocker.util.dnscache import DnsCache
+    return DnsCache.get_instance().resolve(host, gethostbyname)
+
+
 class Authority(object):
     """Object authority holder.
 
@@ -99,7 +138,7 @@ class Authority(object):
         if not isinstance(host, (str, unicode)):
             Log.fatal("Invalid host: expected string, got {x}", x=type(host))
         try:
-            self.ip_addr = unicode(gethostbyname(host))
+            self.ip_addr = unicode(resolve(host))
         except Exception as e:
             Log.warn("Cannot resolve hostname {h}: {e}", e=str(e), h=host)
         try:
@@ -107,6 +146,27 @@ class Authority(object):
         except Exception as e:
             Log.fatal("Invalid host: {e}", e=str(e))
 
+    def set_host_address(self, address):
+        """Authority host setter for an already resolved IP address.
+
+        Unlike set_host, it never calls the resolver.
+
+        Args:
+            address (int): IP address as an integer.
+
+        Raises:
+            Exception: if an invalid IP address is provided.
+        """
+
+        if not isinstance(address, (int, long)):
+            Log.fatal("Invalid host address: expected integer, got {x}",
+                      x=type(address))
+        try:
+            self.ip_addr = unicode(ip_address(address))
+        except Exception as e:
+            Log.fatal("Invalid host address: {e}", e=str(e))
+        self.host = address
+
     def get_port(self):
         """Authority port getter.
 
@@ -278,10 +338,38 @@ class Authority(object):
         if authority.count(cls.DELIMITER) != cls.COMPONENTS:
             Log.fatal("Cannot recover from an invalid authority")
         host, port, user, srv = authority.split(cls.DELIMITER, cls.COMPONENTS)
-        try:  # fix for non-linux platforms
-            host = str(IPv4Address(int(host, 10)))
+        try:
+            address = int(host, 10)
         except ValueError as e:
             Log.warn("Cannot convert to IP4: {e}", e=str(e))
-        except AddressValueError as e:
-            Log.fatal("Invalid host address: {e}", e=str(e))
-        return cls.new(host, port, user, srv)
+            return cls.new(host, port, user, srv)
+        return cls.load(address, port, user, srv)
+
+    @classmethod
+    def load(cls, address, port, user, scheme):
+        """Rebuild an authority instance from stored components.
+
+        The stored IP address is used as is, without resolving anything.
+
+        Args:
+            address (int): IP address as an integer.
+            port    (int): Port number of hostname.
+            user    (str): Username assigned to hostname.
+            scheme  (str): Connection service scheme.
+
+        Raises:
+            Exception: If required fields are invalid.
+
+        Returns:
+            Authority: An authority instance.
+        """
+
+        auth = cls()
+        try:
+            auth.set_scheme(scheme)
+            auth.set_host_address(address)
+            auth.set_port(port)
+            auth.set_user(user)
+        except Exception as e:
+            Log.fatal("Cannot load authority: {e}", e=str(e))
+        return auth
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from importlib import import_module
+from errno import EAGAIN, EWOULDBLOCK
+
+from unlocker.util.log import Log
+
+
+# supported backends and the modules implementing them
+BACKENDS = {
+    "gdbm": ("unlocker.backend.gdbmfile", "GdbmBackend"),
+    "sqlite": ("unlocker.backend.sqlite", "SqliteBackend"),
+    "log": ("unlocker.backend.logfile", "LogBackend"),
+}
+
+
+def get_backend(name):
+    """Backend class getter.
+
+    Backends are imported on first use, so that optional dependencies of
+    one backend are never required by another.
+
+    Args:
+        name (str): Name of the backend.
+
+    Raises:
+        Exception: If backend is not supported.
+
+    Returns:
+        class: Backend class.
+    """
+
+    if name not in BACKENDS:
+        Log.fatal("Unsupported keychain backend {b} (expected one of: {s})",
+                  b=name, s=", ".join(sorted(BACKENDS)))
+    module, cls = BACKENDS.get(name)
+    return getattr(import_module(module), cls)
+
+
+class Layout(object):
+    """Layout of stored entries, as seen by backends.
+
+    Entries are made of a record and a passkey, each stored under its own
+    prefixed key. A backend may keep them in columns instead of their
+    stored values, as long as the values can be rebuilt byte by byte:
+      record:  signature, ip, port, user, scheme, host, jump, jump_signature
+      passkey: passkey
+    """
+
+    @classmethod
+    def split_key(cls, key):
+        """Find entry of a stored key.
+
+        Args:
+            key (str): Prefixed key.
+
+        Returns:
+            tuple: Column group ("record", "passkey" or None) and name.
+        """
+
+        raise NotImplementedError
+
+    @classmethod
+    def join_key(cls, group, name):
+        """Stored key of an entry.
+
+        Args:
+            group (str): Column group ("record" or "passkey").
+            name  (str): Name of entry.
+
+        Returns:
+            str: Prefixed key.
+        """
+
+        raise NotImplementedError
+
+    @classmethod
+    def to_columns(cls, group, name, value):
+        """Split a stored value in columns.
+
+        Args:
+            group (str): Column group ("record" or "passkey").
+            name  (str): Name of entry.
+            value (str): Stored value.
+
+        Returns:
+            tuple: Columns of group or None if value cannot be rebuilt.
+        """
+
+        raise NotImplementedError
+
+    @classmethod
+    def from_columns(cls, group, name, row):
+        """Rebuild a stored value from columns.
+
+        Args:
+            group (str): Column group ("record" or "passkey").
+            name  (str): Name of entry.
+            row (tuple): Columns of group.
+
+        Returns:
+            str: Stored value.
+        """
+
+        raise NotImplementedError
+
+    @classmethod
+    def get_index_key(cls, column, signature):
+        """Index key written for entries not kept in columns.
+
+        Args:
+            column    (str): Indexed column (signature or jump_signature).
+            signature (str): Signature to match.
+
+        Returns:
+            str: Index key holding names of entries.
+        """
+
+        raise NotImplementedError
+
+    @classmethod
+    def split_names(cls, value):
+        """Names of entries stored under an index key.
+
+        Args:
+            value (str): Stored value of index key.
+
+        Returns:
+            list: Names of entries.
+        """
+
+        raise NotImplementedError
+
+
+class Backend(object):
+    """Keychain storage backend interface.
+
+    A backend is a dict-like object mapping prefixed keys to stored values,
+    as Keychain writes them. It must support "in", item get, set and delete
+    (get raises KeyError for missing keys), len, keys or iterkeys, and sync
+    and close to persist changes. Backends able to list keys by prefix
+    without a full scan may also support iterprefix.
+
+    Backends storing entries in columns read keys and values through the
+    layout registered by the layers above (see use_layout), instead of
+    importing them.
+
+    Arguments:
+        SECRETS_FILE (str): Filename of keychain inside secret directory.
+        SIDECAR_SUFFIXES (tuple): Suffixes of files kept next to keychain.
+        READER, WRITER (str): Open modes for readers and writers.
+        LOCKED_ERRNOS (tuple): Error numbers of storage locked by others.
+        layout (Layout): Layout of stored entries (None until registered).
+    """
+
+    SECRETS_FILE = None
+    SIDECAR_SUFFIXES = ()
+    READER, WRITER = "r", "c"
+    LOCKED_ERRNOS = (EAGAIN, EWOULDBLOCK)
+    layout = None
+
+    @classmethod
+    def use_layout(cls, layout):
+        """Register layout of stored entries for all backends.
+
+        Args:
+            layout (Layout): Layout of stored entries.
+        """
+
+        Backend.layout = layout
+
+    @classmethod
+    def open(cls, fullpath, mode):
+        """Open keychain storage.
+
+        Args:
+            fullpath (str): Path to keychain storage.
+            mode     (str): Open mode for readers or writers.
+
+        Raises:
+            Exception: If storage cannot be opened (e.g. it is locked).
+
+        Returns:
+            object: Dict-like storage.
+        """
+
+        raise NotImplementedError
+
+    @classmethod
+    def is_locked(cls, error):
+        """Tests whether storage failed to open because it is locked.
+
+        Args:
+            error (Exception): Error raised by open.
+
+        Returns:
+            bool: True if another process holds the storage, otherwise False.
+        """
+
+        code = getattr(error, "errno", None)
+        if code is None and len(getattr(error, "args", ())) > 0:
+            code = error.args[0]
+        return code in cls.LOCKED_ERRNOS
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from unlocker.backend.base import Backend
+
+from unlocker.util.log import Log
+
+
+class GdbmBackend(Backend):
+    """GNU dbm keychain backend.
+
+    Readers share the file with other readers and writers hold an exclusive
+    lock on it.
+    """
+
+    SECRETS_FILE = ".secrets"
+
+    # gdbm errors of files locked by other processes
+    LOCKED_ERRORS = ("Can't be reader", "Can't be writer")
+
+    @classmethod
+    def open(cls, fullpath, mode):
+        """Open gdbm keychain file.
+
+        Args:
+            fullpath (str): Path to keychain file.
+            mode     (str): Open mode for readers or writers.
+
+        Raises:
+            Exception: If gdbm is missing or file cannot be opened.
+
+        Returns:
+            object: Opened gdbm file.
+        """
+
+        try:
+            from gdbm import open as read_secrets
+        except ImportError:
+            Log.fatal("Missing dependency: gdbm module")
+        return read_secrets(fullpath, mode)
+
+    @classmethod
+    def is_locked(cls, error):
+        """Tests whether gdbm file failed to open because it is locked.
+
+        Args:
+            error (Exception): Error raised by open.
+
+        Returns:
+            bool: True if another process holds the file, otherwise False.
+        """
+
+        return super(GdbmBackend, cls).is_locked(error) or \
+            str(error) in cls.LOCKED_ERRORS
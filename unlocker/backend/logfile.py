@@ -0,0 +1,523 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from os import path, fsync, rename, urandom, close, open as open_fd
+from os import O_RDWR, O_CREAT
+from struct import Struct, error as StructError
+from zlib import crc32
+from mmap import mmap, ACCESS_READ
+from fcntl import flock, LOCK_SH, LOCK_EX, LOCK_NB, LOCK_UN
+
+from unlocker.backend.base import Backend
+
+from unlocker.util.log import Log
+
+
+def create(filepath):
+    """Create a file readable and writable only by its owner, if missing.
+
+    Args:
+        filepath (str): Path to file.
+    """
+
+    close(open_fd(filepath, O_RDWR | O_CREAT, 0600))
+
+
+class LogBackend(Backend):
+    """Append-only log-structured keychain backend.
+
+    Every change is appended to the log file as a length-prefixed record:
+      operation (1 byte), key length (4 bytes), value length (4 bytes), key,
+      value and CRC32 checksum (4 bytes) of all previous fields.
+
+    Removed keys are appended as records without a value. The log starts
+    with a header holding a random generation, changed on every compaction.
+
+    Stored values are read from a read-only memory map of the log, through
+    an in-memory hash index of keys to value offsets. The index is saved on
+    sync to a sidecar file, together with the generation and the size of
+    the log it covers, so only records appended after it are scanned on
+    open. A missing, stale or damaged sidecar is rebuilt by scanning the
+    whole log. Writers truncate a torn record at the end of the log (e.g.
+    after a crash while appending), while readers ignore it.
+
+    Readers share a lock on a sidecar lock file and writers hold it alone,
+    so the log can be replaced by a compacted copy while locked.
+
+    Arguments:
+        fullpath   (str): Path to log file.
+        read_only (bool): Whether keychain is opened for reading only.
+        index     (dict): Stored keys to value offset and length.
+        size       (int): Size of valid records in log.
+        garbage    (int): Size of records overwritten or removed.
+        dirty     (bool): Whether index changed since last saved.
+
+    Args:
+        fullpath   (str): Path to log file.
+        read_only (bool): Whether keychain is opened for reading only.
+    """
+
+    SECRETS_FILE = ".secrets.log"
+    INDEX_SUFFIX, LOCK_SUFFIX, COMPACT_SUFFIX = ".idx", ".lock", ".compact"
+    SIDECAR_SUFFIXES = (INDEX_SUFFIX, LOCK_SUFFIX, COMPACT_SUFFIX,
+                        INDEX_SUFFIX + COMPACT_SUFFIX)
+
+    MAGIC, INDEX_MAGIC = "UNLKLOG1", "UNLKIDX1"
+    GENERATION_SIZE = 8
+    HEADER_SIZE = len(MAGIC) + GENERATION_SIZE
+
+    # record operations
+    PUT, DEL = 1, 2
+
+    RECORD = Struct("<BII")
+    CHECKSUM = Struct("<I")
+    INDEX_HEADER = Struct("<QQ4s")
+    INDEX_ENTRY = Struct("<QII")
+
+    def __init__(self, fullpath, read_only=False):
+        self.fullpath = fullpath
+        self.read_only = read_only
+        self.index, self.size, self.garbage = {}, 0, 0
+        self.dirty = False
+        self.generation = None
+        self.fd, self.map, self.lock = None, None, None
+
+    @classmethod
+    def open(cls, fullpath, mode):
+        """Open log keychain file.
+
+        Args:
+            fullpath (str): Path to log file.
+            mode     (str): Open mode for readers or writers.
+
+        Raises:
+            Exception: If log is locked by another process or damaged.
+
+        Returns:
+            LogBackend: Opened keychain.
+        """
+
+        read_only = mode == cls.READER
+        if read_only and not path.exists(fullpath):
+            raise IOError("No such file or directory: {}".format(fullpath))
+        backend = cls(fullpath, read_only)
+        backend.acquire()
+        try:
+            backend.load()
+        except BaseException:
+            backend.release()
+            raise
+        return backend
+
+    def acquire(self):
+        """Lock keychain for readers (shared) or writers (exclusive).
+
+        Raises:
+            IOError: If keychain is locked by another process.
+        """
+
+        create(self.fullpath + self.LOCK_SUFFIX)
+        self.lock = open(self.fullpath + self.LOCK_SUFFIX, "rb")
+        try:
+            flock(self.lock.fileno(),
+                  (LOCK_SH if self.read_only else LOCK_EX) | LOCK_NB)
+        except IOError:
+            self.lock.close()
+            self.lock = None
+            raise
+
+    def release(self):
+        """Unlock keychain and close all files.
+        """
+
+        if self.map is not None:
+            self.map.close()
+        if self.fd is not None:
+            self.fd.close()
+        if self.lock is not None:
+            flock(self.lock.fileno(), LOCK_UN)
+            self.lock.close()
+        self.fd, self.map, self.lock = None, None, None
+
+    def load(self):
+        """Open log and rebuild index from sidecar and unindexed records.
+
+        Raises:
+            IOError: If log file is not a keychain log.
+        """
+
+        if self.read_only:
+            self.fd = open(self.fullpath, "rb")
+        else:
+            create(self.fullpath)
+            self.fd = open(self.fullpath, "r+b")
+        self.fd.seek(0, 2)
+        if self.fd.tell() < self.HEADER_SIZE and not self.read_only:
+            self.reset()  # new log or crashed while creating it
+        self.remap()
+        if self.map is None or self.map[:len(self.MAGIC)] != self.MAGIC:
+            raise IOError("Not a keychain log: {}".format(self.fullpath))
+        self.generation = self.map[len(self.MAGIC):self.HEADER_SIZE]
+        if not self.load_index():
+            self.index, self.size, self.garbage = {}, self.HEADER_SIZE, 0
+        end = self.scan()
+        if end < len(self.map):
+            Log.warn("Discarding {n} bytes of an incomplete write at the end "
+                     "of {p}", n=len(self.map) - end, p=self.fullpath)
+            if not self.read_only:
+                self.map.close()
+                self.map = None
+                self.fd.truncate(end)
+                fsync(self.fd.fileno())
+                self.remap()
+
+    def reset(self):
+        """Write an empty log with a new generation.
+        """
+
+        self.fd.seek(0)
+        self.fd.truncate(0)
+        self.fd.write(self.MAGIC + urandom(self.GENERATION_SIZE))
+        self.fd.flush()
+        fsync(self.fd.fileno())
+
+    def remap(self):
+        """Map log file in memory (after appending to it).
+        """
+
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if not self.read_only:
+            self.fd.flush()
+        self.fd.seek(0, 2)
+        if self.fd.tell() > 0:
+            self.map = mmap(self.fd.fileno(), 0, access=ACCESS_READ)
+
+    def scan(self):
+        """Index records appended after the indexed part of the log.
+
+        Returns:
+            int: Offset of the end of the last valid record.
+        """
+
+        offset, end = self.size, len(self.map)
+        while offset + self.RECORD.size <= end:
+            op, klen, vlen = self.RECORD.unpack_from(self.map, offset)
+            body = offset + self.RECORD.size
+            stop = body + klen + vlen + self.CHECKSUM.size
+            if op not in (self.PUT, self.DEL) or stop > end:
+                break
+            checksum, = self.CHECKSUM.unpack_from(self.map, stop -
+                                                  self.CHECKSUM.size)
+            if checksum != self.checksum(self.map[offset:stop -
+                                                  self.CHECKSUM.size]):
+                break
+            key = self.map[body:body + klen]
+            self.drop(key)
+            if op == self.PUT:
+                self.index[key] = (body + klen, vlen)
+            else:
+                self.garbage += stop - offset
+            offset = stop
+        if offset != self.size:
+            self.size, self.dirty = offset, True
+        return offset
+
+    def checksum(self, data):
+        """Unsigned CRC32 of record fields.
+
+        Args:
+            data (str): Record without checksum.
+
+        Returns:
+            int: Checksum.
+        """
+
+        return crc32(data) & 0xffffffff
+
+    def drop(self, key):
+        """Account the record of a key as garbage and unindex it.
+
+        Args:
+            key (str): Key as byte string.
+        """
+
+        if key in self.index:
+            offset, vlen = self.index.pop(key)
+            self.garbage += self.RECORD.size + len(key) + vlen + \
+                self.CHECKSUM.size
+
+    def get_index_path(self):
+        """Sidecar index file path getter.
+
+        Returns:
+            str: Path to index file.
+        """
+
+        return self.fullpath + self.INDEX_SUFFIX
+
+    def get_last_checksum(self, size):
+        """Checksum of the last record of the log up to a size.
+
+        Args:
+            size (int): Size of log.
+
+        Returns:
+            str: Packed checksum or an empty string if log has no records.
+        """
+
+        if size <= self.HEADER_SIZE:
+            return ""
+        if size > len(self.map):
+            self.remap()
+        return self.map[size - self.CHECKSUM.size:size]
+
+    def load_index(self):
+        """Load index saved to sidecar file.
+
+        The sidecar is used only if it belongs to the same generation of the
+        log, covers no more than the log holds and ends with the same record.
+
+        Returns:
+            bool: True if index was loaded, otherwise False.
+        """
+
+        index_path = self.get_index_path()
+        if not path.exists(index_path):
+            return False
+        with open(index_path, "rb") as fd:
+            data = fd.read()
+        head = len(self.INDEX_MAGIC) + self.GENERATION_SIZE
+        try:
+            size, garbage, last = self.INDEX_HEADER.unpack_from(data, head)
+            checksum, = self.CHECKSUM.unpack_from(data, len(data) -
+                                                  self.CHECKSUM.size)
+        except StructError:
+            return False
+        if data[:len(self.INDEX_MAGIC)] != self.INDEX_MAGIC \
+                or data[len(self.INDEX_MAGIC):head] != self.generation \
+                or size > len(self.map) \
+                or last != self.get_last_checksum(size) \
+                or checksum != self.checksum(data[:-self.CHECKSUM.size]):
+            return False
+        index, offset, end = {}, head + self.INDEX_HEADER.size, \
+            len(data) - self.CHECKSUM.size
+        while offset < end:
+            voff, vlen, klen = self.INDEX_ENTRY.unpack_from(data, offset)
+            offset += self.INDEX_ENTRY.size
+            index[data[offset:offset + klen]] = (voff, vlen)
+            offset += klen
+        self.index, self.size, self.garbage = index, size, garbage
+        return True
+
+    def save_index(self):
+        """Save index to sidecar file (replaced atomically).
+        """
+
+        parts = [self.INDEX_MAGIC, self.generation,
+                 self.INDEX_HEADER.pack(self.size, self.garbage,
+                                        self.get_last_checksum(self.size))]
+        for key, (voff, vlen) in self.index.iteritems():
+            parts.append(self.INDEX_ENTRY.pack(voff, vlen, len(key)))
+            parts.append(key)
+        data = "".join(parts)
+        temp_path = self.get_index_path() + self.COMPACT_SUFFIX
+        create(temp_path)
+        with open(temp_path, "wb") as fd:
+            fd.write(data + self.CHECKSUM.pack(self.checksum(data)))
+            fd.flush()
+            fsync(fd.fileno())
+        rename(temp_path, self.get_index_path())
+        self.dirty = False
+
+    def encode_key(self, key):
+        """Stored key as byte string.
+
+        Args:
+            key (str): Key.
+
+        Returns:
+            str: Key as byte string.
+        """
+
+        if isinstance(key, unicode):
+            return key.encode("utf-8")
+        return str(key)
+
+    def pack(self, op, key, value=""):
+        """Build a log record.
+
+        Args:
+            op    (int): Record operation.
+            key   (str): Key as byte string.
+            value (str): Stored value.
+
+        Returns:
+            str: Record with checksum.
+        """
+
+        record = self.RECORD.pack(op, len(key), len(value)) + key + value
+        return record + self.CHECKSUM.pack(self.checksum(record))
+
+    def append(self, record):
+        """Append record to log.
+
+        Args:
+            record (str): Record with checksum.
+
+        Raises:
+            IOError: If keychain is opened for reading only.
+
+        Returns:
+            int: Offset of record.
+        """
+
+        if self.read_only:
+            raise IOError("Reader can't store")
+        offset = self.size
+        self.fd.write(record)  # file position is always at end of log
+        self.size += len(record)
+        self.dirty = True
+        return offset
+
+    def __getitem__(self, key):
+        key = self.encode_key(key)
+        if key not in self.index:
+            raise KeyError(key)
+        offset, vlen = self.index.get(key)
+        if offset + vlen > len(self.map):
+            self.remap()
+        return self.map[offset:offset + vlen]
+
+    def __contains__(self, key):
+        return self.encode_key(key) in self.index
+
+    def __setitem__(self, key, value):
+        key, value = self.encode_key(key), str(value)
+        offset = self.append(self.pack(self.PUT, key, value))
+        self.drop(key)
+        self.index[key] = (offset + self.RECORD.size + len(key), len(value))
+
+    def __delitem__(self, key):
+        key = self.encode_key(key)
+        if key not in self.index:
+            raise KeyError(key)
+        record = self.pack(self.DEL, key)
+        self.append(record)
+        self.drop(key)
+        self.garbage += len(record)
+
+    def __len__(self):
+        return len(self.index)
+
+    def iterkeys(self):
+        """Iterate over all stored keys.
+
+        Yields:
+            str: Prefixed keys.
+        """
+
+        return iter(list(self.index))
+
+    def keys(self):
+        """All stored keys getter.
+
+        Returns:
+            list: Prefixed keys.
+        """
+
+        return list(self.index)
+
+    def stats(self):
+        """Log usage getter.
+
+        Returns:
+            tuple: Size of log and size of overwritten or removed records.
+        """
+
+        return self.size, self.garbage
+
+    def compact(self):
+        """Rewrite live records to a new log to reclaim space.
+
+        Live records are copied to a new generation of the log, which then
+        replaces the old one. A crash while compacting leaves the old log
+        in place.
+
+        Raises:
+            IOError: If keychain is opened for reading only.
+
+        Returns:
+            int: Number of bytes reclaimed.
+        """
+
+        if self.read_only:
+            raise IOError("Reader can't compact")
+        self.sync()
+        old_size = self.size
+        generation = urandom(self.GENERATION_SIZE)
+        temp_path = self.fullpath + self.COMPACT_SUFFIX
+        create(temp_path)
+        index, offset = {}, self.HEADER_SIZE
+        with open(temp_path, "wb") as fd:
+            fd.write(self.MAGIC + generation)
+            for key in sorted(self.index):
+                voff, vlen = self.index.get(key)
+                record = self.pack(self.PUT, key,
+                                   self.map[voff:voff + vlen])
+                fd.write(record)
+                index[key] = (offset + self.RECORD.size + len(key), vlen)
+                offset += len(record)
+            fd.flush()
+            fsync(fd.fileno())
+        self.map.close()
+        self.fd.close()
+        self.map = None
+        rename(temp_path, self.fullpath)
+        self.fd = open(self.fullpath, "r+b")
+        self.remap()
+        self.generation, self.index = generation, index
+        self.size, self.garbage = offset, 0
+        self.save_index()
+        Log.debug("Compacted {p} from {o} to {n} bytes", p=self.fullpath,
+                  o=old_size, n=offset)
+        return old_size - offset
+
+    def sync(self):
+        """Flush appended records to disk and save index.
+        """
+
+        if self.read_only or not self.dirty:
+            return
+        self.fd.flush()
+        fsync(self.fd.fileno())
+        self.save_index()
+
+    def close(self):
+        """Sync changes, unlock keychain and close files.
+        """
+
+        if self.lock is None:
+            return
+        self.sync()
+        self.release()
@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from sqlite3 import connect
+
+from unlocker.backend.base import Backend
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    name            TEXT PRIMARY KEY,
+    signature       TEXT,
+    ip              INTEGER,
+    port            INTEGER,
+    user            TEXT,
+    scheme          TEXT,
+    host            TEXT,
+    jump            TEXT,
+    jump_signature  TEXT,
+    passkey         BLOB
+);
+CREATE INDEX IF NOT EXISTS entries_signature ON entries (signature);
+CREATE INDEX IF NOT EXISTS entries_address ON entries (ip, port, user);
+CREATE INDEX IF NOT EXISTS entries_jump ON entries (jump_signature);
+CREATE TABLE IF NOT EXISTS kv (
+    key             TEXT PRIMARY KEY,
+    value           TEXT
+);
+"""
+
+COLUMNS = {
+    "record": ("signature", "ip", "port", "user", "scheme", "host", "jump",
+               "jump_signature"),
+    "passkey": ("passkey",),
+}
+
+
+class SqliteBackend(Backend):
+    """SQLite keychain backend with entries decomposed in columns.
+
+    Record and storage keys of an entry are kept as columns of a single row
+    (authority components, hostname, jump authority and passkey), indexed by
+    name, signature, address and jump signature, which answer Database
+    lookups by signature and of jump dependents, so Database writes no index
+    keys for them. Every other key (indexes, metadata, legacy layout) is kept
+    as is in a key-value table. Values that cannot be rebuilt byte by byte
+    from columns are kept in the key-value table too, so the backend is
+    lossless. Entries are split in columns with the registered layout, and
+    all keys are kept as is until a layout is registered.
+
+    The database runs in WAL mode: readers never block writers and see the
+    last committed state. Changes are committed on sync or close.
+
+    Arguments:
+        conn (Connection): SQLite connection.
+        read_only  (bool): Whether keychain is opened for reading only.
+
+    Args:
+        conn (Connection): SQLite connection.
+        read_only  (bool): Whether keychain is opened for reading only.
+    """
+
+    SECRETS_FILE = ".secrets.db"
+    SIDECAR_SUFFIXES = ("-wal", "-shm", "-journal")
+    TIMEOUT = 5.0
+    LOCKED_ERROR = "database is locked"
+
+    def __init__(self, conn, read_only=False):
+        self.conn = conn
+        self.read_only = read_only
+
+    @classmethod
+    def open(cls, fullpath, mode):
+        """Open SQLite keychain file.
+
+        Args:
+            fullpath (str): Path to keychain file.
+            mode     (str): Open mode for readers or writers.
+
+        Returns:
+            SqliteBackend: Opened keychain.
+        """
+
+        conn = connect(fullpath, timeout=cls.TIMEOUT)
+        conn.text_factory = str
+        if mode == cls.READER:
+            conn.execute("PRAGMA query_only = ON")
+            return cls(conn, True)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.executescript(SCHEMA)
+        return cls(conn)
+
+    @classmethod
+    def is_locked(cls, error):
+        """Tests whether SQLite file failed to open because it is locked.
+
+        Args:
+            error (Exception): Error raised by open.
+
+        Returns:
+            bool: True if another connection holds the file, otherwise False.
+        """
+
+        return str(error) == cls.LOCKED_ERROR
+
+    def split_key(self, key):
+        """Find where a key is stored.
+
+        Args:
+            key (str): Prefixed key.
+
+        Returns:
+            tuple: Column group ("record", "passkey" or None), name of entry
+                   and key as byte string.
+        """
+
+        if isinstance(key, unicode):
+            key = key.encode("utf-8")
+        if self.layout is None:
+            return None, None, key
+        group, name = self.layout.split_key(key)
+        return group, name, key
+
+    def get_columns(self, group):
+        """Column names getter.
+
+        Args:
+            group (str): Column group ("record" or "passkey").
+
+        Returns:
+            tuple: Names of columns.
+        """
+
+        return COLUMNS[group]
+
+    def is_indexed(self, key, value):
+        """Tests whether a value is indexed in columns once written.
+
+        Args:
+            key   (str): Prefixed key.
+            value (str): Stored value.
+
+        Returns:
+            bool: True if key is a record split in columns, otherwise False.
+        """
+
+        group, name, key = self.split_key(key)
+        return group == "record" and \
+            self.layout.to_columns(group, name, value) is not None
+
+    def get_kv(self, key):
+        """Raw value getter from key-value table.
+
+        Args:
+            key (str): Key as byte string.
+
+        Returns:
+            str: Stored value or None if missing.
+        """
+
+        row = self.conn.execute("SELECT value FROM kv WHERE key = ?",
+                                (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def __getitem__(self, key):
+        group, name, key = self.split_key(key)
+        value = self.get_kv(key)
+        if value is not None:
+            return value
+        if group is None:
+            raise KeyError(key)
+        columns = self.get_columns(group)
+        row = self.conn.execute(
+            "SELECT {} FROM entries WHERE name = ? AND {} IS NOT NULL".format(
+                ", ".join(columns), columns[0]), (name,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self.layout.from_columns(group, name, row)
+
+    def __contains__(self, key):
+        group, name, key = self.split_key(key)
+        if self.get_kv(key) is not None:
+            return True
+        if group is None:
+            return False
+        return self.conn.execute(
+            "SELECT 1 FROM entries WHERE name = ? AND {} IS NOT NULL".format(
+                self.get_columns(group)[0]), (name,)).fetchone() is not None
+
+    def __setitem__(self, key, value):
+        group, name, key = self.split_key(key)
+        if group is None:
+            self.conn.execute("INSERT OR REPLACE INTO kv VALUES (?, ?)",
+                              (key, value))
+            return
+        self.clear(group, name, key)
+        row = self.layout.to_columns(group, name, value)
+        if row is None:
+            self.conn.execute("INSERT INTO kv VALUES (?, ?)", (key, value))
+            return
+        self.conn.execute("INSERT OR IGNORE INTO entries (name) VALUES (?)",
+                          (name,))
+        self.conn.execute("UPDATE entries SET {} WHERE name = ?".format(
+            ", ".join("{} = ?".format(each)
+                      for each in self.get_columns(group))), row + (name,))
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        group, name, key = self.split_key(key)
+        if group is None:
+            self.conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+        else:
+            self.clear(group, name, key)
+
+    def clear(self, group, name, key):
+        """Remove record or passkey of an entry from both tables.
+
+        Args:
+            group (str): Column group ("record" or "passkey").
+            name  (str): Name of entry.
+            key   (str): Prefixed key as byte string.
+        """
+
+        self.conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+        self.conn.execute("UPDATE entries SET {} WHERE name = ?".format(
+            ", ".join("{} = NULL".format(each)
+                      for each in self.get_columns(group))), (name,))
+        self.conn.execute("DELETE FROM entries WHERE name = ? AND signature "
+                          "IS NULL AND passkey IS NULL", (name,))
+
+    def iterkeys(self):
+        """Iterate over all stored keys.
+
+        Yields:
+            str: Prefixed keys.
+        """
+
+        for group in ("record", "passkey") if self.layout else ():
+            for name, in self.conn.execute(
+                    "SELECT name FROM entries WHERE {} IS NOT NULL".format(
+                        self.get_columns(group)[0])):
+                yield self.layout.join_key(group, name)
+        for key, in self.conn.execute("SELECT key FROM kv"):
+            yield key
+
+    def iterprefix(self, prefix):
+        """Iterate over stored keys starting with a prefix.
+
+        Keys are found with range queries on primary keys, without reading
+        any other key. Keys are UTF-8 encoded, so no key continues a prefix
+        with a 0xff byte.
+
+        Args:
+            prefix (str): Prefix of keys.
+
+        Yields:
+            str: Prefixed keys.
+        """
+
+        if isinstance(prefix, unicode):
+            prefix = prefix.encode("utf-8")
+        for group in ("record", "passkey") if self.layout else ():
+            group_prefix = self.layout.join_key(group, "")
+            if prefix.startswith(group_prefix):
+                start = prefix[len(group_prefix):]
+            elif group_prefix.startswith(prefix):
+                start = ""
+            else:
+                continue
+            for name, in self.conn.execute(
+                    "SELECT name FROM entries WHERE name >= ? AND name < ? "
+                    "AND {} IS NOT NULL".format(self.get_columns(group)[0]),
+                    (start, start + "\xff")):
+                yield group_prefix + name
+        for key, in self.conn.execute(
+                "SELECT key FROM kv WHERE key >= ? AND key < ?",
+                (prefix, prefix + "\xff")):
+            yield key
+
+    def keys(self):
+        """All stored keys getter.
+
+        Returns:
+            list: Prefixed keys.
+        """
+
+        return list(self.iterkeys())
+
+    def __len__(self):
+        return self.conn.execute(
+            "SELECT (SELECT COUNT(signature) + COUNT(passkey) FROM entries) "
+            "+ (SELECT COUNT(*) FROM kv)").fetchone()[0]
+
+    def find_indexed(self, column, signature):
+        """Names of entries matching a signature column.
+
+        Records kept in columns are found through the index of the column,
+        while other entries (legacy layout, records kept as is) are found
+        through the index key of the key-value table, as Database writes it.
+
+        Args:
+            column    (str): Indexed column (signature or jump_signature).
+            signature (str): Signature to match.
+
+        Returns:
+            list: Sorted names of matching entries or None without layout.
+        """
+
+        if self.layout is None:
+            return None
+        names = set(name for name, in self.conn.execute(
+            "SELECT name FROM entries WHERE {} = ?".format(column),
+            (signature,)))
+        value = self.get_kv(self.layout.get_index_key(column, signature))
+        if value is not None:
+            names.update(self.layout.split_names(value))
+        return sorted(names)
+
+    def find_by_signature(self, signature):
+        """Names of entries with an authority signature.
+
+        Args:
+            signature (str): Authority signature.
+
+        Returns:
+            list: Sorted names of matching entries.
+        """
+
+        return self.find_indexed("signature", signature)
+
+    def find_dependents(self, signature):
+        """Names of entries bouncing through a jump server.
+
+        Args:
+            signature (str): Signature of the jump server.
+
+        Returns:
+            list: Sorted names of matching entries.
+        """
+
+        return self.find_indexed("jump_signature", signature)
+
+    def sync(self):
+        """Commit pending changes.
+        """
+
+        if not self.read_only:
+            self.conn.commit()
+
+    def close(self):
+        """Commit pending changes and close connection.
+        """
+
+        if self.conn is None:
+            return
+        self.sync()
+        self.conn.close()
+        self.conn = None
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from sys import stdin, stdout
+from json import dumps, loads
+from StringIO import StringIO
+
+from unlocker.manager import Manager
+from unlocker.display import Display
+
+from unlocker.util.secret import Secret, confidential
+from unlocker.util.log import Log
+
+
+class Batch(object):
+    """Run many options against one open keychain.
+
+    Commands are JSON objects on separate lines with an option and arguments,
+    the same ones the CLI accepts:
+      {"option": "lookup", "args": {"name": "server_one_x"}}
+
+    Passkeys cannot be prompted for, since STDIN is the stream of commands,
+    so options saving a passkey must provide it as a "passkey" argument, with
+    the same value that would have been typed (password or path to private
+    key). Each command gets a JSON result on a separate line, in order:
+      {"line": 1, "option": "lookup", "ok": true, "output": "..."}
+      {"line": 2, "option": "remove", "ok": false, "error": "..."}
+
+    In transaction mode all changes are staged and written at once with a
+    single sync at the end. The first failed command stops the batch and
+    drops every change.
+
+    Arguments:
+        transaction (bool): Whether to run all commands in a transaction.
+        source    (object): File-like object to read commands from.
+        target    (object): File-like object to write results to.
+        total        (int): Number of commands run.
+        failures     (int): Number of commands failed.
+
+    Args:
+        transaction (bool): Whether to run all commands in a transaction.
+        source    (object): File-like object to read commands from.
+        target    (object): File-like object to write results to.
+    """
+
+    UNSUPPORTED_OPTIONS = ("migrate",)
+
+    # options prompting for a passkey unless it is provided
+    PASSKEY_OPTIONS = ("append", "update")
+
+    def __init__(self, transaction=False, source=stdin, target=stdout):
+        self.transaction = transaction
+        self.source, self.target = source, target
+        self.total, self.failures = 0, 0
+
+    def start(self):
+        """Open keychain, run all commands and close keychain.
+
+        Raises:
+            Exception: If any command failed.
+        """
+
+        confidential(self.run)()
+        if self.failures == 0:
+            return
+        if self.transaction:
+            error = "Transaction rolled back: command on line {n} failed"
+            Log.fatal(error, n=self.total)
+        error = "Failed {n} out of {t} batch commands"
+        Log.fatal(error, n=self.failures, t=self.total)
+
+    def run(self, secrets, read_only=False):
+        """Run all commands against a keychain.
+
+        Args:
+            secrets  (object): Dict-like object storage.
+            read_only  (bool): Whether storage is opened for reading only.
+        """
+
+        keychain = Manager.initialize(secrets, Secret.get_journal(),
+                                      read_only)
+        if self.transaction:
+            keychain.begin()
+        for line in iter(self.source.readline, ""):
+            if len(line.strip()) == 0:
+                continue
+            self.total += 1
+            result = self.handle(line)
+            result.update({"line": self.total})
+            self.target.write(dumps(result) + "\n")
+            self.target.flush()
+            if result.get("ok"):
+                continue
+            self.failures += 1
+            if self.transaction:
+                keychain.rollback()
+                return
+        if self.transaction:
+            keychain.commit()
+
+    def handle(self, command):
+        """Run a single command against the open keychain.
+
+        Args:
+            command (str): JSON encoded option and arguments.
+
+        Returns:
+            dict: Result of command with output or error message.
+        """
+
+        result = {"option": None, "ok": False}
+        Display.output = StringIO()
+        try:
+            data = loads(command)
+            option, args = data.get("option"), data.get("args") or {}
+            result.update({"option": option})
+            if option in self.UNSUPPORTED_OPTIONS:
+                Log.fatal("Unsupported batch option {o}", o=option)
+            if option in self.PASSKEY_OPTIONS and args.get("passkey") is None:
+                error = "Missing passkey for batch option {o} (passkeys " \
+                        "cannot be prompted for in batch mode)"
+                Log.fatal(error, o=option)
+            Manager(option, args).call()
+            result.update({"ok": True, "output": Display.output.getvalue()})
+        except (Exception, SystemExit) as e:
+            Log.debug("Batch command failed: {e}", e=str(e))
+            result.update({"error": str(e)})
+        finally:
+            Display.output = None
+        return result
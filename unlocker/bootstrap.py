@@ -20,30 +20,39 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+from os import path
+
 from unlocker.manager import Manager
 from unlocker.stream import StreamData
 
-from unlocker.util.secret import confidential
-from unlocker.util.shell import ShellParser
+from unlocker.util.secret import Secret, confidential
+from unlocker.util.profiler import Profiler
 from unlocker.util.log import Log
 
 
 @confidential
-def unlocker(secrets, args=()):
+def unlocker(secrets, args=(), read_only=False):
     """Manage unlocker's keychain.
 
     Can add, edit, delete and lookup keys.
     All keys stored are compressed and encoded.
+
+    Returns:
+        str: Result of the called option (see Manager.NEEDS_WRITE).
     """
 
     # register secrets on keychain
-    Manager.initialize(secrets)
+    keychain = Manager.initialize(secrets, Secret.get_journal(), read_only)
     Log.debug("Preparing to boot...")
 
     # initialize manager and parse arguments
     mng = Manager(*args)
-    mng.call()
+    with Log.span("command"):
+        result = mng.call()
+    Log.debug("Keychain metrics: {m}", m=keychain.metrics())
+    Log.report_spans()
     Log.debug("Preparing to exit...")
+    return result
 
 
 def read_input():
@@ -58,6 +67,7 @@ def read_input():
         return StreamData.OPTION, StreamData.parse()
 
     # initialize shell
+    from unlocker.util.shell import ShellParser
     shell = ShellParser()
     opts, args = shell.get_args()
     Log.debug("Running '{o}' with arguments: {a}", o=opts, a=args)
@@ -66,19 +76,45 @@ def read_input():
     return opts, vars(args)
 
 
+def run(forward=True):
+    """Read input and run unlocker.
+
+    Args:
+        forward (bool): Let a running agent answer read-only options.
+    """
+
+    # read input
+    args = read_input()
+
+    # let a running agent answer read-only options
+    if forward and path.exists(Secret.get_agent_socket()):
+        from unlocker.agent import Agent
+        if Agent.forward(*args):
+            return
+
+    # run unlocker with input args (readers share keychain)
+    result = unlocker(args=args, read_only=Manager.is_read_only(args[0]))
+
+    # run again with exclusive access if the option has to write
+    if result == Manager.NEEDS_WRITE:
+        Log.debug("Reopening keychain for writing...")
+        unlocker(args=args)
+
+
 def main():
     """Main callable function.
 
     Configure logging capabilities, read input from shell or stdin (can exit
-    fastly) and run unlocker manager.
+    fastly) and run unlocker manager. Profiled runs always use the local
+    keychain.
     """
 
     # configure log
     Log.configure()
     Log.debug("Running in debug mode...")
 
-    # read input
-    args = read_input()
-
-    # run unlocker with input args
-    unlocker(args=args)
+    # profile the whole run if requested
+    profiler = Profiler.from_argv()
+    if profiler is not None:
+        return profiler.run(run, forward=False)
+    run()
@@ -19,11 +19,15 @@ if [ -z "$HOME" ]; then
     echo "Cannot find your user's home directory..." && exit 1
 fi
 
-# set path to secrets
-SECRETS="$HOME/.unlocker/.secrets"
-
-# set path to encrypted secrets (same directory, different filename)
-LOCKED_SECRETS="$SECRETS.lock"
+# set paths to secrets of the configured keychain backend, to encrypted
+# secrets and to sidecar files of the backend (see "unlocker keychain")
+KEYCHAIN_PATHS="$(unlocker keychain 2> /dev/null)"
+if [ -z "$KEYCHAIN_PATHS" ]; then
+    echo "Cannot find path to secrets (is unlocker installed?)..." && exit 1
+fi
+SECRETS="$(echo "$KEYCHAIN_PATHS" | sed -n 1p)"
+LOCKED_SECRETS="$(echo "$KEYCHAIN_PATHS" | sed -n 2p)"
+SECRETS_SIDECARS="$(echo "$KEYCHAIN_PATHS" | sed -n '3,$p')"
 
 # clean close with error code
 close() {
@@ -54,6 +58,25 @@ is_installed() {
     return $FAILURE
 }
 
+# list filenames of sidecar files of secrets found on disk
+found_sidecars() {
+    echo "$SECRETS_SIDECARS" | while IFS= read -r sidecar; do
+        if [ -n "$sidecar" ] && [ -e "$sidecar" ]; then
+            basename "$sidecar"
+        fi
+    done
+}
+
+# remove secrets and their sidecar files
+remove_secrets() {
+    rm -f "$SECRETS" || return $FAILURE
+    echo "$SECRETS_SIDECARS" | while IFS= read -r sidecar; do
+        if [ -n "$sidecar" ]; then
+            rm -f "$sidecar" || exit $FAILURE
+        fi
+    done
+}
+
 # lock secrets if not already locked
 lock_secrets() {
     if file_exists "$LOCKED_SECRETS"; then
@@ -101,19 +124,34 @@ lock_secrets() {
         echo "Error: cannot find secrets on this system! Aborting..."
         close $ERROR_NO_SECRETS
     fi
-    gpg -o "$LOCKED_SECRETS" --symmetric --cipher-algo AES256 "$SECRETS"
+    local sidecars="$(found_sidecars)"
+    if [ -z "$sidecars" ]; then
+        gpg -o "$LOCKED_SECRETS" --symmetric --cipher-algo AES256 "$SECRETS"
+    else
+        # secrets are archived with their sidecar files (e.g. SQLite write-ahead log)
+        if ! is_installed tar; then
+            echo "Cannot archive secrets with their sidecar files:"
+            echo "\"tar\" is NOT installed! Please install \"tar\" and try again"
+            close $ERROR_MISSING_DEPS
+        fi
+        local archive="$LOCKED_SECRETS.tar"
+        tar -C "$(dirname "$SECRETS")" -cf "$archive" "$(basename "$SECRETS")" $sidecars && \
+            gpg -o "$LOCKED_SECRETS" --symmetric --cipher-algo AES256 "$archive"
+        local status=$?
+        rm -f "$archive"
+        [ "$status" = "0" ]
+    fi
     if [ "$?" != "0" ]; then
         echo "Error: failed to encrypt secrets..."
         echo "Error: please correct the errors above and try again"
         close $ERROR_CANNOT_ENCRYPT
     fi
-    rm -f "$SECRETS"
-    if [ "$?" = "0" ]; then
+    if remove_secrets; then
         echo "Secrets are now encrypted. Don't forget the password!"
     else
         echo "Secrets are now encrypted, but the old unencrypted secrets are still on disk"
-        echo "Cannot remove old secrets from: $SECRETS. It's recommended to delete this file"
-        echo "You can recover it by decrypting $LOCKED_SECRETS (try \"unlock help\")"
+        echo "Cannot remove old secrets from: $SECRETS (and its sidecar files). It's recommended to delete them"
+        echo "You can recover them by decrypting $LOCKED_SECRETS (try \"unlock help\")"
     fi
 }
 
@@ -3,11 +3,21 @@ if [ -z "$HOME" ]; then
     echo "Cannot find your user's home directory..." && exit 1
 fi
 
-# set path to secrets
-SECRETS="$HOME/.unlocker/.secrets"
+# set paths to secrets of the configured keychain backend, to encrypted
+# secrets and to sidecar files of the backend (see "unlocker keychain")
+KEYCHAIN_PATHS="$(unlocker keychain 2> /dev/null)"
+if [ -z "$KEYCHAIN_PATHS" ]; then
+    echo "Cannot find path to secrets (is unlocker installed?)..." && exit 1
+fi
+SECRETS="$(echo "$KEYCHAIN_PATHS" | sed -n 1p)"
+LOCKED_SECRETS="$(echo "$KEYCHAIN_PATHS" | sed -n 2p)"
+SECRETS_SIDECARS="$(echo "$KEYCHAIN_PATHS" | sed -n '3,$p')"
+
+# set path to unlocker agent socket (see "unlocker agent")
+AGENT_SOCKET="$HOME/.unlocker/.agent.sock"
 
-# set path to encrypted secrets (same directory, different filename)
-LOCKED_SECRETS="$SECRETS.lock"
+# set path to cache of resolved hostnames (see "unlocker dns-cache")
+DNS_CACHE="$HOME/.unlocker/.dns-cache"
 
 # define exit errors constants
 SUCCESS=0
@@ -138,6 +148,7 @@ global_ssh_tunnel() {
     local jump_host="$(read_param "$jump_record" $POS_HOST)"
     local jump_port="$(read_param "$jump_record" $POS_PORT)"
     local jump_user="$(read_param "$jump_record" $POS_USER)"
+    local jump_address="$(cached_address "$jump_host")"
 
     # get passkey for jump server and set back server passkey
     if ! save_passkey "$jump_name"; then
@@ -152,7 +163,7 @@ global_ssh_tunnel() {
     fi
 
     # create a tunnel and wait for 10 seconds for a connection to be made
-    ssh -f -L $local_port:$IPv4:$PORT -i $(temp_key_file) -p $jump_port ${jump_user}@${jump_host} sleep 10
+    ssh -f -L $local_port:$IPv4:$PORT -i $(temp_key_file) -p $jump_port -o HostKeyAlias=$jump_host ${jump_user}@${jump_address:-$jump_host} sleep 10
 
     # update global port
     PORT=$local_port
@@ -171,6 +182,33 @@ global_ssh_tunnel() {
     return $SUCCESS
 }
 
+# print a fresh cached IP address of a hostname (no lookup, no python startup)
+cached_address() {
+    local host address stamp negative ttl=0 now
+
+    if [ -z "$1" ] || [ ! -f "$DNS_CACHE" ]; then
+        return $FAILURE
+    fi
+    now="$(date +%s)"
+
+    # header line holds the TTL, then one tab-separated record per hostname
+    while IFS="$TAB" read -r host address stamp negative; do
+        if [ "x$host" = "x#" ]; then
+            ttl="${negative:-0}"
+        elif [ "x$host" = "x$1" ] && [ "x$negative" = "x0" ] && [ -n "$address" ]; then
+            case "$stamp$ttl" in
+                *[!0-9]*) return $FAILURE ;;
+            esac
+            if [ $((stamp + ttl)) -gt "$now" ]; then
+                echo "$address"
+                return $SUCCESS
+            fi
+            return $FAILURE
+        fi
+    done < "$DNS_CACHE"
+    return $FAILURE
+}
+
 # service cli helper
 build_args() {
     local args
@@ -200,6 +238,11 @@ unlock_server() {
         close $ERROR_NO_TUNNEL
     fi
 
+    # connect to cached address of hostname if any (hostname is kept for
+    # TLS and known hosts)
+    local address="$(cached_address "$HOST")"
+    local target="${address:-$HOST}"
+
     # detect connection protocol and call proper unlock method
     case $SCHEME in
 
@@ -208,6 +251,9 @@ unlock_server() {
             if ! is_installed curl; then
                 require_deps curl
             fi
+            if [ -n "$address" ]; then
+                CMD_ARGS="--resolve ${HOST}:${PORT}:${address} $CMD_ARGS"
+            fi
             curl $(build_args "${SCHEME}://${HOST}:${PORT} -u ${USER}:${PASSKEY}")
         }
         ;;
@@ -217,7 +263,7 @@ unlock_server() {
             if ! is_installed redis-cli; then
                 require_deps redis
             fi
-            redis-cli $(build_args "-h $HOST -p $PORT -a $PASSKEY")
+            redis-cli $(build_args "-h $target -p $PORT -a $PASSKEY")
         }
         ;;
 
@@ -226,7 +272,7 @@ unlock_server() {
             if ! is_installed mongo; then
                 require_deps mongodb-org
             fi
-            mongo $(build_args "--username $USER --password $PASSKEY --host $HOST --port $PORT")
+            mongo $(build_args "--username $USER --password $PASSKEY --host $target --port $PORT")
         }
         ;;
 
@@ -236,7 +282,7 @@ unlock_server() {
                 require_deps postgresql
             fi
             export PGPASSWORD="$PASSKEY"
-            psql $(build_args "-h $HOST -p $PORT -U $USER")
+            psql $(build_args "-h $target -p $PORT -U $USER")
             unset PGPASSWORD
         }
         ;;
@@ -246,7 +292,7 @@ unlock_server() {
             if ! is_installed mysql; then
                 require_deps mysql-client
             fi
-            mysql $(build_args "-h $HOST -p$PASSKEY -P $PORT -u $USER")
+            mysql $(build_args "-h $target -p$PASSKEY -P $PORT -u $USER")
         }
         ;;
 
@@ -258,7 +304,7 @@ unlock_server() {
                         require_deps sshpass
                     fi
                     export SSHPASS="$PASSKEY"
-                    sshpass -e ssh $(build_args "${USER}@${HOST} -P ${PORT}")
+                    sshpass -e ssh $(build_args "-o HostKeyAlias=${HOST} ${USER}@${target} -P ${PORT}")
                     unset SSHPASS
                 }
                 ;;
@@ -266,7 +312,7 @@ unlock_server() {
                     if ! is_installed ssh; then
                         require_deps openssh-server
                     fi
-                    ssh $(build_args "-i $(temp_key_file) -p${PORT} ${USER}@${HOST}")
+                    ssh $(build_args "-i $(temp_key_file) -p${PORT} -o HostKeyAlias=${HOST} ${USER}@${target}")
                 }
                 ;;
                 *) {
@@ -299,20 +345,52 @@ decrypt_secrets() {
         close $ERROR_MISSING_DEPS
     fi
 
-    # decrypt secrets and delete the encrypted file
-    gpg -o "$SECRETS" --decrypt "$LOCKED_SECRETS"
+    # decrypt secrets next to the encrypted file
+    local decrypted="$LOCKED_SECRETS.out"
+    gpg -o "$decrypted" --decrypt "$LOCKED_SECRETS"
 
     # get exit code of decryption and don't delete the encrypted file if it failed
     if [ "$?" != "0" ]; then
+        rm -f "$decrypted"
         console err "Failed to decrypt secrets..."
         console "Closing..."
         close $ERROR_CANNOT_DECRYPT
+    fi
+
+    # sidecar files of overwritten plain secrets don't belong to decrypted secrets
+    remove_sidecars
+
+    # secrets locked with their sidecar files are archived (see lock script)
+    if is_installed tar && tar -tf "$decrypted" > /dev/null 2>&1; then
+        tar -C "$(dirname "$SECRETS")" -xf "$decrypted" && rm -f "$decrypted"
     else
-        rm -f "$LOCKED_SECRETS"  # it still outputs errors if any
-        console "Successfully decrypted..."
-        return $SUCCESS
+        mv "$decrypted" "$SECRETS"
     fi
-    return $FAILURE
+    if [ "$?" != "0" ]; then
+        console err "Failed to restore decrypted secrets from $decrypted..."
+        close $ERROR_CANNOT_DECRYPT
+    fi
+    rm -f "$LOCKED_SECRETS"  # it still outputs errors if any
+    console "Successfully decrypted..."
+    return $SUCCESS
+}
+
+# remove sidecar files of secrets
+remove_sidecars() {
+    echo "$SECRETS_SIDECARS" | while IFS= read -r sidecar; do
+        if [ -n "$sidecar" ]; then
+            rm -f "$sidecar"
+        fi
+    done
+}
+
+# move sidecar files of secrets next to a moved secrets file
+move_sidecars() {
+    echo "$SECRETS_SIDECARS" | while IFS= read -r sidecar; do
+        if [ -n "$sidecar" ] && [ -e "$sidecar" ]; then
+            mv "$sidecar" "$1${sidecar#"$SECRETS"}" || exit $FAILURE
+        fi
+    done
 }
 
 if [ -z "$1" ] && [ "$(ls -l "$LOCKED_SECRETS" 2> /dev/null | wc -l)" = "1" ]; then
@@ -365,7 +443,7 @@ if [ -z "$2" ]; then
 fi
 
 # dependency list
-DEPENDENCIES="unlocker python tail cat wc grep sed tr cut tee touch mkdir ls mv rm"
+DEPENDENCIES="unlocker python cat wc grep sed tr cut tee touch mkdir ls mv rm date awk"
 
 # save current working directory
 THIS_DIRECTORY=$(pwd)
@@ -373,8 +451,7 @@ THIS_DIRECTORY=$(pwd)
 # path to temporary directory
 TEMP_DIRECTORY=/tmp/.unlocker
 
-# unlocker all records
-UNLOCKER_TABLE=""
+# unlocker all records (one tab-separated record per line)
 UNLOCKER_LIST=""
 UNLOCKER_LAN=""
 
@@ -411,6 +488,9 @@ JUMP=""
 # credentials
 CREDENTIALS="SCHEME SERVER AUTH USER HOST PORT NAME PASSKEY"
 
+# field separator of records
+TAB="$(printf '\t')"
+
 # positional parameters
 POS_SIGN=1
 POS_JUMP=2
@@ -436,12 +516,65 @@ file_exists() {
     return $SUCCESS
 }
 
+# send request to unlocker agent if it's running (no python startup)
+agent_request() {
+    local response
+
+    # agent is not running or netcat is missing
+    if [ ! -S "$AGENT_SOCKET" ] || ! is_installed nc; then
+        return $FAILURE
+    fi
+
+    # successful responses start with "+" and failures with "-"
+    response="$(printf '%s\n' "$1" | nc -U "$AGENT_SOCKET" 2> /dev/null)"
+    case "$response" in
+        +*) {
+            echo "${response#+}"
+            return $SUCCESS
+        }
+        ;;
+    esac
+    return $FAILURE
+}
+
+# list known servers as tab-separated records through agent or unlocker
+unlocker_list() {
+    if ! agent_request '{"option": "list", "args": {"format": "tsv"}}'; then
+        unlocker list --format=tsv
+    fi
+}
+
+# print table of known servers through agent or unlocker
+unlocker_table() {
+    if ! agent_request '{"option": "list", "args": {"vertical": false}}'; then
+        unlocker list
+    fi
+}
+
+# escape backslashes and double quotes of a JSON string
+json_escape() {
+    printf '%s' "$1" | sed -e 's/\\/\\\\/g' -e 's/"/\\"/g'
+}
+
+# dump passkey through agent or unlocker
+unlocker_dump() {
+    local request=""
+
+    # control characters are not sent to agent (not valid in a JSON string)
+    case "$*" in
+        *[[:cntrl:]]*) ;;
+        *) request="{\"option\": \"stdout_dump\", \"args\": {\"stdin\": \"$(json_escape "$*")\"}}" ;;
+    esac
+    if [ -z "$request" ] || ! agent_request "$request"; then
+        echo "$@" | unlocker
+    fi
+}
+
 # create temporary unlocker file storage
 initialize() {
 
     # update unlocker servers table
-    UNLOCKER_TABLE="$(unlocker list)"
-    UNLOCKER_LIST="$(echo "$UNLOCKER_TABLE" | tail -n +3)"
+    UNLOCKER_LIST="$(unlocker_list)"
     if [ "$?" != "0" ]; then
         console err "Cannot refresh credentials list"
     else
@@ -487,9 +620,9 @@ safe_cleanup() {
 # save passkey into holder
 save_passkey() {
     if [ ! -z "$DEBUG" ]; then
-        PASSKEY=$(echo "$@" | unlocker)
+        PASSKEY=$(unlocker_dump "$@")
     else
-        PASSKEY=$(echo "$@" | unlocker 2> /dev/null) # TODO: can it be done better?
+        PASSKEY=$(unlocker_dump "$@" 2> /dev/null) # TODO: can it be done better?
     fi
 
     # check if unlocker had an ok exit code and we got a passkey...
@@ -523,7 +656,7 @@ save_passkey() {
 # extract param from given record
 read_param() {
     if [ $# -eq 2 ]; then
-        echo "$1" | cut -d "|" -f$2 | tr -d " "
+        echo "$1" | cut -f$2
         if [ "$?" != "0" ]; then
             console err "Cannot get record param $2 for $1 ..."
         fi
@@ -532,6 +665,16 @@ read_param() {
     fi
 }
 
+# print records of a scheme matching host (IPv4 address or hostname), user
+# and port by position (empty user or port match any)
+find_records() {
+    echo "$UNLOCKER_LIST" | awk -F "$TAB" -v scheme="$1" -v host="$2" \
+        -v user="$3" -v port="$4" -v ps=$POS_SCHEME -v pi=$POS_IPv4 \
+        -v ph=$POS_HOST -v pu=$POS_USER -v pp=$POS_PORT \
+        '$ps == scheme && ($pi == host || $ph == host) &&
+         (user == "" || $pu == user) && (port == "" || $pp == port)'
+}
+
 # go through all records and filter input
 query_unlocker() {
     local all="false"
@@ -549,10 +692,10 @@ query_unlocker() {
     fi
 
     # loop all known servers
-    echo "$UNLOCKER_LIST" | grep "$1" | while read line; do
+    echo "$UNLOCKER_LIST" | grep "$1" | while IFS= read -r line; do
         local name="$(read_param "$line" $pos)"
         if [ "x$name" = "x$1" ]; then
-            echo $line
+            echo "$line"
             if [ "x$all" != "xtrue" ]; then
                 break
             fi
@@ -629,7 +772,7 @@ scan_server_address() {
         if [ ! -z "$creds" ]; then
             USER=$(echo "$creds" | cut -d " " -f1)
             HOST=$(echo "$creds" | cut -d " " -f2)
-            local port="$(echo "$UNLOCKER_LIST" | grep "$SCHEME .* $HOST .* $USER")"
+            local port="$(find_records "$SCHEME" "$HOST" "$USER")"
             if [ -z "$port" ] || [ "$(echo "$port" | wc -l)" = "0" ]; then
                 console err "Cannot find port for address ${SCHEME}://${USER}@${HOST}"
                 return $FAILURE
@@ -642,7 +785,7 @@ scan_server_address() {
             if [ ! -z "$creds" ]; then
                 HOST=$(echo "$creds" | cut -d " " -f1)
                 PORT=$(echo "$creds" | cut -d " " -f2)
-                local user="$(echo "$UNLOCKER_LIST" | grep "$SCHEME .* $PORT .* $HOST")"
+                local user="$(find_records "$SCHEME" "$HOST" "" "$PORT")"
                 if [ -z "$user" ] || [ "$(echo "$user" | wc -l)" = "0" ]; then
                     console err "Cannot find user for address ${SCHEME}://${HOST}:${PORT}"
                     return $FAILURE
@@ -660,7 +803,7 @@ scan_server_address() {
             else
                 # nothing else to parse... it has to be the host
                 HOST=$1
-                local rest="$(echo "$UNLOCKER_LIST" | grep "$SCHEME .* $HOST")"
+                local rest="$(find_records "$SCHEME" "$HOST")"
                 if [ -z "$rest" ] || [ "$(echo "$rest" | wc -l)" = "0" ]; then
                     console err "Cannot find credentials for ${SCHEME}://${HOST}"
                     return $FAILURE
@@ -674,7 +817,7 @@ scan_server_address() {
                 if [ -z "$USER" ]; then
                     USER="$(read_param "$rest" $POS_USER | tr '\n' ' ' | cut -d " " -f1)"
                 fi
-                local port="$(echo "$UNLOCKER_LIST" | grep "$SCHEME .* $HOST .* $USER")"
+                local port="$(find_records "$SCHEME" "$HOST" "$USER")"
                 if [ -z "$port" ] || [ "$(echo "$port" | wc -l)" = "0" ]; then
                     console err "Cannot find port for address ${SCHEME}://${USER}@${HOST}"
                     return $FAILURE
@@ -695,7 +838,7 @@ scan_server_address() {
     fi
 
     # find the server alias
-    local record="$(echo "$UNLOCKER_LIST" | grep "$SCHEME .* $PORT .* $HOST .* $USER")"
+    local record="$(find_records "$SCHEME" "$HOST" "$USER" "$PORT")"
     local total="$(echo "$record" | wc -l)"
 
     if [ "$total" = "0" ]; then
@@ -737,7 +880,7 @@ find_server_address_or_name() {
     local warning
 
     # review known servers in debug mode
-    console "Printing unlockable servers table...\n$UNLOCKER_TABLE"
+    console "Printing unlockable servers records...\n$UNLOCKER_LIST"
 
     # exit if input is missing
     if [ -z "$1" ]; then
@@ -896,7 +1039,7 @@ find_server_address_or_name() {
         if [ "x$bounce" = "xyes" ]; then
             echo "Please select jump server from the list below"
             echo "Leave it blank to skip jump server..."
-            echo "$UNLOCKER_TABLE"
+            unlocker_table
             read -p "Type jump server (HASH): " jump
         fi
 
@@ -992,7 +1135,8 @@ unlock_secrets() {
                     # keep old plain secrets for analysis or something, maybe there
                     # are old credentials you migh want to keep...
                     4) {
-                        mv "$SECRETS" "$THIS_DIRECTORY/plain_secrets"
+                        mv "$SECRETS" "$THIS_DIRECTORY/plain_secrets" && \
+                            move_sidecars "$THIS_DIRECTORY/plain_secrets"
                         if [ "$?" = "0" ]; then
                             echo "Moved plain secrets file to current directory..."
                             if decrypt_secrets; then
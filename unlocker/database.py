@@ -20,6 +20,12 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+from zlib import decompress, error as ZlibError
+from base64 import b64decode
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from unlocker.backend.base import Backend, Layout
 from unlocker.keychain import Keychain
 from unlocker.authority import Authority
 
@@ -31,6 +37,24 @@ class Database(object):
     """Database common interface.
 
     Supports high-level and quick access to keychain.
+
+    Entries are stored in the v2 layout: one record key holding authority,
+    hostname, jump authority and a pointer to the storage key of passkey.
+    Entries stored in the legacy layout (separate authority, hostname and
+    jump keys) are transparently read until they are converted. Older
+    versions cannot read records, so keychains with records are stamped with
+    a newer version, which older versions refuse to open.
+
+    Indexes are kept inside the keychain as a key per signature holding the
+    sorted names of entries (e.g. signature index key = "s!" + signature),
+    so finding entries reads a single key on every backend. Changes made in
+    a transaction are gathered and each index key is written once, so bulk
+    imports don't rewrite an index for every entry. They are updated
+    by add, remove and update_jump_auth, and rebuilt from scratch on the
+    first write to a keychain without indexes. The dependency index maps the
+    signature of a jump server to names of entries bouncing through it.
+    Entries which storage indexes by itself (e.g. SQLite columns) get no
+    index keys.
     """
 
     # used by version key
@@ -39,8 +63,26 @@ class Database(object):
     # used as second character after a key type prefix
     SEPARATOR = "!"
 
-    # key type prefix (storage, auth, host, jump)
-    PASS, AUTH, HOST, JUMP = "$", "A", "h", "j"
+    # key type prefix (storage, auth, host, jump, record)
+    PASS, AUTH, HOST, JUMP, RECORD = "$", "A", "h", "j", "R"
+
+    # index and metadata key type prefix (signature, dependency, metadata)
+    SIGN, DEPS, META = "s", "d", "#"
+
+    # metadata key marking complete indexes and indexes version
+    INDEX, INDEX_VERSION = "index", "4"
+
+    # delimiter of names stored under an index key
+    INDEX_DELIMITER = "\n"
+
+    # indexes version suffix of storage indexing entries by itself
+    INDEX_STORAGE = "+storage"
+
+    # metadata key of counts and sizes of keys per type prefix
+    STATS = "stats"
+
+    # record fields delimiter and number of fields
+    RECORD_DELIMITER, RECORD_FIELDS = "\n", 4
 
     # minimum length of a prefix with separator
     PREFIX_FIXED_LEN = 2
@@ -49,8 +91,10 @@ class Database(object):
         if not isinstance(storage, Keychain):
             Log.fatal("Unexpected database storage {t}", t=type(storage))
         self.storage = storage
+        self.pending = None
+        self.storage.track_stats(self.get_meta_key(self.STATS))
         Log.debug("Database initialized...")
-        Log.debug("Storage status: {k}", k=str(storage))
+        Log.debug("Storage status: {k}", k=storage)
 
     def exists(self, name):
         """Tests whether a named authority exists in keychain.
@@ -128,6 +172,25 @@ class Database(object):
             Log.fatal("Expected jump to be authority, got {t}", t=type(auth))
         self.storage.add(self.get_jump_key(name), auth.read())
 
+    def add_record(self, name, auth, host=None, jump_auth=None):
+        """Create new record for named authority.
+
+        Args:
+            name            (str): Full name of the authority to add.
+            auth      (Authority): Authority instance to save to keychain.
+            host            (str): Hostname to save to keychain.
+            jump_auth (Authority): Jump authority instance to save to keychain.
+
+        Raises:
+            Exception: If named authority already exists in keychain.
+        """
+
+        if self.storage.has(self.get_record_key(name)) or \
+                self.storage.has(self.get_auth_key(name)):
+            Log.fatal("Cannot add record on a duplicate entry")
+        record = self.pack_record(name, auth, host, jump_auth)
+        self.storage.add(self.get_record_key(name), record)
+
     def update_passkey(self, name, passkey):
         """Update passkey for existing named authority.
 
@@ -144,7 +207,9 @@ class Database(object):
         self.storage.update(self.get_pass_key(name), passkey)
 
     def update_jump_auth(self, name, auth):
-        """Update passkey for existing named authority.
+        """Update jump authority for existing named authority.
+
+        Entries stored in the legacy layout are converted to a single record.
 
         Args:
             name       (str): Full name of the authority to add.
@@ -156,7 +221,18 @@ class Database(object):
 
         if not isinstance(auth, Authority):
             Log.fatal("Expected authority instance, got {t}", t=type(auth))
-        self.storage.update(self.get_jump_key(name), auth.read())
+        with self.transaction():
+            self.ensure_indexes()
+            record = self.fetch_record(name)
+            if record is None:
+                return self.storage.update(self.get_jump_key(name),
+                                           auth.read())
+            auth_, host, jump = record
+            self.unindex(name, auth_, jump)
+            self.convert(name)
+            record = self.pack_record(name, auth_, host, auth)
+            self.storage.update(self.get_record_key(name), record)
+            self.index(name, auth_, auth)
 
     def add(self, name, passkey, auth, host=None, jump_auth=None):
         """Create entry for named authority.
@@ -172,12 +248,39 @@ class Database(object):
             Exception: If any of the methods raise an exception.
         """
 
-        self.add_passkey(name, passkey)
-        self.add_auth(name, auth)
-        if host is not None:
-            self.add_host(name, host)
-        if jump_auth is not None:
-            self.add_jump(name, jump_auth)
+        with self.transaction():
+            if self.exists(name) or \
+                    self.storage.has(self.get_record_key(name)) or \
+                    self.storage.has(self.get_auth_key(name)):
+                Log.fatal("Cannot add duplicate entry: {n}", n=name)
+            self.ensure_indexes()
+            self.update_passkey(name, passkey)
+            record = self.pack_record(name, auth, host, jump_auth)
+            self.storage.update(self.get_record_key(name), record)
+            self.index(name, auth, jump_auth)
+
+    @contextmanager
+    def transaction(self):
+        """Stage all changes made inside a block and write them at once.
+
+        Index changes are kept aside until the outermost block ends, so each
+        index key is written once.
+
+        Yields:
+            Database: Self.
+        """
+
+        with self.storage.batch():
+            outer = self.pending is None
+            if outer:
+                self.pending = {}
+            try:
+                yield self
+                if outer:
+                    self.flush_indexes()
+            finally:
+                if outer:
+                    self.pending = None
 
     def remove_passkey(self, name):
         """Remove storage key containing passkey from keychain.
@@ -242,6 +345,8 @@ class Database(object):
     def remove(self, name):
         """Remove all keys from keychain for a named authority.
 
+        Legacy keys left next to a record are removed along with it.
+
         Args:
             name (str): Full name of the authority to remove.
 
@@ -252,11 +357,380 @@ class Database(object):
             Exception: If any of the methods used raise an exception.
         """
 
+        with self.transaction():
+            self.ensure_indexes()
+            record = self.fetch_record(name)
+            if record is not None:
+                auth, _, jump = record
+                self.unindex(name, auth, jump)
+            is_record = self.storage.has(self.get_record_key(name))
+            if is_record:
+                self.remove_record(name)
+            if self.storage.has(self.get_jump_key(name)):
+                self.remove_jump(name)
+            if not is_record or self.storage.has(self.get_host_key(name)):
+                self.remove_host(name)
+            if not is_record or self.storage.has(self.get_auth_key(name)):
+                self.remove_auth(name)
+            self.remove_passkey(name)
+
+    def remove_record(self, name):
+        """Remove record key containing the entry from keychain.
+
+        Args:
+            name (str): Full name of the authority to remove.
+
+        Outputs:
+            stdout: Prints a warning if the record key is not found.
+
+        Returns:
+            mixt: The record just removed (if found) or None.
+        """
+
+        return self.storage.remove(self.get_record_key(name))
+
+    def convert(self, name):
+        """Convert a named authority from legacy layout to a single record.
+
+        The record is written before the legacy keys are removed, so the
+        entry is readable at any point of the conversion.
+
+        Args:
+            name (str): Full name of the authority to convert.
+
+        Returns:
+            bool: True if entry was converted, otherwise False.
+        """
+
+        if self.storage.has(self.get_record_key(name)):
+            return False
+        if not self.storage.has(self.get_auth_key(name)):
+            return False
+        auth, host, jump = self.fetch_record(name)
+        record = self.pack_record(name, auth, host, jump)
+        self.storage.add(self.get_record_key(name), record)
         if self.storage.has(self.get_jump_key(name)):
             self.remove_jump(name)
-        self.remove_host(name)
+        if self.storage.has(self.get_host_key(name)):
+            self.remove_host(name)
         self.remove_auth(name)
-        self.remove_passkey(name)
+        return True
+
+    def convert_all(self):
+        """Convert all named authorities stored in legacy layout.
+
+        Returns:
+            int: Number of converted entries.
+        """
+
+        converted = 0
+        with self.transaction():
+            for each in self.storage.lookup(self.get_auth_prefix()):
+                if self.convert(self.shift(each)):
+                    converted += 1
+        Log.debug("Converted {n} entries to records...", n=converted)
+        return converted
+
+    def get_index_entries(self, auth, jump_auth=None):
+        """Index keys pointing to an entry.
+
+        Args:
+            auth      (Authority): Authority of the entry.
+            jump_auth (Authority): Jump authority of the entry.
+
+        Returns:
+            list: Prefixed index keys.
+        """
+
+        keys = [self.get_sign_key(auth.signature())]
+        if jump_auth is not None:
+            keys.append(self.get_deps_key(jump_auth.signature()))
+        return keys
+
+    def has_indexes(self):
+        """Tests whether indexes are complete and up to date.
+
+        Returns:
+            bool: True if indexes can be trusted, otherwise False.
+        """
+
+        marker = self.storage.read(self.get_meta_key(self.INDEX))
+        return marker == self.get_index_version()
+
+    def get_index_version(self):
+        """Indexes version getter.
+
+        Entries indexed by storage have no index keys, so their indexes are
+        not complete once copied to another kind of storage.
+
+        Returns:
+            str: Indexes version for the kind of storage.
+        """
+
+        if self.storage.can_find("find_by_signature"):
+            return self.INDEX_VERSION + self.INDEX_STORAGE
+        return self.INDEX_VERSION
+
+    def ensure_indexes(self):
+        """Build indexes if they are missing (e.g. older keychains).
+        """
+
+        if not self.has_indexes():
+            self.rebuild_indexes()
+
+    def convert_backend(self, backend):
+        """Copy entries to another backend and switch to it.
+
+        Indexes, their marker and statistics are left behind and built again
+        on the new keychain, since the backends do not store them alike.
+
+        Args:
+            backend (str): Name of backend to convert to.
+
+        Returns:
+            int: Number of keys copied.
+        """
+
+        derived = self.get_index_prefixes() + (
+            self.get_meta_key(self.INDEX), self.get_meta_key(self.STATS))
+
+        def rebuild(target):
+            database = Database(Keychain(target))
+            with database.transaction():
+                database.ensure_indexes()
+            database.storage.store_stats()
+
+        return Secret.convert_secrets(self.storage.keychain, backend,
+                                      derived=lambda key: key.startswith(
+                                          derived),
+                                      rebuild=rebuild)
+
+    def get_index_names(self, key):
+        """Names of entries found under an index key.
+
+        Names changed in the open transaction are returned as they will be
+        written, and can be changed in place.
+
+        Args:
+            key (str): Prefixed index key.
+
+        Returns:
+            list: Sorted names of entries.
+        """
+
+        if self.pending is not None and key in self.pending:
+            return self.pending[key]
+        value = self.storage.read(key)
+        return value.split(self.INDEX_DELIMITER) if value else []
+
+    def set_index_names(self, key, names):
+        """Write names of entries under an index key.
+
+        Names are written when the open transaction ends, if there is one.
+
+        Args:
+            key    (str): Prefixed index key.
+            names (list): Sorted names of entries.
+        """
+
+        if self.pending is not None:
+            self.pending[key] = names
+        elif len(names) > 0:
+            self.storage.update(key, self.INDEX_DELIMITER.join(names))
+        elif self.storage.has(key):
+            self.storage.remove(key)
+
+    def flush_indexes(self):
+        """Write index keys changed in the open transaction.
+        """
+
+        pending, self.pending = self.pending, None
+        for key, names in pending.iteritems():
+            self.set_index_names(key, names)
+        self.pending = pending
+
+    def index(self, name, auth, jump_auth=None):
+        """Add a named authority to indexes.
+
+        Args:
+            name            (str): Full name of the authority.
+            auth      (Authority): Authority of the entry.
+            jump_auth (Authority): Jump authority of the entry.
+        """
+
+        if self.storage.is_indexed(self.get_record_key(name)):
+            return
+        name = self.storage.index_key(name)
+        for key in self.get_index_entries(auth, jump_auth):
+            names = self.get_index_names(key)
+            position = bisect_left(names, name)
+            if position == len(names) or names[position] != name:
+                names.insert(position, name)
+                self.set_index_names(key, names)
+
+    def unindex(self, name, auth, jump_auth=None):
+        """Remove a named authority from indexes.
+
+        Args:
+            name            (str): Full name of the authority.
+            auth      (Authority): Authority of the entry.
+            jump_auth (Authority): Jump authority of the entry.
+        """
+
+        name = self.storage.index_key(name)
+        for key in self.get_index_entries(auth, jump_auth):
+            names = self.get_index_names(key)
+            if name in names:
+                names.remove(name)
+                self.set_index_names(key, names)
+
+    def build_indexes(self):
+        """Compute indexes from all entries not indexed by storage.
+
+        Returns:
+            dict: Prefixed index keys and names of entries.
+        """
+
+        indexes = {}
+        for name, auth, _, jump in self.query_all():
+            if self.storage.is_indexed(self.get_record_key(name)):
+                continue
+            for key in self.get_index_entries(auth, jump):
+                indexes.setdefault(key, []).append(
+                    self.storage.index_key(name))
+        for names in indexes.itervalues():
+            names.sort()
+        return indexes
+
+    def get_index_prefixes(self):
+        """Index prefixes getter.
+
+        Returns:
+            tuple: Prefixes of all index keys.
+        """
+
+        return (self.get_sign_prefix(), self.get_deps_prefix())
+
+    def rebuild_indexes(self):
+        """Drop and rebuild all indexes from scratch.
+
+        Returns:
+            int: Number of index keys written.
+        """
+
+        Log.debug("Rebuilding indexes...")
+        if self.pending is not None:
+            self.pending.clear()
+        for prefix in self.get_index_prefixes():
+            for key in self.storage.lookup(prefix):
+                self.storage.remove(key)
+        indexes = self.build_indexes()
+        for key, names in indexes.iteritems():
+            self.set_index_names(key, names)
+        self.storage.update(self.get_meta_key(self.INDEX),
+                            self.get_index_version())
+        Log.debug("Rebuilt {n} index keys...", n=len(indexes))
+        return len(indexes)
+
+    def verify_indexes(self):
+        """Compare stored indexes with indexes computed from entries.
+
+        Returns:
+            list: Problems found as human-readable messages.
+        """
+
+        if not self.has_indexes():
+            return ["indexes are missing or outdated"]
+        problems, stored_indexes = [], {}
+        expected = self.build_indexes()
+        for prefix in self.get_index_prefixes():
+            for key in self.storage.lookup(prefix):
+                stored_indexes[key] = self.get_index_names(key)
+        for key, stored in sorted(stored_indexes.iteritems()):
+            names = expected.pop(key, [])
+            if stored != names:
+                problems.append("{} points to {} instead of {}".format(
+                    key, ", ".join(stored), ", ".join(names) or "nothing"))
+        for key, names in expected.iteritems():
+            problems.append("{} is missing for {}".format(
+                key, ", ".join(names)))
+        return problems
+
+    def find_by_signature(self, signature):
+        """Find names of entries with a given authority signature.
+
+        Storage answers it if it indexes signatures (e.g. SQLite columns).
+        Falls back to scanning all authorities when indexes are missing, or
+        when storage cannot answer it during a transaction.
+
+        Args:
+            signature (str): Authority signature.
+
+        Returns:
+            list: Names of matching entries.
+        """
+
+        if self.has_indexes():
+            names = self.storage.find("find_by_signature", signature)
+            if names is not None:
+                return names
+            if not self.storage.can_find("find_by_signature"):
+                return list(self.get_index_names(
+                    self.get_sign_key(signature)))
+        Log.debug("Indexes unavailable, scanning authorities...")
+        return [name for auth, name in self.query_auth()
+                if auth.signature() == signature]
+
+    def find_dependents(self, signature):
+        """Find names of entries bouncing through a jump server.
+
+        Storage answers it if it indexes jump signatures (e.g. SQLite
+        columns). Falls back to scanning all jump authorities when indexes
+        are missing, or when storage cannot answer it during a transaction.
+
+        Args:
+            signature (str): Signature of the jump server.
+
+        Returns:
+            list: Names of entries jumping directly through the server.
+        """
+
+        if self.has_indexes():
+            names = self.storage.find("find_dependents", signature)
+            if names is not None:
+                return names
+            if not self.storage.can_find("find_dependents"):
+                return list(self.get_index_names(
+                    self.get_deps_key(signature)))
+        Log.debug("Indexes unavailable, scanning jump authorities...")
+        return [name for jump, name in self.query_jump()
+                if jump.signature() == signature]
+
+    def walk_dependents(self, name):
+        """Depth-first walk through all entries bouncing off a named entry.
+
+        Args:
+            name (str): Full name of the jump server entry.
+
+        Yields:
+            tuple: Depth, name and authority of dependent entry and a flag
+                   set if the entry was already reached (cycle).
+        """
+
+        visited = set([name])
+        signature = self.fetch_auth(name).signature()
+        stack = [(1, each) for each in
+                 reversed(self.find_dependents(signature))]
+        while len(stack) > 0:
+            depth, each = stack.pop()
+            auth = self.fetch_auth(each)
+            if each in visited:
+                yield depth, each, auth, True
+                continue
+            visited.add(each)
+            yield depth, each, auth, False
+            for child in reversed(self.find_dependents(auth.signature())):
+                stack.append((depth + 1, child))
 
     def fetch(self, name, query, key_name="name"):
         """Retieve entry from keychain for a named authority.
@@ -280,6 +754,51 @@ class Database(object):
                 return each
         Log.fatal("Cannot fetch unexisting {k}: {n}", n=name, k=key_name)
 
+    def fetch_record(self, name):
+        """Retrieve authority, hostname and jump authority of an entry.
+
+        Reads the record of the named authority or falls back to the keys of
+        the legacy layout.
+
+        Args:
+            name (str): Full name of the authority to fetch.
+
+        Returns:
+            tuple: Authority, hostname and jump authority or None if missing.
+        """
+
+        value = self.storage.read(self.get_record_key(name))
+        if value is not None:
+            auth, host, jump, _ = self.unpack_record(value)
+            return auth, host, jump
+        value = self.storage.read(self.get_auth_key(name))
+        if value is None:
+            return None
+        auth = Authority.recover(value)
+        host = self.storage.read(self.get_host_key(name))
+        jump = self.storage.read(self.get_jump_key(name))
+        if jump is not None:
+            jump = Authority.recover(jump)
+        return auth, host, jump
+
+    def fetch_passkey(self, name):
+        """Retrieve secret passkey of a named authority.
+
+        Args:
+            name (str): Full name of the authority to fetch.
+
+        Raises:
+            Exception: If entry is not found.
+
+        Returns:
+            str: Prefixed secret passkey.
+        """
+
+        secret = self.storage.read(self.get_pass_key(name))
+        if secret is None:
+            Log.fatal("Cannot fetch unexisting passkey: {n}", n=name)
+        return secret
+
     def fetch_auth(self, name):
         """Retieve authority from keychain for a named authority.
 
@@ -287,13 +806,16 @@ class Database(object):
             name (str): Full name of the authority to fetch.
 
         Raises:
-            Exception: If entry is not found or query is not callable.
+            Exception: If entry is not found.
 
         Returns:
             Authority: Authority to retrieve.
         """
 
-        return self.fetch(name, self.query_auth, "authority")
+        record = self.fetch_record(name)
+        if record is None:
+            Log.fatal("Cannot fetch unexisting authority: {n}", n=name)
+        return record[0]
 
     def fetch_host(self, name):
         """Retieve hostname from keychain for a named authority.
@@ -302,13 +824,20 @@ class Database(object):
             name (str): Full name of the authority to fetch.
 
         Raises:
-            Exception: If entry is not found or query is not callable.
+            Exception: If entry is not found.
 
         Returns:
             str: Hostname to retrieve.
         """
 
-        return self.fetch(name, self.query_host, "hostname")
+        value = self.storage.read(self.get_record_key(name))
+        if value is not None:
+            host = self.unpack_record(value)[1]
+        else:
+            host = self.storage.read(self.get_host_key(name))
+        if host is None:
+            Log.fatal("Cannot fetch unexisting hostname: {n}", n=name)
+        return host
 
     def fetch_jump(self, name):
         """Retieve jump authority from keychain for a named authority.
@@ -317,13 +846,22 @@ class Database(object):
             name (str): Full name of the authority to fetch.
 
         Raises:
-            Exception: If entry is not found or query is not callable.
+            Exception: If entry is not found.
 
         Returns:
             Authority: Jump authority to retrieve.
         """
 
-        return self.fetch(name, self.query_jump, "jump server")
+        value = self.storage.read(self.get_record_key(name))
+        if value is not None:
+            jump = self.unpack_record(value)[2]
+        else:
+            jump = self.storage.read(self.get_jump_key(name))
+            if jump is not None:
+                jump = Authority.recover(jump)
+        if jump is None:
+            Log.fatal("Cannot fetch unexisting jump server: {n}", n=name)
+        return jump
 
     def query(self, key_type_prefix):
         """Query secrets from keychain storage.
@@ -342,6 +880,18 @@ class Database(object):
                 Log.fatal("Storage contains empty value for key {k}", k=each)
             yield each
 
+    def query_records(self):
+        """Query records from keychain storage.
+
+        Yields:
+            tuple: Authority instance, hostname, jump auth and the named key.
+        """
+
+        for each in self.storage.lookup(self.get_record_prefix()):
+            value = self.storage.get_value(each)
+            auth, host, jump, _ = self.unpack_record(value)
+            yield auth, host, jump, self.shift(each)
+
     def query_auth(self):
         """Query authorities from keychain storage.
 
@@ -349,8 +899,12 @@ class Database(object):
             tuple: Authority instance and the named key.
         """
 
+        for auth, _, _, name in self.query_records():
+            yield auth, name
         for each in self.query(self.get_auth_prefix()):
             name = self.shift(each)
+            if self.storage.has(self.get_record_key(name)):
+                continue  # entry partially converted
             yield Authority.recover(self.storage.get_value(each)), name
 
     def query_host(self):
@@ -360,8 +914,13 @@ class Database(object):
             tuple: Hostname and the named key.
         """
 
+        for _, host, _, name in self.query_records():
+            if host is not None:
+                yield host, name
         for each in self.query(self.get_host_prefix()):
             name = self.shift(each)
+            if self.storage.has(self.get_record_key(name)):
+                continue  # entry partially converted
             yield self.storage.get_value(each), name
 
     def query_jump(self):
@@ -371,31 +930,34 @@ class Database(object):
             tuple: Jump authority instance and the named key.
         """
 
+        for _, _, jump, name in self.query_records():
+            if jump is not None:
+                yield jump, name
         for each in self.query(self.get_jump_prefix()):
             name = self.shift(each)
+            if self.storage.has(self.get_record_key(name)):
+                continue  # entry partially converted
             yield Authority.recover(self.storage.get_value(each)), name
 
     def query_all(self):
         """Query everything in relation to authority from keychain storage.
 
+        Entries stored as records need one read, while entries stored in
+        legacy layout need a read for each key.
+
         Yields:
             tuple: The named key, authority instance, hostname and jump auth.
         """
 
-        for each in self.query(self.get_pass_prefix()):
+        for each in self.storage.lookup(self.get_pass_prefix()):
             if len(each) <= self.PREFIX_FIXED_LEN:
                 continue
             name = self.shift(each)
-            auth = self.storage.get_value(self.get_auth_key(name))
-            authority = Authority.recover(auth)
-            host = None
-            if self.storage.has(self.get_host_key(name)):
-                host = self.storage.get_value(self.get_host_key(name))
-            jump_auth = None
-            if self.storage.has(self.get_jump_key(name)):
-                jump = self.storage.get_value(self.get_jump_key(name))
-                jump_auth = Authority.recover(jump)
-            yield name, authority, host, jump_auth
+            record = self.fetch_record(name)
+            if record is None:
+                Log.fatal("Storage is missing authority for {n}", n=name)
+            auth, host, jump_auth = record
+            yield name, auth, host, jump_auth
 
     def lookup(self, lookup_name):
         """Lookup a named authority and return self, hostname and secret.
@@ -410,11 +972,64 @@ class Database(object):
             tuple: Authority instance, hostname and secret passkey.
         """
 
-        for name, auth, host, jump in self.query_all():
-            if name == lookup_name:
-                secret = self.storage.get_value(self.get_pass_key(name))
-                return auth, host, secret
-        Log.fatal("Nothing found for name {n}", n=lookup_name)
+        record = self.fetch_record(lookup_name)
+        secret = self.storage.read(self.get_pass_key(lookup_name))
+        if record is None or secret is None:
+            Log.fatal("Nothing found for name {n}", n=lookup_name)
+        auth, host, _ = record
+        return auth, host, secret
+
+    def pack_record(self, name, auth, host=None, jump_auth=None):
+        """Serialize a record for a named authority.
+
+        Args:
+            name            (str): Full name of the authority.
+            auth      (Authority): Authority instance.
+            host            (str): Hostname of authority.
+            jump_auth (Authority): Jump authority instance.
+
+        Raises:
+            Exception: If arguments are not authorities or hostname is invalid.
+
+        Returns:
+            str: Record with all fields of the named authority.
+        """
+
+        if not isinstance(auth, Authority):
+            Log.fatal("Expected auth to be authority, got {t}", t=type(auth))
+        if jump_auth is not None and not isinstance(jump_auth, Authority):
+            Log.fatal("Expected jump to be authority, got {t}",
+                      t=type(jump_auth))
+        if host is not None and self.RECORD_DELIMITER in host:
+            Log.fatal("Invalid hostname: {h}", h=host)
+        fields = (
+            auth.read(),
+            host or u"",
+            jump_auth.read() if jump_auth is not None else u"",
+            self.get_pass_key(name),
+        )
+        return self.RECORD_DELIMITER.join(fields)
+
+    def unpack_record(self, record):
+        """Deserialize a record.
+
+        Args:
+            record (str): Stored record of a named authority.
+
+        Raises:
+            Exception: If record is corrupted.
+
+        Returns:
+            tuple: Authority, hostname, jump authority and storage key.
+        """
+
+        fields = record.split(self.RECORD_DELIMITER, self.RECORD_FIELDS - 1)
+        if len(fields) != self.RECORD_FIELDS or fields[0] == "":
+            Log.fatal("Storage contains corrupted record {r}", r=record)
+        auth, host, jump, pass_key = fields
+        auth = Authority.recover(auth)
+        jump = Authority.recover(jump) if jump != "" else None
+        return auth, host or None, jump, pass_key
 
     def shift(self, string):
         """Shift to the right a sting to remove any prefix.
@@ -514,6 +1129,81 @@ class Database(object):
 
         return self.get_prefix(self.JUMP)
 
+    def get_record_key(self, key):
+        """Record generator and getter.
+
+        Args:
+            key (str): Key to format and return with prefix.
+
+        Returns:
+            str: Prefixed record with record key prefix.
+        """
+
+        return "{}{}".format(self.get_record_prefix(), key)
+
+    def get_record_prefix(self):
+        """Record prefix getter.
+
+        Returns:
+            str: Prefix for record key.
+        """
+
+        return self.get_prefix(self.RECORD)
+
+    def get_sign_key(self, key):
+        """Signature index key generator and getter.
+
+        Args:
+            key (str): Authority signature to format and return with prefix.
+
+        Returns:
+            str: Prefixed signature with signature index key prefix.
+        """
+
+        return "{}{}".format(self.get_sign_prefix(), key)
+
+    def get_sign_prefix(self):
+        """Signature index prefix getter.
+
+        Returns:
+            str: Prefix for signature index key.
+        """
+
+        return self.get_prefix(self.SIGN)
+
+    def get_deps_key(self, key):
+        """Dependency index key generator and getter.
+
+        Args:
+            key (str): Jump server signature to format and return with prefix.
+
+        Returns:
+            str: Prefixed signature with dependency index key prefix.
+        """
+
+        return "{}{}".format(self.get_deps_prefix(), key)
+
+    def get_deps_prefix(self):
+        """Dependency index prefix getter.
+
+        Returns:
+            str: Prefix for dependency index key.
+        """
+
+        return self.get_prefix(self.DEPS)
+
+    def get_meta_key(self, key):
+        """Metadata key generator and getter.
+
+        Args:
+            key (str): Key to format and return with prefix.
+
+        Returns:
+            str: Prefixed metadata key.
+        """
+
+        return "{}{}".format(self.get_prefix(self.META), key)
+
     def get_auth_key(self, key):
         """Authority generator and getter.
 
@@ -535,6 +1225,23 @@ class Database(object):
 
         return self.get_prefix(self.AUTH)
 
+    def get_stats(self, scan=True):
+        """Statistics of stored keys per type getter.
+
+        Args:
+            scan (bool): Count all keys if statistics are not stored yet.
+
+        Returns:
+            list: Type of key, type prefix, count, key, raw and stored sizes
+                  for each type, or None if statistics are missing.
+        """
+
+        stats = self.storage.get_stats(scan)
+        if stats is None:
+            return None
+        return [tuple([self.which(prefix), prefix] + values)
+                for prefix, values in sorted(stats.iteritems())]
+
     def which(self, key):
         """Determine the type of a key.
 
@@ -553,4 +1260,163 @@ class Database(object):
             return "hostname"
         elif key.startswith(self.JUMP):
             return "jump server"
+        elif key.startswith(self.RECORD):
+            return "record"
+        elif key.startswith(self.SIGN):
+            return "signature index"
+        elif key.startswith(self.DEPS):
+            return "dependency index"
+        elif key.startswith(self.META):
+            return "metadata"
         return "unsupported"
+
+
+class RecordLayout(Layout):
+    """Layout of entries stored by Database, registered for backends.
+
+    Arguments:
+        GROUPS  (dict): Column groups by key type prefix.
+        INDEXES (dict): Index key type prefix by indexed column.
+    """
+
+    GROUPS = {Database.RECORD: "record", Database.PASS: "passkey"}
+    INDEXES = {"signature": Database.SIGN, "jump_signature": Database.DEPS}
+
+    @classmethod
+    def split_key(cls, key):
+        """Find entry of a record or storage key.
+
+        Args:
+            key (str): Prefixed key.
+
+        Returns:
+            tuple: Column group ("record", "passkey" or None) and name.
+        """
+
+        group = cls.GROUPS.get(key[:1])
+        if group is None or key[1:Database.PREFIX_FIXED_LEN] != \
+                Database.SEPARATOR:
+            return None, None
+        return group, key[Database.PREFIX_FIXED_LEN:]
+
+    @classmethod
+    def join_key(cls, group, name):
+        """Record or storage key of an entry.
+
+        Args:
+            group (str): Column group ("record" or "passkey").
+            name  (str): Name of entry.
+
+        Returns:
+            str: Prefixed key.
+        """
+
+        prefix = Database.RECORD if group == "record" else Database.PASS
+        return "{}{}{}".format(prefix, Database.SEPARATOR, name)
+
+    @classmethod
+    def decode(cls, value):
+        """Real value of a stored value if it is encoded as Keychain does.
+
+        Args:
+            value (str): Stored value.
+
+        Returns:
+            str: Real value or None if value cannot be encoded back as is.
+        """
+
+        try:
+            raw = decompress(b64decode(Keychain.split_value(value)[1]))
+        except (TypeError, ZlibError):
+            return None
+        return raw if Keychain.encode(raw) == value else None
+
+    @classmethod
+    def to_columns(cls, group, name, value):
+        """Split a stored record or passkey in columns.
+
+        Args:
+            group (str): Column group ("record" or "passkey").
+            name  (str): Name of entry.
+            value (str): Stored value.
+
+        Returns:
+            tuple: Columns of group or None if value cannot be rebuilt.
+        """
+
+        raw = cls.decode(value)
+        if raw is None:
+            return None
+        if group == "passkey":
+            return (buffer(raw),)
+        fields = raw.split(Database.RECORD_DELIMITER,
+                           Database.RECORD_FIELDS - 1)
+        if len(fields) != Database.RECORD_FIELDS:
+            return None
+        auth, host, jump, _ = fields
+        if auth.count(Authority.DELIMITER) != Authority.COMPONENTS:
+            return None
+        ip, port, user, scheme = auth.split(Authority.DELIMITER,
+                                            Authority.COMPONENTS)
+        try:
+            ip, port = int(ip), int(port)
+        except ValueError:
+            return None
+        jump_signature = Authority.sign(jump) if jump != "" else None
+        row = (Authority.sign(auth), ip, port, user, scheme, host or None,
+               jump or None, jump_signature)
+        if cls.from_columns(group, name, row) != value:
+            return None
+        return row
+
+    @classmethod
+    def from_columns(cls, group, name, row):
+        """Rebuild a stored record or passkey from columns.
+
+        Args:
+            group (str): Column group ("record" or "passkey").
+            name  (str): Name of entry.
+            row (tuple): Columns of group.
+
+        Returns:
+            str: Stored value.
+        """
+
+        if group == "passkey":
+            return Keychain.encode(str(row[0]))
+        _, ip, port, user, scheme, host, jump, _ = row
+        auth = Authority.DELIMITER.join((str(ip), str(port), user, scheme))
+        fields = (auth, host or "", jump or "", cls.join_key("passkey", name))
+        return Keychain.encode(Database.RECORD_DELIMITER.join(fields))
+
+    @classmethod
+    def get_index_key(cls, column, signature):
+        """Index key of entries with a signature.
+
+        Args:
+            column    (str): Indexed column (signature or jump_signature).
+            signature (str): Signature to match.
+
+        Returns:
+            str: Index key holding names of entries.
+        """
+
+        return "{}{}{}".format(cls.INDEXES[column], Database.SEPARATOR,
+                               signature)
+
+    @classmethod
+    def split_names(cls, value):
+        """Names of entries stored under an index key.
+
+        Args:
+            value (str): Stored value of index key.
+
+        Returns:
+            list: Names of entries (none if value is not encoded as is).
+        """
+
+        raw = cls.decode(value)
+        return raw.split(Database.INDEX_DELIMITER) if raw else []
+
+
+Backend.use_layout(RecordLayout)
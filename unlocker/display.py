@@ -23,13 +23,6 @@
 from os import environ
 from sys import stdout
 
-try:
-    if environ.get("NOPAGER", "") == "true":
-        raise ImportError("NOPAGER is set")
-    from click import echo_via_pager as print_page
-except ImportError:
-    def print_page(content): stdout.write(content.encode("utf-8"))
-
 from unlocker.util.log import Log
 
 
@@ -71,6 +64,36 @@ VERTICAL_LIST_TEMPLATE = u"""
       User: {user}
 """.encode("utf-8")
 
+DEPENDENT_TEMPLATE = u"""{indent}-> {name} ({sig}){cycle}""".encode("utf-8")
+
+TSV_LIST_FIELDS = ("sig", "jump", "proto", "ip4", "port", "host", "user",
+                   "name")
+
+# formats of list which stream one record per line (tabular is the default)
+STREAM_LIST_FORMATS = ("tsv", "jsonl", "null")
+
+STATS_TEMPLATE = u"""{name:<20} {keys:>5} {key_size:>10} {raw_size:>12} \
+{stored_size:>12} {avg_raw:>9} {avg_stored:>9} {ratio:>6}""".encode("utf-8")
+
+
+def print_page(content):
+    """Print content via pager if available, otherwise flush to stdout.
+
+    The pager is loaded on first use, only for interactive display.
+
+    Args:
+        content (unicode): Content to print.
+    """
+
+    if environ.get("NOPAGER", "") != "true":
+        try:
+            from click import echo_via_pager
+        except ImportError:
+            pass
+        else:
+            return echo_via_pager(content)
+    stdout.write(content.encode("utf-8"))
+
 
 class Display(object):
     """Pretty display manager.
@@ -81,6 +104,9 @@ class Display(object):
     DEFAULT_MESSAGE = "Nothing to show..."
     LINE_SEPARATOR = "\n"
 
+    # file-like object to collect content instead of printing it (optional)
+    output = None
+
     @classmethod
     def show(cls, content=None):
         """Display content in pager or flush to stdout.
@@ -101,7 +127,22 @@ class Display(object):
             content = cls.LINE_SEPARATOR.join(content)
         if not isinstance(content, (str, unicode)):
             Log.fatal("Cannot display non-string content")
-        print_page(content)
+        if cls.output is not None:
+            return cls.collect(content)
+        with Log.span("display"):
+            print_page(content)
+
+    @classmethod
+    def collect(cls, content):
+        """Write content to output collector as UTF-8 encoded string.
+
+        Args:
+            content (str): Content to collect.
+        """
+
+        if isinstance(content, unicode):
+            content = content.encode("utf-8")
+        cls.output.write(content)
 
     @classmethod
     def show_lookup(cls, auth, host, pass_type, passkey):
@@ -177,7 +218,8 @@ class Display(object):
             if jump is not None:
                 jump_server = " => {}".format(jump.signature())
             record = VERTICAL_LIST_TEMPLATE.format(
-                       sig=auth.signature(), host=host, ip=auth.get_host_ip4(),
+                       sig=auth.signature(), host=host or "",
+                       ip=auth.get_host_ip4(),
                        port=auth.get_port(), proto=auth.get_scheme(),
                        user=auth.get_user(), nr=len(content) + 1,
                        name=name, jump_server=jump_server)
@@ -187,7 +229,77 @@ class Display(object):
         cls.show(content)
 
     @classmethod
-    def show_list_view(cls, rows, vertical, **kwargs):
+    def stream_list_view(cls, rows, fmt):
+        """Write records from keychain one per line as they are read.
+
+        Unlike the table-like view, nothing is kept in memory, there is no
+        pager and records are not ordered by jump servers. The "tsv" format
+        has the same columns as the table-like view with no headers, the
+        "jsonl" format has one JSON object per line, and the "null" format
+        reads all records without writing anything.
+
+        Args:
+            rows (iter): Records from keychain.
+            fmt   (str): One of the streamed list formats.
+
+        Raises:
+            Exception: If an unsupported format is provided.
+
+        Output:
+            stdout: One line per record.
+        """
+
+        if fmt not in STREAM_LIST_FORMATS:
+            Log.fatal("Cannot stream list in {f} format", f=fmt)
+        if fmt == "jsonl":
+            from json import dumps
+        write = stdout.write if cls.output is None else cls.collect
+        for name, auth, host, jump in rows:
+            if fmt == "null":
+                continue
+            record = {
+                "sig": auth.signature(),
+                "jump": jump.signature() if jump is not None else "~",
+                "proto": auth.get_scheme(),
+                "ip4": auth.get_host_ip4(),
+                "port": auth.get_port(),
+                "host": host or "",
+                "user": auth.get_user(),
+                "name": name,
+            }
+            if fmt == "jsonl":
+                if jump is None:
+                    record["jump"] = None
+                line = dumps(record, sort_keys=True)
+            else:
+                fields = [record[each] for each in TSV_LIST_FIELDS]
+                line = "\t".join(map(cls.get_tsv_field, fields))
+            write(line + cls.LINE_SEPARATOR)
+
+    @staticmethod
+    def get_tsv_field(value):
+        """Format a value as a TSV field.
+
+        Tabs and line breaks are replaced with spaces so each record stays
+        on a single line.
+
+        Args:
+            value (mixt): Value of field.
+
+        Returns:
+            str: UTF-8 encoded field.
+        """
+
+        if isinstance(value, unicode):
+            value = value.encode("utf-8")
+        elif not isinstance(value, str):
+            value = str(value)
+        for each in ("\t", "\r", "\n"):
+            value = value.replace(each, " ")
+        return value
+
+    @classmethod
+    def show_list_view(cls, rows, vertical=False, **kwargs):
         """Display records from keychain in a table-like view.
 
         Args:
@@ -214,6 +326,7 @@ class Display(object):
         max_user_len = len(headers["user"])
         max_name_len = len(headers["name"])
         for name, auth, host, jump in rows:
+            host = host or ""
             if len(name) > max_name_len:
                 max_name_len = len(name)
             if len(host) > max_host_len:
@@ -263,6 +376,70 @@ class Display(object):
         content.append(cls.LINE_SEPARATOR)
         cls.show(content)
 
+    @classmethod
+    def show_dependents(cls, name, auth, dependents):
+        """Display tree of servers bouncing off a jump server.
+
+        Args:
+            name        (str): Name of the jump server.
+            auth  (Authority): Authority of the jump server.
+            dependents (iter): Depth, name, authority and cycle flag of
+                               each dependent.
+        """
+
+        content = ["{} ({})".format(name, auth.signature())]
+        for depth, each, each_auth, cycle in dependents:
+            content.append(DEPENDENT_TEMPLATE.format(
+                indent="  " * depth, name=each, sig=each_auth.signature(),
+                cycle=" (cycle)" if cycle else ""))
+        if len(content) == 1:
+            content.append("  No servers bounce off {}".format(name))
+        content = [each.decode("utf-8") if isinstance(each, str) else each
+                   for each in content]
+        cls.show(content)
+
+    @classmethod
+    def show_stats(cls, rows, file_size, free_space):
+        """Display counts and sizes of stored keys per type.
+
+        Sizes are in bytes. Raw sizes are of uncompressed values and stored
+        sizes of compressed and encoded values.
+
+        Args:
+            rows     (list): Type of key, type prefix, count, key, raw and
+                             stored sizes for each type.
+            file_size (int): Size of keychain file.
+            free_space (int): Estimated space not used by any key.
+        """
+
+        content = [STATS_TEMPLATE.format(
+            name="type", keys="keys", key_size="key size",
+            raw_size="raw size", stored_size="stored size",
+            avg_raw="avg raw", avg_stored="avg stored", ratio="ratio")]
+        total = ["total", "", 0, 0, 0, 0]
+        for row in list(rows) + [None]:
+            if row is None:
+                row = total
+            else:
+                for i in xrange(2, len(total)):
+                    total[i] += row[i]
+            name, prefix, keys, key_size, raw_size, stored_size = row
+            if prefix:
+                name = "{} ({})".format(name, prefix)
+            content.append(STATS_TEMPLATE.format(
+                name=name, keys=keys, key_size=key_size, raw_size=raw_size,
+                stored_size=stored_size,
+                avg_raw=raw_size // keys if keys else 0,
+                avg_stored=stored_size // keys if keys else 0,
+                ratio="{:.2f}".format(float(stored_size) / raw_size)
+                if raw_size else "-"))
+        content.append("")
+        content.append("File size: {} bytes, estimated free space: {} "
+                       "bytes".format(file_size, free_space))
+        content = [each.decode("utf-8") if isinstance(each, str) else each
+                   for each in content]
+        cls.show(content)
+
     @classmethod
     def show_dump(cls, passkey_dump):
         """Vulnerable passkey dump to stdout.
@@ -274,4 +451,6 @@ class Display(object):
             stdout: Base64 encoded passkey.
         """
 
+        if cls.output is not None:
+            return cls.collect(passkey_dump.strip())
         stdout.write(passkey_dump.strip())
@@ -20,8 +20,11 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-from zlib import compress, decompress
+from zlib import compress, decompress, error as ZlibError
 from base64 import b64encode, b64decode
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from contextlib import contextmanager
 
 from unlocker.util.log import Log
 
@@ -29,15 +32,82 @@ from unlocker.util.log import Log
 class Keychain(object):
     """Credentials storage wrapper.
 
+    Exact-key questions (has, get, remove) are answered directly by the
+    storage object, while prefix lookups are answered through a sorted index
+    of keys built on first use and maintained on every update and remove.
+
+    Writes can be staged in memory between begin and commit (or rollback),
+    so that a group of changes is written to storage all at once or not at
+    all. Staged removals are kept as None values. When a journal is set,
+    committed changes are written ahead to it so that a crash while applying
+    them can be recovered on next open.
+
+    Decoded values are kept in a size-bounded cache, evicting the least
+    recently used ones first, so that values read by many entries (e.g. jump
+    authorities) are decoded once per process.
+
+    When a statistics key is set, counts and sizes of keys grouped by their
+    first character (the type prefix) are maintained on every write and
+    stored under that key, so they can be read without scanning storage.
+    Values are stored with the size of their real value, so a write never
+    decodes the value it replaces. Values stored without a size by versions
+    before 2.3.0 are still read, while those versions cannot read sized
+    values and refuse keychains stamped with a newer version. Missing
+    statistics are not maintained until they are built with one scan (see
+    store_stats).
+
+    Prefix lookups are answered by the storage itself when it can list keys
+    by prefix (e.g. a range query on a primary key), otherwise from a sorted
+    index of all keys built with one scan.
+
+    Storage operations on hot paths are counted (full scans, prefix and
+    indexed queries and keys iterated, exact reads, writes and removals,
+    decoded values and bytes), so that tests can assert how much work an
+    operation does.
+
     Arguments:
         keychain (object): Storage dict-like object.
+        index      (list): Sorted list of stored keys (built on demand).
+        staged     (dict): Pending changes while a transaction is open.
+        cache (OrderedDict): Decoded values in least recently used order.
+        cache_size    (int): Max number of cached values (0 disables cache).
+        hits          (int): Number of values read from cache.
+        misses        (int): Number of values decoded from storage.
+        journal   (Journal): Write-ahead journal for commits (optional).
+        stats_key     (str): Key to store statistics under (optional).
+        stats        (dict): Type prefix to count, key, raw and stored sizes.
+        stats_dirty  (bool): Whether staged changes altered statistics.
+        stats_missing (bool): Whether statistics are known to be not stored.
+        counters     (dict): Number of storage operations by name.
 
     Args:
         holder   (object): Storage instance or object.
+        cache_size  (int): Max number of cached values (optional).
+        journal (Journal): Write-ahead journal for commits (optional).
     """
 
-    def __init__(self, holder):
+    CACHE_SIZE = 1024
+
+    # storage operations counted on hot paths
+    COUNTERS = ("scans", "ranges", "queries", "keys_iterated", "contains",
+                "gets", "puts", "deletes", "decodes", "bytes_decoded")
+
+    # statistics kept for each type of key
+    STATS_FIELDS = ("count", "key_size", "raw_size", "stored_size")
+
+    # separates size of real value from encoded value (not a base64 char)
+    SIZE_SEPARATOR = ":"
+
+    def __init__(self, holder, cache_size=CACHE_SIZE, journal=None):
         self.keychain = holder
+        self.index = None
+        self.staged = None
+        self.journal = journal
+        self.cache, self.cache_size = OrderedDict(), cache_size
+        self.hits, self.misses = 0, 0
+        self.stats_key, self.stats, self.stats_dirty = None, None, False
+        self.stats_missing = False
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
         Log.debug("Keychain initialized...")
 
     def add(self, key, value):
@@ -62,9 +132,10 @@ class Keychain(object):
             bool: True if keychain has key, otherwise False.
         """
 
-        for k in self.lookup(key, partial=False):
-            return True
-        return False
+        if self.staged is not None and key in self.staged:
+            return self.staged[key] is not None
+        self.counters["contains"] += 1
+        return key in self.keychain
 
     def get_value(self, key):
         """Returns real value for given key.
@@ -79,10 +150,131 @@ class Keychain(object):
             str: Uncompressed and decoded stored value for key.
         """
 
-        value = self.get(key)
+        value = self.read(key)
         if value is None:
             Log.fatal("Keychain does not have requested key")
-        return decompress(b64decode(value))
+        return value
+
+    def read(self, key):
+        """Returns real value for given key, from cache if possible.
+
+        Args:
+            key (str): Key to lookup and retrieve value.
+
+        Returns:
+            str: Uncompressed and decoded value or None if key is missing.
+        """
+
+        if key in self.cache:
+            self.hits += 1
+            value = self.cache[key] = self.cache.pop(key)
+            return value
+        value = self.get(key)
+        if value is None:
+            return None
+        self.misses += 1
+        value = self.decode(value)
+        if self.cache_size > 0:
+            self.cache[key] = value
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return value
+
+    def cache_info(self):
+        """Decoded values cache statistics getter.
+
+        Returns:
+            dict: Hits, misses, current size and max size of cache.
+        """
+
+        return {"hits": self.hits, "misses": self.misses,
+                "size": len(self.cache), "max_size": self.cache_size}
+
+    def metrics(self):
+        """Storage operation counters snapshot.
+
+        Returns:
+            dict: Number of storage operations by name, and cache hits and
+                  misses.
+        """
+
+        metrics = dict(self.counters)
+        metrics.update({"cache_hits": self.hits, "cache_misses": self.misses})
+        return metrics
+
+    def reset_metrics(self):
+        """Reset storage operation counters and cache statistics.
+        """
+
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.hits, self.misses = 0, 0
+
+    @classmethod
+    def encode(cls, value):
+        """Returns raw "as is" value to store for a real value.
+
+        Args:
+            value (str): Real value.
+
+        Returns:
+            str: Size of value followed by compressed and base64 value.
+        """
+
+        return "{}{}{}".format(len(value), cls.SIZE_SEPARATOR,
+                               b64encode(compress(value)))
+
+    @classmethod
+    def split_value(cls, value):
+        """Split a raw "as is" stored value without decoding it.
+
+        Values stored by older versions have no size of real value.
+
+        Args:
+            value (str): Raw stored value.
+
+        Returns:
+            tuple: Size of real value (or None if unknown) and base64 value.
+        """
+
+        size, separator, encoded = value.rpartition(cls.SIZE_SEPARATOR)
+        if not separator or not size.isdigit():
+            return None, encoded
+        return int(size), encoded
+
+    def decode(self, value):
+        """Returns real value for a raw "as is" stored value.
+
+        Args:
+            value (str): Raw stored value.
+
+        Returns:
+            str: Uncompressed and decoded value.
+        """
+
+        self.counters["decodes"] += 1
+        self.counters["bytes_decoded"] += len(value)
+        with Log.span("decode"):
+            return decompress(b64decode(self.split_value(value)[1]))
+
+    def raw_size(self, value):
+        """Size of real value for a raw "as is" stored value.
+
+        Only values stored by older versions are decoded.
+
+        Args:
+            value (str): Raw stored value.
+
+        Raises:
+            Exception: If value is not stored by keychain.
+
+        Returns:
+            int: Size of uncompressed and decoded value.
+        """
+
+        size, _ = self.split_value(value)
+        if size is None:
+            size = len(self.decode(value))
+        return size
 
     def get(self, key):
         """Returns "as is" value for given key.
@@ -97,9 +289,13 @@ class Keychain(object):
             str: Raw "as is" base64 stored value for key.
         """
 
-        if not self.has(key):
+        if self.staged is not None and key in self.staged:
+            return self.staged[key]
+        self.counters["gets"] += 1
+        try:
+            return self.keychain[key]
+        except KeyError:
             return None
-        return self.keychain[key]
 
     def update(self, key, value):
         """Update key in keychain.
@@ -109,7 +305,19 @@ class Keychain(object):
             value (str): Value to save for given key.
         """
 
-        self.keychain[key] = b64encode(compress(value))
+        raw_size = len(value)
+        value = self.encode(value)
+        self.account(key, value, raw_size)
+        is_new_key = self.index is not None and not self.has(key)
+        self.cache.pop(key, None)
+        if self.staged is not None:
+            self.staged[key] = value
+        else:
+            self.counters["puts"] += 1
+            self.keychain[key] = value
+        if is_new_key:
+            insort(self.index, self.index_key(key))
+        self.save_stats()
 
     def remove(self, key):
         """Remove key from keychain.
@@ -122,29 +330,405 @@ class Keychain(object):
         """
 
         value = self.get(key)
+        if value is not None:
+            self.account(key)
+        self.cache.pop(key, None)
         if value is None:
             Log.warn("Keychain can not remove an unset key")
+        elif self.staged is not None:
+            self.staged[key] = None
+            self.unindex(key)
         else:
+            self.counters["deletes"] += 1
             del self.keychain[key]
+            self.unindex(key)
+        self.save_stats()
         return value
 
+    def track_stats(self, key):
+        """Maintain statistics of keys and store them under a key.
+
+        Args:
+            key (str): Key to store statistics under.
+        """
+
+        self.stats_key = key
+
+    def is_tracked(self, key):
+        """Tests whether a key is counted in statistics.
+
+        Args:
+            key (str): Key to test.
+
+        Returns:
+            bool: True if statistics are tracked and key is not their own.
+        """
+
+        return self.stats_key is not None and \
+            self.index_key(key) != self.index_key(self.stats_key)
+
+    def get_stats(self, scan=True):
+        """Statistics of keys getter.
+
+        Args:
+            scan (bool): Count all keys if statistics are not stored yet.
+
+        Returns:
+            dict: Type prefix to list of count, key, raw and stored sizes,
+                  or None if statistics are missing and scan is disabled.
+        """
+
+        if self.stats is None and not self.stats_missing:
+            value = self.get(self.stats_key) if self.stats_key else None
+            if value is not None:
+                self.stats = {}
+                for line in self.decode(value).splitlines():
+                    fields = line.split(" ")
+                    self.stats[fields[0]] = [int(each) for each in fields[1:]]
+            else:
+                self.stats_missing = True
+        if self.stats is None and scan:
+            self.stats = self.build_stats()
+            self.stats_dirty = self.stats_key is not None
+        return self.stats
+
+    def store_stats(self):
+        """Build missing statistics with a scan and store them.
+
+        Returns:
+            dict: Type prefix to list of count, key, raw and stored sizes.
+        """
+
+        stats = self.get_stats()
+        self.save_stats()
+        return stats
+
+    def build_stats(self):
+        """Count all keys and their sizes with a scan of storage.
+
+        Values not stored by keychain (e.g. version of storage) are skipped.
+
+        Returns:
+            dict: Type prefix to list of count, key, raw and stored sizes.
+        """
+
+        stats = {}
+        for key in list(self.get_index()):
+            if not self.is_tracked(key):
+                continue
+            value = self.get(key)
+            try:
+                raw_size = self.raw_size(value)
+            except (TypeError, ZlibError):
+                continue
+            self.add_stats(stats, key, value, raw_size, 1)
+        Log.debug("Counted {n} key type(s)...", n=len(stats))
+        return stats
+
+    def add_stats(self, stats, key, value, raw_size, sign):
+        """Add or subtract a stored key from statistics.
+
+        Args:
+            stats  (dict): Statistics to change.
+            key     (str): Stored key.
+            value   (str): Raw "as is" stored value.
+            raw_size (int): Size of uncompressed and decoded value.
+            sign    (int): 1 to add key, -1 to subtract it.
+        """
+
+        key = self.index_key(key)
+        counters = stats.setdefault(key[:1], [0] * len(self.STATS_FIELDS))
+        for i, size in enumerate((1, len(key), raw_size, len(value))):
+            counters[i] += sign * size
+        if counters[0] == 0:
+            del stats[key[:1]]
+
+    def account(self, key, value=None, raw_size=0):
+        """Update statistics with a key about to be written or removed.
+
+        Missing statistics (e.g. of a new keychain) are counted from scratch
+        first, so they are stored along with the first change.
+
+        Args:
+            key      (str): Key to write or remove.
+            value    (str): Raw "as is" value to store (None to remove).
+            raw_size (int): Size of uncompressed and decoded value.
+        """
+
+        if not self.is_tracked(key):
+            return
+        stats = self.get_stats()
+        old = self.get(key)
+        if old is not None:
+            try:
+                old_size = self.raw_size(old)
+            except (TypeError, ZlibError):
+                old_size = None
+            if old_size is not None:
+                self.add_stats(stats, key, old, old_size, -1)
+        if value is not None:
+            self.add_stats(stats, key, value, raw_size, 1)
+        self.stats_dirty = True
+
+    def save_stats(self):
+        """Store changed statistics (staged ones are stored on commit).
+        """
+
+        if not self.stats_dirty or self.staged is not None:
+            return
+        self.stats_dirty = False
+        self.update(self.stats_key, self.dump_stats())
+
+    def dump_stats(self):
+        """Serialize statistics, one type of key per line.
+
+        Returns:
+            str: Type prefix followed by counters on each line.
+        """
+
+        return "\n".join(" ".join([prefix] + [str(each) for each in values])
+                         for prefix, values in sorted(self.stats.items()))
+
     def lookup(self, key, partial=True):
         """Lookup key in keychain.
 
+        Exact lookups go straight to storage, while partial lookups query
+        storage by prefix if supported (until the sorted index of keys is
+        built) or run a binary search on the sorted index of keys.
+
         Args:
-            key (str): Key to lookup.
+            key      (str): Key to lookup.
+            partial (bool): Whether to match key as a prefix or not.
 
         Yields:
             str: Yields exact key(s) if found.
         """
 
-        if hasattr(self.keychain, "iterkeys"):
-            iterator = self.keychain.iterkeys
-        else:
-            iterator = self.keychain.keys
-        for k in iterator():
-            if key == k or (partial and k.startswith(key)):
+        if not partial:
+            if self.has(key):
+                yield key
+            return
+        prefix = self.index_key(key)
+        if self.index is None and hasattr(self.keychain, "iterprefix"):
+            self.counters["ranges"] += 1
+            keys = self.merge_staged(set(
+                self.index_key(k) for k in self.keychain.iterprefix(prefix)),
+                prefix)
+            self.counters["keys_iterated"] += len(keys)
+            for k in sorted(keys):
                 yield k
+            return
+        keys = self.get_index()
+        start = end = bisect_left(keys, prefix)
+        while end < len(keys) and keys[end].startswith(prefix):
+            end += 1
+        for k in keys[start:end]:  # copy allows changes while iterating
+            yield k
+
+    def find(self, query, *args):
+        """Run an indexed query of storage, if storage supports it.
+
+        Storage does not see staged changes, so queries are not run while a
+        transaction is open.
+
+        Args:
+            query (str): Name of storage method (e.g. "find_by_signature").
+            args  (list): Arguments of query.
+
+        Returns:
+            list: Query result or None if storage cannot answer it.
+        """
+
+        method = getattr(self.keychain, query, None)
+        if method is None or self.staged is not None:
+            return None
+        self.counters["queries"] += 1
+        return method(*args)
+
+    def can_find(self, query):
+        """Tests whether storage supports an indexed query.
+
+        Args:
+            query (str): Name of storage method (e.g. "find_by_signature").
+
+        Returns:
+            bool: True if storage has the query, otherwise False.
+        """
+
+        return hasattr(self.keychain, query)
+
+    def is_indexed(self, key):
+        """Tests whether storage indexes the value of a key by itself.
+
+        Args:
+            key (str): Key to lookup.
+
+        Returns:
+            bool: True if storage indexes the value, otherwise False.
+        """
+
+        method = getattr(self.keychain, "is_indexed", None)
+        if method is None:
+            return False
+        value = self.get(key)
+        return value is not None and method(key, value)
+
+    def get_index(self):
+        """Sorted index of keys getter.
+
+        The index is built once from storage and kept in sync afterwards.
+
+        Returns:
+            list: Sorted list of all keys from keychain.
+        """
+
+        if self.index is None:
+            if hasattr(self.keychain, "iterkeys"):
+                iterator = self.keychain.iterkeys
+            else:
+                iterator = self.keychain.keys
+            self.counters["scans"] += 1
+            keys = set(self.index_key(k) for k in iterator())
+            self.counters["keys_iterated"] += len(keys)
+            self.index = sorted(self.merge_staged(keys))
+            Log.debug("Indexed {n} key(s)...", n=len(self.index))
+        return self.index
+
+    def merge_staged(self, keys, prefix=""):
+        """Apply staged additions and removals to a set of stored keys.
+
+        Args:
+            keys    (set): Keys found in storage (changed in place).
+            prefix  (str): Only staged keys with this prefix are applied.
+
+        Returns:
+            set: Keys including staged changes.
+        """
+
+        for k, v in (self.staged or {}).iteritems():
+            k = self.index_key(k)
+            if not k.startswith(prefix):
+                continue
+            if v is None:
+                keys.discard(k)
+            else:
+                keys.add(k)
+        return keys
+
+    def unindex(self, key):
+        """Remove key from the sorted index of keys, if index is built.
+
+        Args:
+            key (str): Key to remove from index.
+        """
+
+        if self.index is None:
+            return
+        key = self.index_key(key)
+        position = bisect_left(self.index, key)
+        if position < len(self.index) and self.index[position] == key:
+            del self.index[position]
+
+    def index_key(self, key):
+        """Normalize key to be stored in index.
+
+        Storage returns keys as byte strings, so unicode keys are encoded
+        to keep the index consistently ordered.
+
+        Args:
+            key (str): Key to normalize.
+
+        Returns:
+            str: Byte string key.
+        """
+
+        if isinstance(key, unicode):
+            return key.encode("utf-8")
+        return key
+
+    def begin(self):
+        """Start staging changes in memory.
+
+        Raises:
+            Exception: If a transaction is already open.
+        """
+
+        if self.staged is not None:
+            Log.fatal("Keychain transaction already open")
+        self.staged = {}
+        Log.debug("Keychain transaction open...")
+
+    def commit(self):
+        """Write staged changes to storage and sync it once.
+
+        Returns:
+            int: Number of keys written or removed.
+        """
+
+        if self.staged is None:
+            Log.fatal("Keychain transaction not open")
+        if self.stats_dirty:
+            self.stats_dirty = False
+            self.staged[self.stats_key] = self.encode(self.dump_stats())
+            self.cache.pop(self.stats_key, None)
+        staged, self.staged = self.staged, None
+        if len(staged) == 0:
+            return 0
+        if self.journal is not None:
+            self.journal.write(staged)
+        for key, value in staged.iteritems():
+            if value is not None:
+                self.counters["puts"] += 1
+                self.keychain[key] = value
+            elif key in self.keychain:
+                self.counters["deletes"] += 1
+                del self.keychain[key]
+        if hasattr(self.keychain, "sync"):
+            self.keychain.sync()
+        if self.journal is not None:
+            self.journal.clear()
+        Log.debug("Keychain committed {n} change(s)...", n=len(staged))
+        return len(staged)
+
+    def rollback(self):
+        """Drop staged changes.
+
+        Returns:
+            int: Number of changes dropped.
+        """
+
+        staged, self.staged = self.staged or {}, None
+        self.index = None  # index includes staged keys
+        self.cache.clear()  # cache includes staged values
+        self.stats, self.stats_dirty = None, False
+        self.stats_missing = False
+        Log.debug("Keychain dropped {n} change(s)...", n=len(staged))
+        return len(staged)
+
+    @contextmanager
+    def batch(self):
+        """Stage changes made inside a block and commit them at once.
+
+        Changes are dropped if the block raises. A block inside an already
+        open transaction joins it and is committed with it.
+
+        Yields:
+            Keychain: Self.
+        """
+
+        if self.staged is not None:
+            yield self
+            return
+        self.begin()
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            raise
+        self.commit()
 
     def __repr__(self):
-        return "[{} key(s) stored]".format(len(self.keychain))
+        stats = self.get_stats(scan=False)
+        if stats is None:
+            return "[keychain without statistics]"
+        return "[{} key(s) stored]".format(sum(v[0] for v in stats.values()))
@@ -20,15 +20,13 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-from uuid import uuid4
-
 from unlocker.authority import Authority
 from unlocker.keychain import Keychain
 from unlocker.database import Database
-from unlocker.migrate import Migrate
-from unlocker.display import Display
+from unlocker.display import Display, STREAM_LIST_FORMATS
 
 from unlocker.util.service import Service
+from unlocker.util.graph import JumpGraph
 from unlocker.util.passkey import Passkey
 from unlocker.util.log import Log
 
@@ -39,34 +37,32 @@ class Manager(object):
     The Manager is a dispatcher for various call options, such as saving
     passkeys and removing them or lookup.
 
-    There are four possible keys to be accessed by the manager:
+    There are two keys to be accessed by the manager for each entry:
       1) storage keys: used to store passkeys (passwords or private keys);
-      2) authority keys: used to save authority instances;
-      3) host keys: used to keep track of the hostname of an authority;
-      4) jump keys: used to keep track of relationships between authorities.
+      2) record keys: used to save the authority, its hostname, the optional
+         jump authority and a pointer to the storage key in one place.
 
-    It's mandatory for the manager to always orchestrate storage, authority and
-    host keys. Without there three, the keychain is considered to be corrupted.
+    It's mandatory for the manager to always orchestrate storage and record
+    keys. Without these two, the keychain is considered to be corrupted, so
+    both are always written in a single transaction: changes are staged,
+    written ahead to a journal and applied with a single sync. A crash while
+    applying them is recovered from the journal on next open.
 
     A saved passkey is prefixed with the passkey's type in a "storage key"
     where a storage key is a known named authority.
       let "storage_key" be "storage_prefix" + "named authority"
       e.g. storage_key = passkey_type + actual_passkey
 
-    Authority keys are similar to storage_key, except the content stored is
-    compacted by the Authority layer.
-      let "auth_key" be "auth_prefix" + "named authority"
-      e.g. auth_key = component_authority_formatted_string
-
-    Hostnames are saved in hostnames keys as plain strings.
-      let "hostname_key" be "hostname_prefix" + "named authority"
-      e.g. hostname_key = localhost
+    Record keys hold the authority compacted by the Authority layer, the
+    hostname as plain string, the jump authority (if any) and the storage key
+    of the passkey. The optional jump authorities point to another authority
+    from the keychain and are used for tunneling or bouncing.
+      let "record_key" be "record_prefix" + "named authority"
+      e.g. record_key = authority \n hostname \n jump_authority \n storage_key
 
-    The optional jump authority keys are saved in jump keys pointing to another
-    authority from the keychain. These jump authorities are used for tunneling
-    or bouncing.
-      let "jump_key" be "jump_prefix" + "named authority"
-      e.g. jump_key = another_component_authority_formatted_string
+    Older keychains saved authorities, hostnames and jump authorities in
+    separate authority, host and jump keys. Such entries are still readable
+    and can be converted to records with "migrate --convert".
 
     Arguments:
         __secrets (Keychain): Authority and passwords database.
@@ -77,7 +73,7 @@ class Manager(object):
         auth (Authority): Current authority working with.
     """
 
-    __secrets, __database = None, None
+    __secrets, __database, __read_only = None, None, False
 
     supported_options = {
         # option        access level
@@ -89,12 +85,22 @@ class Manager(object):
         "lookup":       "read_only",
         "recall":       "read_only",
         "list":         "read_only",
+        "index":        "read_write",
+        "compact":      "read_write",
+        "stats":        "read_only",
+        "dependents":   "read_only",
         "dump":         "debug_read",
         "purge":        "debug_write",
+        "metrics":      "debug_write",
         "stdout_dump":  "secret_read",
     }
 
-    MAX_ITER_LIST = 2**16
+    # access levels that never write to keychain
+    READ_ONLY_ACCESS = ("read_only", "secret_read", "debug_read")
+
+    # returned by read-only options that need to run again read-write
+    NEEDS_WRITE = "needs_write"
+
     MIN_NAME_LEN, MAX_NAME_LEN = 10, 42  # meaning of life
 
     def __init__(self, option, args):
@@ -103,16 +109,36 @@ class Manager(object):
         self.auth = None
 
     @classmethod
-    def initialize(cls, secrets):
+    def initialize(cls, secrets, journal=None, read_only=False):
         """Register keychain to manager's database.
 
         Args:
-            secrets (object): Dict-like object storage.
+            secrets  (object): Dict-like object storage.
+            journal (Journal): Write-ahead journal for commits (optional).
+            read_only  (bool): Whether storage is opened for reading only.
+
+        Returns:
+            Keychain: Registered keychain.
         """
 
-        cls.__secrets = Keychain(secrets)
+        cls.__secrets = Keychain(secrets, journal=journal)
         cls.__database = Database(cls.__secrets)
+        cls.__read_only = read_only
         Log.debug("Manager initialized...")
+        return cls.__secrets
+
+    @classmethod
+    def is_read_only(cls, option):
+        """Tests whether an option only reads from keychain.
+
+        Args:
+            option (str): Manager operation.
+
+        Returns:
+            bool: True if option never writes, otherwise False.
+        """
+
+        return cls.supported_options.get(option) in cls.READ_ONLY_ACCESS
 
     def get_secrets(self):
         """Keychain getter.
@@ -171,9 +197,8 @@ class Manager(object):
             Authority: The authority with the signature provided.
         """
 
-        for each, _ in self.get_db().query_auth():
-            if each.signature() == signature:
-                return each
+        for name in self.get_db().find_by_signature(signature):
+            return self.get_db().fetch_auth(name)
         Log.fatal("Cannot find authority for signature {s}", s=signature)
 
     def build_random_name(self):
@@ -183,6 +208,7 @@ class Manager(object):
             str: Random 16 characters.
         """
 
+        from uuid import uuid4
         name = uuid4().hex[:16]
         Log.debug("Generating new random name: {n}", n=name)
         return name
@@ -225,11 +251,10 @@ class Manager(object):
         Log.debug("Searching secret passkey for key {s}", s=signature)
         if len(signature) < self.MIN_NAME_LEN:
             Log.debug("Trying key as authority signature...")
-            for name, auth, _, _ in self.get_db().query_all():
-                if auth.signature() == signature:
-                    Log.debug("Got authority with signature {s}", s=signature)
-                    signature = name
-                    break
+            for name in self.get_db().find_by_signature(signature):
+                Log.debug("Got authority with signature {s}", s=signature)
+                signature = name
+                break
         Log.debug("Running a lookup for named authority: {n}", n=signature)
         self.call_read_only_lookup_option(signature)
 
@@ -251,21 +276,22 @@ class Manager(object):
         Log.debug("Testing if key {s} exists", s=signature)
         if len(signature) < self.MIN_NAME_LEN:
             Log.debug("Trying key as authority signature...")
-            for name, auth, _, _ in self.get_db().query_all():
-                if auth.signature() == signature:
-                    Log.debug("Got authority with signature {s}", s=signature)
-                    signature = name
-                    break
+            for name in self.get_db().find_by_signature(signature):
+                Log.debug("Got authority with signature {s}", s=signature)
+                signature = name
+                break
         Log.debug("Running cleanup after named authority: {n}", n=signature)
         self.call_read_write_remove_option(signature)
 
     def call_read_write_update_option(self, name, auth, jump_server=None,
-                                      **kwargs):
+                                      passkey=None, **kwargs):
         """Update secrets for an existing named authority.
 
         Args:
-            name (str): The name of the authority to lookup.
-            auth (str): Authentification method.
+            name        (str): The name of the authority to lookup.
+            auth        (str): Authentification method.
+            jump_server (str): Name or signature of another authority.
+            passkey     (str): Prepared answer for passkey prompt (optional).
 
         Raises:
             Exception: If named authority does not exists.
@@ -280,18 +306,23 @@ class Manager(object):
             error = "Cannot update entry: \"{name}\" not found in " \
                     "keychain (missing key)"
             Log.fatal(error, name=name)
+        jump_auth = None
         if jump_server is not None:
             Log.debug("Update requests to change jump server...")
             jump_auth = self.build_authority_from_signature(jump_server)
-            self.get_db().update_jump_auth(name, jump_auth)
-            Log.debug("New jump set to authority: {a}", a=str(jump_auth))
-        passkey = Passkey.resolve(auth)
-        self.get_db().update_passkey(name, passkey)
+        passkey = Passkey.resolve(auth, passkey)
+        with self.get_db().transaction():
+            if jump_auth is not None:
+                self.get_db().update_jump_auth(name, jump_auth)
+                Log.debug("New jump set to authority: {a}", a=jump_auth)
+            self.get_db().update_passkey(name, passkey)
         Log.debug("New passkey set ... ")
         Display.show_update(self.get_db().fetch_auth(name))
 
-    def call_read_write_append_option(self, name, host, port, user, auth,
-                                      scheme, jump_server, **kwargs):
+    def call_read_write_append_option(self, host, port, user, auth,
+                                      name=None, scheme=None,
+                                      jump_server=None, passkey=None,
+                                      **kwargs):
         """Append secrets to a named authority.
 
         Args:
@@ -302,6 +333,7 @@ class Manager(object):
             auth        (str): Authentification method.
             scheme      (str): Scheme of the connection.
             jump_server (str): Name or signature of another authority.
+            passkey     (str): Prepared answer for passkey prompt (optional).
 
         Raises:
             Exception: If named authority already exists.
@@ -336,7 +368,7 @@ class Manager(object):
                 "jump_auth": self.build_authority_from_signature(jump_server)
             })
         Log.debug("Preparing to add {args}", args=data)
-        self.get_db().add(passkey=Passkey.resolve(auth), **data)
+        self.get_db().add(passkey=Passkey.resolve(auth, passkey), **data)
         Log.debug("New named authority is saved...")
         Display.show_append(data.get("auth"))
 
@@ -361,13 +393,9 @@ class Manager(object):
             Log.fatal(error, name=name)
         Log.debug("Fetching data for named authority...")
         auth, host, secret = self.get_db().lookup(name)
-        dependents = []
-        for jump, dep_name in self.get_db().query_jump():
-            if jump.signature() == auth.signature():
-                debug_message = "Found another authority {a} " \
-                                "depending on this... "
-                Log.debug(debug_message, a=str(jump))
-                dependents.append(dep_name)
+        dependents = self.get_db().find_dependents(auth.signature())
+        Log.debug("Found {n} authorities depending on this...",
+                  n=len(dependents))
         if len(dependents) > 0:
             error = "Not removing entry because {n} other servers bounce of " \
                     "\"{name}\": remove all before trying again (safe mode)"
@@ -406,36 +434,146 @@ class Manager(object):
     def call_read_only_list_option(self, *args, **kwargs):
         """List handler.
 
+        Hosts are streamed as they are read if a machine-readable format is
+        requested, otherwise they are ordered by jump servers first.
+
         Outputs:
-            stdout: Pager with table-like view of all hostnames.
+            stdout: Pager with table-like view of all hostnames or one line
+                    per hostname.
         """
 
         Log.debug("Incoming list request...")
-        known_hosts = [e for e in self.get_db().query_all()]
-        counter = -1
-        indexes = {}
-        sorted_hosts = []
-        Log.debug("Found {n} hosts to list...", n=len(known_hosts))
-        while len(known_hosts) > 0:
-            if counter >= self.MAX_ITER_LIST:
-                Log.fatal("Max. iteration over list display reached...")
-            name, auth, host, jump = known_hosts[0]
-            counter += 1
-            if auth.signature() not in indexes:
-                indexes.update({auth.signature(): counter})
-            if jump is None:
-                sorted_hosts.append(known_hosts.pop(0))
-                continue
-            jump_index = indexes.get(jump.signature(), -1)
-            if jump_index > -1:
-                if jump_index == 0:
-                    jump_index += 1
-                sorted_hosts.insert(jump_index, known_hosts.pop(0))
-                continue
-            known_hosts.insert(len(known_hosts), known_hosts.pop(0))
+        fmt = self.args.get("format")
+        if fmt in STREAM_LIST_FORMATS:
+            Log.debug("Streaming list of hosts as {f}...", f=fmt)
+            with Log.span("query_all"):
+                Display.stream_list_view(self.get_db().query_all(), fmt)
+            return
+        with Log.span("query_all"):
+            graph = JumpGraph(self.get_db().query_all())
+        Log.debug("Found {n} hosts to list...", n=len(graph.rows))
+        sorted_hosts = graph.order()
+        for name in graph.get_dangling_names():
+            Log.warn("Entry {n} bounces off a missing jump server", n=name)
+        for names in graph.get_cycles_names():
+            Log.warn("Entries bounce off each other in a cycle: {n}",
+                     n=", ".join(names))
         Log.debug("Sorted all known hosts and now preparing to print out...")
         Display.show_list_view(sorted_hosts, **self.args)
 
+    def call_read_only_dependents_option(self, signature, **kwargs):
+        """Dependents handler.
+
+        Prints all servers bouncing directly or indirectly off a server.
+
+        Args:
+            signature (str): Name or signature of the jump server.
+
+        Raises:
+            Exception: If no entry matches the name or signature.
+
+        Outputs:
+            stdout: Tree of dependent servers.
+        """
+
+        Log.debug("Incoming dependents request for {s}", s=signature)
+        name = signature
+        if not self.get_db().exists(name):
+            Log.debug("Trying key as authority signature...")
+            for name in self.get_db().find_by_signature(signature):
+                break
+            else:
+                error = "Cannot find dependents: \"{s}\" not found in " \
+                        "keychain (missing key)"
+                Log.fatal(error, s=signature)
+        auth = self.get_db().fetch_auth(name)
+        Display.show_dependents(name, auth,
+                                self.get_db().walk_dependents(name))
+
+    def call_read_write_index_option(self, rebuild=False, verify=False,
+                                     **kwargs):
+        """Indexes maintenance handler.
+
+        Args:
+            rebuild (bool): Drop and rebuild all indexes.
+            verify  (bool): Compare stored indexes with keychain entries.
+
+        Raises:
+            Exception: If indexes are inconsistent.
+
+        Outputs:
+            stdout: Human-readable result of maintenance.
+        """
+
+        Log.debug("Incoming index request...")
+        if rebuild:
+            keys = self.get_db().rebuild_indexes()
+            Display.show("Rebuilt {} index keys".format(keys))
+        if verify:
+            problems = self.get_db().verify_indexes()
+            for problem in problems:
+                Log.warn("Index inconsistency: {p}", p=problem)
+            if len(problems) > 0:
+                error = "Found {n} index inconsistencies: run " \
+                        "\"index --rebuild\" to fix them"
+                Log.fatal(error, n=len(problems))
+            Display.show("Indexes are consistent")
+
+    def call_read_only_stats_option(self, *args, **kwargs):
+        """Keychain statistics handler.
+
+        Statistics are maintained on every write, so they are read without
+        scanning the keychain. Keychains without stored statistics are
+        scanned once and statistics are stored, so they are maintained from
+        then on. Storing them needs the keychain opened for writing.
+
+        Returns:
+            str: NEEDS_WRITE if statistics are missing from a keychain opened
+                 for reading only, otherwise None.
+
+        Outputs:
+            stdout: Counts and sizes of keys per type and free space.
+        """
+
+        Log.debug("Incoming stats request...")
+        rows = self.get_db().get_stats(scan=False)
+        if rows is None and self.__read_only:
+            Log.debug("Statistics are missing, keychain is read-only...")
+            return self.NEEDS_WRITE
+        if rows is None:
+            Log.warn("Statistics are not stored yet, counting all keys...")
+            self.get_secrets().store_stats()
+            rows = self.get_db().get_stats()
+        live_size = sum(row[3] + row[5] for row in rows)
+        storage = self.get_secrets().keychain
+        if hasattr(storage, "stats"):
+            file_size, free_space = storage.stats()
+        else:
+            from os import path
+            from unlocker.util.secret import Secret
+            secret_path = Secret.get_secret_path()
+            file_size = path.getsize(secret_path) \
+                if path.exists(secret_path) else live_size
+            free_space = max(file_size - live_size, 0)
+        Display.show_stats(rows, file_size, free_space)
+
+    def call_read_write_compact_option(self, *args, **kwargs):
+        """Reclaim space of overwritten and removed entries.
+
+        Raises:
+            Exception: If keychain backend cannot be compacted.
+
+        Outputs:
+            stdout: Number of bytes reclaimed.
+        """
+
+        Log.debug("Incoming compact request...")
+        storage = self.get_secrets().keychain
+        if not hasattr(storage, "compact"):
+            Log.fatal("Keychain backend does not support compaction")
+        reclaimed = storage.compact()
+        Display.show("Reclaimed {} bytes".format(reclaimed))
+
     def call_read_write_migrate_option(self, *args, **kwargs):
         """Migration wrapper.
 
@@ -452,6 +590,7 @@ class Manager(object):
         """
 
         Log.debug("Incoming migrate request...")
+        from unlocker.migrate import Migrate
         Migrate.discover(self)
         Log.debug("Migrated data...")
 
@@ -480,6 +619,24 @@ class Manager(object):
                 Log.debug("Removed {k} ...", k=key)
         Log.debug("Closing...")
 
+    def call_debug_write_metrics_option(self, option, args):
+        """Count keychain operations of another option in debug mode.
+
+        Args:
+            option (str): Manager option to run.
+            args  (dict): Arguments of option.
+        """
+
+        Log.debug("Incoming debug metrics request for {o}...", o=option)
+        if option == self.option:
+            Log.fatal("Cannot measure metrics option")
+        self.get_secrets().reset_metrics()
+        self.__class__(option, args).call()
+        metrics = self.get_secrets().metrics()
+        for name in sorted(metrics):
+            Log.debug(" [{n}] {v}", n=name, v=metrics[name])
+        Log.debug("Closing...")
+
     def call_secret_read_stdout_dump_option(self, name, signature, **kwargs):
         """Vulnerable passkey dump to stdout.
 
@@ -504,9 +661,7 @@ class Manager(object):
             Log.debug("Got named authority {n}...", n=name)
             passkey = print_passkey(name)
         elif len(signature) > 0:
-            for each, name in self.get_db().query_auth():
-                if each.signature() != signature:
-                    continue
+            for name in self.get_db().find_by_signature(signature):
                 Log.debug("Records matched authority, got passkey...")
                 passkey = print_passkey(name)
                 break  # exit on first match
@@ -20,14 +20,15 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-from os import path, makedirs, remove
 from sys import stdin, stdout
-from shutil import rmtree, make_archive
-from base64 import b64encode, b64decode
-from uuid import uuid4
+from time import time
+from itertools import islice
+from tempfile import SpooledTemporaryFile
 from zipfile import ZipFile
 
+from unlocker.util.archive import Base64Writer, ZipStream, copy_base64
 from unlocker.util.passkey import Passkey
+from unlocker.util.resolver import Resolver
 from unlocker.util.log import Log
 
 
@@ -35,9 +36,9 @@ class Migrate(object):
     """Secrets migration in and out.
 
     Arguments:
-        migrate_format  (str): The temporary file format of archive.
-        migrate_tmpdir  (str): Temporary directory to unpack and pack secrets.
-        migrate_tmpfile (str): Name of temporary file to unpack and pack.
+        migrate_tmpfile (str): Name of archived file with secrets.
+        resolver   (Resolver): Resolver of imported hostnames (created on
+                               first import, so exports don't load it).
 
     Raises:
         Exception: If manager raises any exceptions.
@@ -45,82 +46,235 @@ class Migrate(object):
 
     COLUMNS = 9  # +1 (starts from 0) number of exported/imported columns
 
-    migrate_format = "zip"
-    migrate_tmpdir = "/tmp/.x-unlocker"
+    BATCH_SIZE = 1000  # entries written to storage at once on import
+    PROGRESS_BATCHES = 10  # batches written between progress messages
+    SPOOL_SIZE = 16 << 20  # bytes of archive kept in memory on import
+
     migrate_tmpfile = "secrets.list"
 
-    def __init__(self, manager):
+    def __init__(self, manager, resolver=None):
         self.manager = manager
+        self.resolver = resolver
+
+    def get_resolver(self):
+        """Resolver of imported hostnames getter.
+
+        Returns:
+            Resolver: Given resolver or one configured on first call.
+        """
 
-    def import_secrets(self):
+        if self.resolver is None:
+            self.resolver = Resolver.from_config()
+        return self.resolver
+
+    def import_secrets(self, batch_size=None):
         """Import secrets wrapper.
 
-        Read and decode from stdin and import authority and passkeys.
+        Decode stdin in chunks into a spooled file, which is kept in memory
+        unless it grows too large, and import authority and passkeys.
+
+        Args:
+            batch_size (int): Number of entries written at once (optional).
+        """
+
+        with SpooledTemporaryFile(self.SPOOL_SIZE) as fd:
+            copy_base64(stdin, fd)
+            fd.seek(0)
+            with ZipFile(fd, "r") as zf:
+                self.read_tmp_secrets(zf, batch_size or self.BATCH_SIZE)
+
+    def read_rows(self, zf_secrets):
+        """Read exported rows line by line.
+
+        Args:
+            zf_secrets (ZipFile): ZipFile instance with secrets and passkeys.
+
+        Raises:
+            SystemExit: If a row has an unexpected number of columns.
+
+        Yields:
+            list: Columns of each row.
         """
 
-        filename = self.get_tmp_filename()
-        filepath = self.get_tmp_path(filename)
-        with open(filepath, "wb") as fd:
-            fd.write(b64decode(stdin.read()))
-        with ZipFile(filepath, "r") as zf:
-            self.read_tmp_secrets(zf)
+        for each in zf_secrets.open(self.migrate_tmpfile):
+            if each.endswith("\n"):
+                each = each[:-1]
+            if len(each) == 0:
+                continue
+            line = each.split("\t", self.COLUMNS)
+            if len(line) != self.COLUMNS + 1:
+                Log.fatal("Corrupted secrets row: {n} columns", n=len(line))
+            yield line
 
-    def read_tmp_secrets(self, zf_secrets):
+    def read_tmp_secrets(self, zf_secrets, batch_size=BATCH_SIZE):
         """Read temporary secrets.
 
+        Entries are written in batches, each one synced to storage once.
+        Hostnames of a batch are resolved concurrently before it's written.
+        A failed batch is dropped while previous batches are kept, so
+        entries already in keychain with the same authority are skipped
+        and a failed import can be run again to resume it. Missing statistics
+        of keychain are built once all entries are written. Progress is logged
+        every few batches, and the number of imported entries at the end.
+
         Args:
             zf_secrets (ZipFile): ZipFile instance with secrets and passkeys.
+            batch_size     (int): Number of entries written at once.
 
         Raises:
             SystemExit: If manager crashes or corrupted data are found.
         """
 
-        for each in zf_secrets.read(self.migrate_tmpfile).split("\n"):
-            line = each.split("\t", self.COLUMNS)
-            if len(line) == 0:
-                continue
-            _, _, host, ipv4, port, user, scheme, name, ptype, passkey = line
-            if ptype not in Passkey.SUPPORTED_TYPES:
-                Log.fatal("Unsupported passkey storage {x}", x=ptype)
-            authority_args = user, host, port, scheme
-            auth = self.manager.build_authority_from_args(*authority_args)
-            if ptype == "privatekey":
-                passkey = zf_secrets.read(passkey)
-            data = {
-                "name": name,
-                "host": host,
-                "auth": auth,
-                "passkey": Passkey.SUPPORTED_TYPES.get(ptype) + passkey
-            }
-            self.manager.get_db().add(**data)
+        database = self.manager.get_db()
+        resolver = self.get_resolver()
+        rows = self.read_rows(zf_secrets)
+        imported, skipped, batches, started = 0, 0, 0, time()
+        while True:
+            batch = list(islice(rows, batch_size))
+            if len(batch) == 0:
+                break
+            addresses = resolver.resolve_all(line[2] for line in batch)
+            added = 0
+            try:
+                with database.transaction():
+                    for line in batch:
+                        address = addresses.get(line[2])
+                        if self.import_row(database, zf_secrets, line,
+                                           address):
+                            added += 1
+            except SystemExit:
+                if imported > 0:
+                    Log.warn("Imported {n} entries before failing (run "
+                             "import again to resume)", n=imported)
+                raise
+            imported += added
+            skipped += len(batch) - added
+            batches += 1
+            if batches % self.PROGRESS_BATCHES == 0:
+                Log.warn("Imported {n} entries ({r} entries/sec)...",
+                         n=imported, r=self.get_rate(imported, started))
+        Log.warn("Imported {n} entries ({r} entries/sec)", n=imported,
+                 r=self.get_rate(imported, started))
+        if skipped > 0:
+            Log.warn("Skipped {n} entries already in keychain", n=skipped)
+        database.storage.store_stats()
         Log.warn("Unsupported import for jump server, yet")
 
+    @staticmethod
+    def get_rate(count, started):
+        """Entries imported per second getter.
+
+        Args:
+            count   (int): Number of imported entries.
+            started (float): Time import started at.
+
+        Returns:
+            int: Entries per second.
+        """
+
+        return int(count / max(time() - started, 1e-6))
+
+    def import_row(self, database, zf_secrets, line, address=None):
+        """Add an entry from an exported row.
+
+        Authority is created from the resolved address of the hostname, or
+        from the exported IP address if it could not be resolved. An entry
+        already in keychain under the same name and with the same authority
+        (e.g. imported by a previous run) is skipped.
+
+        Args:
+            database (Database): Database to add entry to.
+            zf_secrets (ZipFile): ZipFile instance with secrets and passkeys.
+            line         (list): Columns of row.
+            address       (str): Resolved IP address of hostname (optional).
+
+        Raises:
+            SystemExit: If name is used by another authority or entry has
+                        unsupported passkey.
+
+        Returns:
+            bool: True if entry was added, False if it was skipped.
+        """
+
+        sign, _, host, ipv4, port, user, scheme, name, ptype, passkey = line
+        if ptype not in Passkey.SUPPORTED_TYPES:
+            Log.fatal("Unsupported passkey storage {x}", x=ptype)
+        authority_args = user, address or ipv4, port, scheme
+        auth = self.manager.build_authority_from_args(*authority_args)
+        record = database.fetch_record(name)
+        if record is not None and \
+                record[0].signature() in (sign, auth.signature()):
+            return False
+        if ptype == "privatekey":
+            passkey = self.read_member(zf_secrets, passkey)
+        data = {
+            "name": name,
+            "host": host,
+            "auth": auth,
+            "passkey": Passkey.SUPPORTED_TYPES.get(ptype) + passkey
+        }
+        database.add(**data)
+        return True
+
+    def read_member(self, zf_secrets, filename):
+        """Read a whole file from archive while another one is streamed.
+
+        Open files of an archive share its file object, so the position of
+        the streamed file is restored.
+
+        Args:
+            zf_secrets (ZipFile): ZipFile instance with secrets and passkeys.
+            filename       (str): Name of file to read.
+
+        Returns:
+            str: Content of file.
+        """
+
+        position = zf_secrets.fp.tell()
+        try:
+            return zf_secrets.read(filename)
+        finally:
+            zf_secrets.fp.seek(position)
+
     def export_secrets(self, records=[]):
         """Export secrets wrapper.
 
-        Loop through all secrets and export authority and passkeys.
+        Loop through all secrets and stream authority and passkeys to stdout
+        as a base64 encoded zip archive. Each entry is read once, along with
+        its passkey, and its row is written right away. Private keys are
+        written after all rows as separate files, so only their names are
+        kept in memory and each one is read a second time.
 
         Args:
-            records (list): Optional list of named servers to filter on export.
+            records (iter): Optional named servers to filter on export.
 
         Raises:
             SystemExit: If there's nothing to export.
         """
 
-        rows = []
-        for name, auth, host, jump in self.manager.get_db().query_all():
+        database = self.manager.get_db()
+        records = set(records)
+        encoder = Base64Writer(stdout)
+        archive = ZipStream(encoder)
+        private_keys = []
+        for name, auth, host, jump in database.query_all():
             if len(records) > 0 and name not in records:
                 continue
             ipv4, port = auth.get_host_ip4(), str(auth.get_port())
             user, scheme = auth.get_user(), auth.get_scheme()
-            _, _, secret = self.manager.get_db().lookup(name)
+            secret = database.fetch_passkey(name)
             passtype, passkey = Passkey.copy(secret, True)
             if passtype == "privatekey":
-                passkey = self.dump_pk_file(passkey, user, host, scheme)
+                passkey = self.create_pk_file(name, user, host, scheme)
+                private_keys.append((name, passkey))
             jump_auth = "."
             if jump is not None:
                 jump_auth = jump.signature()
-            rows.append((
+            if archive.member is None:
+                archive.start(self.migrate_tmpfile)
+            else:
+                archive.write("\n")
+            archive.write(self.pack_row((
                 auth.signature(),  # auth signature
                 jump_auth,         # jump signature if any
                 host,              # hostname
@@ -131,71 +285,40 @@ class Migrate(object):
                 name,              # authority name
                 passtype,          # passkey type
                 passkey            # actual passkey or path to passkey
-            ))
-        if len(rows) == 0:
+            )))
+        if archive.member is None:
             Log.fatal("Nothing to export...")
-        self.flush_secrets(rows)
-
-    def flush_secrets(self, content):
-        """Flush secrets to stdout.
-
-        It creates additional files for private keys whenever needed. Files
-        are deleted after they are flushed to stdout.
-
-        Args:
-            content (str): Content with secrets to write to file.
-        """
-
-        # write all secrets to file...
-        with open(self.get_tmp_path(self.migrate_tmpfile), "wb") as fd:
-            safe_content = []
-            for ctx in content:
-                line = []
-                for each in ctx:
-                    if isinstance(each, str):
-                        each = each.decode("utf-8")
-                    line.append(each)
-                safe_content.append("\t".join(line))
-            fd.write("\n".join(safe_content).encode("utf-8"))
-
-        # create temporary archive and flush it's content to stdout
-        exp_pkg = "/tmp/{}".format(self.get_tmp_filename())
-        make_archive(exp_pkg, self.migrate_format, self.migrate_tmpdir)
-        with open("{}.{}".format(exp_pkg, self.migrate_format), "rb") as fd:
-            stdout.write(b64encode(fd.read()))
+        for name, filename in private_keys:
+            _, passkey = Passkey.copy(database.fetch_passkey(name), True)
+            archive.writestr(filename, passkey)
+        archive.close()
+        encoder.close()
 
-        # cleanup
-        remove("{}.{}".format(exp_pkg, self.migrate_format))
-
-    def get_tmp_filename(self):
-        """Temporary filename getter.
-
-        Generates a filename for temporary storage.
-
-        Returns:
-            str: Temporary filename.
-        """
-
-        return str(uuid4().hex.upper())
-
-    def get_tmp_path(self, filename):
-        """Temporary path getter.
-
-        Returns path to migration temporary directory.
+    def pack_row(self, row):
+        """Serialize an exported row as a tab separated line.
 
         Args:
-            filename (str): Name of file from temp directory.
+            row (tuple): Columns of exported row.
 
         Returns:
-            str: Path to file from temporary directory.
+            str: UTF-8 encoded line without line break.
         """
 
-        return "{}/{}".format(self.migrate_tmpdir, filename)
+        line = []
+        for each in row:
+            if isinstance(each, str):
+                each = each.decode("utf-8")
+            line.append(each)
+        return u"\t".join(line).encode("utf-8")
 
-    def create_pk_file(self, user, hostname, scheme):
+    def create_pk_file(self, name, user, hostname, scheme):
         """Create a private key filename.
 
+        The name of the entry keeps filenames unique, even for entries with
+        the same user, host and scheme.
+
         Args:
+            name   (str): Name of authority.
             user   (str): Username from Authority.
             host   (str): Hostname from Authority.
             scheme (str): Scheme from Authority.
@@ -204,26 +327,7 @@ class Migrate(object):
             str: Filename for private key.
         """
 
-        return "{}_{}_{}.pk".format(user, hostname, scheme)
-
-    def dump_pk_file(self, passkey, user, host, scheme):
-        """Write private key to file and return file name.
-
-        Args:
-            passkey (str): Passkey as private key to write to file.
-            user    (str): Username from Authority.
-            host    (str): Hostname from Authority.
-            scheme  (str): Scheme from Authority.
-
-        Returns:
-            str: Name of file with private key.
-
-        """
-
-        filename = self.create_pk_file(user, host, scheme)
-        with open(self.get_tmp_path(filename), "wb") as fd:
-            fd.write(passkey)
-        return filename
+        return "{}_{}_{}_{}.pk".format(name, user, hostname, scheme)
 
     @classmethod
     def discover(cls, manager):
@@ -237,25 +341,34 @@ class Migrate(object):
 
         import_secrets = manager.args.get("import_secrets")
         export_secrets = manager.args.get("export_secrets")
+        convert_records = manager.args.get("convert_records")
+        convert_backend = manager.args.get("convert_backend")
+
+        # convert legacy entries in place...
+        if convert_records is True:
+            converted = manager.get_db().convert_all()
+            Log.warn("Converted {n} entries to records", n=converted)
+            return
+
+        # copy secrets to another backend...
+        if convert_backend is not None:
+            copied = manager.get_db().convert_backend(convert_backend)
+            Log.warn("Copied {n} keys to {b} keychain and removed the old "
+                     "keychain", n=copied, b=convert_backend)
+            return
 
         # fail fast if no options is provided...
         if import_secrets is not True and not isinstance(export_secrets, list):
             Log.fatal("Unexpected migrate request...")
 
-        # create tmp dir if not eixsts...
-        if not path.exists(cls.migrate_tmpdir):
-            makedirs(cls.migrate_tmpdir)
-
-        # run migration
+        # export streams to stdout without temporary files...
         mig = cls(manager)
-        if import_secrets is True:
-            if stdin.isatty():
-                Log.fatal("Migration failed: stdin is empty")
-            mig.import_secrets()
-        elif isinstance(export_secrets, list) and len(export_secrets) >= 0:
+        if import_secrets is not True:
             if stdout.isatty():
                 Log.fatal("Migration failed: stdout is empty")
-            mig.export_secrets(records=export_secrets)
+            return mig.export_secrets(records=export_secrets)
 
-        # cleanup
-        rmtree(cls.migrate_tmpdir)
+        # import streams from stdin in batches...
+        if stdin.isatty():
+            Log.fatal("Migration failed: stdin is empty")
+        mig.import_secrets(batch_size=manager.args.get("batch_size"))
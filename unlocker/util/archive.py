@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from base64 import b64encode
+from binascii import a2b_base64
+from struct import pack
+from time import localtime
+from zlib import compressobj, crc32, DEFLATED, Z_DEFAULT_COMPRESSION
+
+from unlocker.util.log import Log
+
+
+class Base64Writer(object):
+    """File-like writer encoding content to base64 as it's written.
+
+    Content is encoded in chunks with a size multiple of three bytes, so the
+    output is the same as encoding everything at once.
+
+    Arguments:
+        target   (file): File-like object to write encoded content to.
+        size      (int): Size of chunks encoded at once.
+        buffer    (str): Content not encoded yet.
+
+    Args:
+        target (file): File-like object to write encoded content to.
+        size    (int): Size of chunks encoded at once (multiple of three).
+    """
+
+    CHUNK_SIZE = 3 << 14  # 48 KiB
+
+    def __init__(self, target, size=CHUNK_SIZE):
+        if size <= 0 or size % 3 != 0:
+            Log.fatal("Base64 chunk size must be a multiple of 3")
+        self.target = target
+        self.size = size
+        self.buffer = ""
+
+    def write(self, content):
+        """Buffer content and encode every complete chunk.
+
+        Args:
+            content (str): Content to encode.
+        """
+
+        self.buffer += content
+        if len(self.buffer) < self.size:
+            return
+        cut = len(self.buffer) - len(self.buffer) % self.size
+        for offset in xrange(0, cut, self.size):
+            chunk = self.buffer[offset:offset + self.size]
+            self.target.write(b64encode(chunk))
+        self.buffer = self.buffer[cut:]
+
+    def close(self):
+        """Encode remaining content with padding.
+        """
+
+        if len(self.buffer) > 0:
+            self.target.write(b64encode(self.buffer))
+        self.buffer = ""
+
+
+def copy_base64(source, target, size=Base64Writer.CHUNK_SIZE):
+    """Decode base64 content from a file-like object in chunks.
+
+    Whitespace is ignored, so wrapped lines are decoded as well.
+
+    Args:
+        source (file): File-like object to read encoded content from.
+        target (file): File-like object to write decoded content to.
+        size    (int): Size of chunks read at once.
+
+    Raises:
+        Exception: If content is not base64 encoded.
+
+    Returns:
+        int: Number of decoded bytes.
+    """
+
+    buffer, decoded = "", 0
+    while True:
+        chunk = source.read(size)
+        buffer += "".join(chunk.split())
+        cut = len(buffer) if len(chunk) == 0 else len(buffer) & ~3
+        try:
+            content = a2b_base64(buffer[:cut])
+        except Exception as e:
+            Log.fatal("Cannot decode base64 content: {e}", e=str(e))
+        target.write(content)
+        decoded += len(content)
+        buffer = buffer[cut:]
+        if len(chunk) == 0:
+            return decoded
+
+
+class ZipStream(object):
+    """Zip archive writer for targets that cannot seek or tell.
+
+    Each member is compressed as it's written and followed by a data
+    descriptor with its checksum and sizes, so nothing needs to be known
+    in advance. Only the central directory is kept in memory, one small
+    entry per member, and it's written when the archive is closed.
+
+    Arguments:
+        target   (file): File-like object to write archive to.
+        offset    (int): Number of bytes written so far.
+        directory (list): Central directory entries of written members.
+        member   (list): Name, offset, checksum and sizes of open member.
+        compressor (Compress): Compressor of open member.
+
+    Args:
+        target (file): File-like object to write archive to.
+    """
+
+    VERSION = 20
+    VERSION_ZIP64 = 45
+    FLAGS = 0x08 | 0x800  # data descriptor, UTF-8 names
+    SYSTEM = 3  # unix
+    MODE = 0600
+
+    LOCAL_HEADER = "<4s2B4HL2L2H"
+    DESCRIPTOR = "<4s3L"
+    CENTRAL_HEADER = "<4s4B4HL2L5H2L"
+    END_RECORD = "<4s4H2LH"
+    END_RECORD_ZIP64 = "<4sQ2H2L4Q"
+    END_LOCATOR_ZIP64 = "<4sLQL"
+
+    MAX_SIZE = 0xFFFFFFFF
+    MAX_COUNT = 0xFFFF
+
+    def __init__(self, target):
+        self.target = target
+        self.offset = 0
+        self.directory = []
+        self.member = None
+        self.compressor = None
+
+    def emit(self, content):
+        """Write raw bytes to target and keep track of offset.
+
+        Args:
+            content (str): Bytes to write.
+
+        Raises:
+            Exception: If archive grows too large for offsets to fit.
+        """
+
+        self.offset += len(content)
+        if self.offset > self.MAX_SIZE:
+            Log.fatal("Archive is too large to export")
+        self.target.write(content)
+
+    def get_date_time(self):
+        """Current local time in MS-DOS format.
+
+        Returns:
+            tuple: DOS time and date.
+        """
+
+        now = localtime()
+        dos_time = now.tm_hour << 11 | now.tm_min << 5 | now.tm_sec // 2
+        dos_date = (now.tm_year - 1980) << 9 | now.tm_mon << 5 | now.tm_mday
+        return dos_time, dos_date
+
+    def start(self, name):
+        """Start a new member, closing the previous one if any.
+
+        Args:
+            name (str): Name of member in archive.
+        """
+
+        if self.member is not None:
+            self.finish()
+        if isinstance(name, unicode):
+            name = name.encode("utf-8")
+        dos_time, dos_date = self.get_date_time()
+        self.member = [name, self.offset, dos_time, dos_date, 0, 0, 0]
+        self.compressor = compressobj(Z_DEFAULT_COMPRESSION, DEFLATED, -15)
+        self.emit(pack(self.LOCAL_HEADER, "PK\003\004", self.VERSION, 0,
+                       self.FLAGS, DEFLATED, dos_time, dos_date, 0, 0, 0,
+                       len(name), 0))
+        self.emit(name)
+
+    def write(self, content):
+        """Compress and write content to the open member.
+
+        Args:
+            content (str): Content of member.
+
+        Raises:
+            Exception: If no member is open.
+        """
+
+        if self.member is None:
+            Log.fatal("Cannot write to archive without a member")
+        if isinstance(content, unicode):
+            content = content.encode("utf-8")
+        self.member[4] = crc32(content, self.member[4])
+        self.member[6] += len(content)
+        compressed = self.compressor.compress(content)
+        self.member[5] += len(compressed)
+        if len(compressed) > 0:
+            self.emit(compressed)
+
+    def finish(self):
+        """Flush compressed content of open member and its data descriptor.
+        """
+
+        compressed = self.compressor.flush()
+        self.member[5] += len(compressed)
+        self.emit(compressed)
+        name, offset, dos_time, dos_date, crc, size, raw_size = self.member
+        crc &= 0xFFFFFFFF
+        self.emit(pack(self.DESCRIPTOR, "PK\007\010", crc, size, raw_size))
+        self.directory.append(pack(
+            self.CENTRAL_HEADER, "PK\001\002", self.VERSION, self.SYSTEM,
+            self.VERSION, 0, self.FLAGS, DEFLATED, dos_time, dos_date, crc,
+            size, raw_size, len(name), 0, 0, 0, 0, self.MODE << 16,
+            offset) + name)
+        self.member, self.compressor = None, None
+
+    def writestr(self, name, content):
+        """Write a whole member at once.
+
+        Args:
+            name    (str): Name of member in archive.
+            content (str): Content of member.
+        """
+
+        self.start(name)
+        self.write(content)
+        self.finish()
+
+    def close(self):
+        """Finish open member and write central directory.
+
+        Archives with more members than the classic end record can count
+        get a zip64 end record as well.
+        """
+
+        if self.member is not None:
+            self.finish()
+        start = self.offset
+        for each in self.directory:
+            self.emit(each)
+        size, count = self.offset - start, len(self.directory)
+        if count > self.MAX_COUNT:
+            end = self.offset
+            self.emit(pack(self.END_RECORD_ZIP64, "PK\006\006", 44,
+                           self.VERSION_ZIP64, self.VERSION_ZIP64, 0, 0,
+                           count, count, size, start))
+            self.emit(pack(self.END_LOCATOR_ZIP64, "PK\006\007", 0, end, 1))
+            count = self.MAX_COUNT
+        self.emit(pack(self.END_RECORD, "PK\005\006", 0, 0, count, count,
+                       size, start, 0))
+        self.directory = []
@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from os import path, rename, close, write, unlink, chmod, \
+    open as open_fd, O_RDONLY, O_CREAT
+from fcntl import flock, LOCK_EX, LOCK_UN
+from contextlib import contextmanager
+from time import time
+
+from unlocker.util.secret import Secret
+from unlocker.util.log import Log
+
+
+class DnsCache(object):
+    """Persistent cache of resolved hostnames.
+
+    Answers are kept for a number of seconds (TTL), and failed lookups are
+    kept as negative answers for a shorter time. The oldest answers are
+    evicted once the cache holds too many. Hits and misses are counted
+    across runs.
+
+    The cache file is written only when answers change. Counters of lookups
+    answered from cache are written along with the next change, so lookups
+    answered only from cache never write the file (their counters are lost
+    if nothing else changes). Changes are merged with the file as it is at
+    the time of writing, under an exclusive lock, so concurrent processes
+    don't drop each other's answers.
+
+    The cache is a tab separated file, so shell scripts can read it too. The
+    first line holds counters and TTL ("#", hits, misses, TTL), followed by
+    a line per hostname (hostname, IP address, time of lookup and negative
+    flag).
+
+    Arguments:
+        filepath    (str): Path to cache file.
+        ttl         (int): Seconds an answer is kept.
+        negative_ttl (int): Seconds a failed lookup is kept.
+        size        (int): Maximum number of hostnames kept.
+        entries    (dict): IP address (or None), time of lookup and negative
+                           flag of each hostname.
+        hits        (int): Number of fresh answers found.
+        misses      (int): Number of missing or expired answers.
+        changed    (dict): Answers stored since last save.
+        pending    (list): Hits and misses counted since last save.
+
+    Args:
+        filepath     (str): Path to cache file.
+        ttl          (int): Seconds an answer is kept.
+        negative_ttl (int): Seconds a failed lookup is kept.
+        size         (int): Maximum number of hostnames kept.
+    """
+
+    SECTION = "resolver"
+    TTL = 3600
+    NEGATIVE_TTL = 60
+    SIZE = 4096
+
+    HEADER = "#"
+    LOCK_SUFFIX = ".lock"
+    NEGATIVE_ANSWER = "cached negative answer"
+
+    # cache loaded by this process, reloaded if home directory changes
+    instance = None
+
+    def __init__(self, filepath, ttl=TTL, negative_ttl=NEGATIVE_TTL,
+                 size=SIZE):
+        self.filepath = filepath
+        self.ttl, self.negative_ttl, self.size = ttl, negative_ttl, size
+        self.changed, self.pending = {}, [0, 0]
+        self.entries, self.hits, self.misses = self.read()
+
+    @classmethod
+    def get_instance(cls):
+        """Cache getter configured in the "resolver" section.
+
+        Raises:
+            Exception: If configuration is invalid.
+
+        Returns:
+            DnsCache: Cache of resolved hostnames.
+        """
+
+        filepath = Secret.get_dns_cache_path()
+        if cls.instance is not None and cls.instance.filepath == filepath:
+            return cls.instance
+        try:
+            ttl = int(Secret.get_config(cls.SECTION, "ttl", cls.TTL))
+            negative_ttl = int(Secret.get_config(
+                cls.SECTION, "negative_ttl", cls.NEGATIVE_TTL))
+            size = int(Secret.get_config(cls.SECTION, "cache_size",
+                                         cls.SIZE))
+        except ValueError as e:
+            Log.fatal("Invalid resolver configuration: {e}", e=str(e))
+        cls.instance = cls(filepath, ttl, negative_ttl, size)
+        return cls.instance
+
+    def read(self):
+        """Read cache file, skipping malformed lines.
+
+        Returns:
+            tuple: Answers of each hostname, hits and misses.
+        """
+
+        entries, hits, misses = {}, 0, 0
+        if not path.exists(self.filepath):
+            return entries, hits, misses
+        with open(self.filepath, "rb") as fd:
+            for line in fd:
+                fields = line.rstrip("\n").split("\t")
+                try:
+                    if fields[0] == self.HEADER:
+                        hits, misses = int(fields[1]), int(fields[2])
+                        continue
+                    host, address, stamp, negative = fields
+                    entries[host] = (address or None, int(stamp),
+                                     negative == "1")
+                except (IndexError, ValueError):
+                    Log.debug("Skipping malformed DNS cache line...")
+        return entries, hits, misses
+
+    def is_fresh(self, entry, now):
+        """Tests whether a cached answer has not expired yet.
+
+        Args:
+            entry (tuple): IP address, time of lookup and negative flag.
+            now     (int): Current time.
+
+        Returns:
+            bool: True if answer can be used, otherwise False.
+        """
+
+        _, stamp, negative = entry
+        ttl = self.negative_ttl if negative else self.ttl
+        return stamp <= now < stamp + ttl
+
+    def count(self, hit):
+        """Count a hit or a miss, saved with the next changed answer.
+
+        Args:
+            hit (bool): Whether a fresh answer was found.
+        """
+
+        if hit:
+            self.hits += 1
+            self.pending[0] += 1
+        else:
+            self.misses += 1
+            self.pending[1] += 1
+
+    def get(self, host):
+        """Find a fresh answer for a hostname and count a hit or a miss.
+
+        Args:
+            host (str): Hostname.
+
+        Returns:
+            tuple: IP address (None if negative) and negative flag, or None
+                   if there is no fresh answer.
+        """
+
+        entry = self.entries.get(host)
+        if entry is None or not self.is_fresh(entry, int(time())):
+            self.count(False)
+            return None
+        self.count(True)
+        address, _, negative = entry
+        return address, negative
+
+    def put(self, host, address=None):
+        """Store an answer for a hostname (saved on next save).
+
+        Args:
+            host    (str): Hostname.
+            address (str): IP address or None if lookup failed.
+        """
+
+        entry = (address, int(time()), address is None)
+        self.entries[host] = self.changed[host] = entry
+
+    def resolve(self, host, lookup):
+        """Resolve a hostname from cache or with a lookup, caching the answer.
+
+        The cache file is written only if a lookup is made.
+
+        Args:
+            host    (str): Hostname.
+            lookup (func): Blocking resolver of hostname to IPv4 address.
+
+        Raises:
+            Exception: If hostname cannot be resolved (also if cached).
+
+        Returns:
+            str: IPv4 address.
+        """
+
+        cached = self.get(host)
+        if cached is not None:
+            address, negative = cached
+            if negative:
+                raise IOError(self.NEGATIVE_ANSWER)
+            return address
+        try:
+            address = lookup(host)
+        except Exception:
+            self.put(host)
+            self.save()
+            raise
+        self.put(host, address)
+        self.save()
+        return address
+
+    def evict(self):
+        """Drop expired answers and the oldest ones above size limit.
+
+        Returns:
+            int: Number of hostnames dropped.
+        """
+
+        now, total = int(time()), len(self.entries)
+        for host, entry in self.entries.items():
+            if not self.is_fresh(entry, now):
+                del self.entries[host]
+        if len(self.entries) > self.size:
+            by_age = sorted(self.entries.iteritems(), key=lambda x: x[1][1])
+            for host, _ in by_age[:len(self.entries) - self.size]:
+                del self.entries[host]
+        return total - len(self.entries)
+
+    def save(self):
+        """Merge changed answers and counters into cache file.
+
+        Nothing is written if no answer changed since last save, even if
+        hits or misses were counted.
+        """
+
+        if not self.changed:
+            return
+        if not path.isdir(path.dirname(self.filepath)):
+            return
+        try:
+            with self.locked():
+                self.entries, hits, misses = self.read()
+                self.entries.update(self.changed)
+                self.hits, self.misses = hits + self.pending[0], \
+                    misses + self.pending[1]
+                self.changed, self.pending = {}, [0, 0]
+                self.evict()
+                self.write()
+        except (IOError, OSError) as e:
+            Log.warn("Cannot save DNS cache: {e}", e=str(e))
+
+    @contextmanager
+    def locked(self):
+        """Hold an exclusive lock on cache file while it's read and written.
+
+        Raises:
+            IOError: If lock file cannot be opened.
+
+        Yields:
+            None: Cache file is locked until context exits.
+        """
+
+        fd = open_fd(self.filepath + self.LOCK_SUFFIX, O_RDONLY | O_CREAT,
+                     0600)
+        try:
+            flock(fd, LOCK_EX)
+            try:
+                yield
+            finally:
+                flock(fd, LOCK_UN)
+        finally:
+            close(fd)
+
+    def write(self):
+        """Replace cache file with answers and counters held in memory.
+
+        Answers are written to a unique temporary file in the same directory
+        and renamed over the cache file, so readers never see a torn file.
+
+        Raises:
+            IOError: If cache file cannot be written.
+        """
+
+        from tempfile import mkstemp
+
+        lines = ["\t".join([self.HEADER, str(self.hits), str(self.misses),
+                            str(self.ttl)])]
+        for host, (address, stamp, negative) in self.entries.iteritems():
+            lines.append("\t".join([host, address or "", str(stamp),
+                                    "1" if negative else "0"]))
+        dirname, basename = path.split(self.filepath)
+        fd, temp_path = mkstemp(prefix=basename + ".", dir=dirname)
+        try:
+            try:
+                write(fd, "\n".join(lines) + "\n")
+            finally:
+                close(fd)
+            chmod(temp_path, 0600)
+            rename(temp_path, self.filepath)
+        except BaseException:
+            unlink(temp_path)
+            raise
+
+    def flush(self):
+        """Drop all answers and reset counters.
+
+        Returns:
+            int: Number of hostnames dropped.
+        """
+
+        total = 0
+        try:
+            with self.locked():
+                total = len(self.read()[0])
+                self.entries, self.hits, self.misses = {}, 0, 0
+                self.changed, self.pending = {}, [0, 0]
+                self.write()
+        except (IOError, OSError) as e:
+            Log.warn("Cannot save DNS cache: {e}", e=str(e))
+        return total
+
+    def get_stats(self):
+        """Cache statistics getter.
+
+        Returns:
+            dict: Number of hostnames, negative and expired answers, hits,
+                  misses and hit rate (percent).
+        """
+
+        now = int(time())
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "negative": sum(1 for _, _, negative in self.entries.itervalues()
+                            if negative),
+            "expired": sum(1 for entry in self.entries.itervalues()
+                           if not self.is_fresh(entry, now)),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": 100.0 * self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from unlocker.util.log import Log
+
+
+class JumpGraph(object):
+    """Graph of entries bouncing through jump servers.
+
+    Each entry is a node and each jump authority is an edge from the entry
+    holding that authority to the entry bouncing through it. Entries are
+    ordered as a forest: every entry is followed by the entries jumping
+    through it, in the order they were provided.
+
+    Arguments:
+        rows      (list): Entries as (name, auth, host, jump) tuples.
+        roots     (list): Indexes of entries without a known jump server.
+        children  (dict): Index of entry to indexes of its dependents.
+        dangling  (list): Indexes of entries jumping through missing servers.
+        cycles    (list): Lists of indexes of entries jumping in a cycle.
+
+    Args:
+        rows (iter): Entries as (name, auth, host, jump) tuples.
+    """
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.roots, self.children = [], {}
+        self.dangling, self.cycles = [], []
+        self.build()
+
+    def build(self):
+        """Build adjacency from jump signatures in a single pass.
+        """
+
+        signatures = [auth.signature() for _, auth, _, _ in self.rows]
+        parents = {}
+        for index, signature in enumerate(signatures):
+            parents.setdefault(signature, index)
+        for index, (_, _, _, jump) in enumerate(self.rows):
+            if jump is None:
+                self.roots.append(index)
+                continue
+            parent = parents.get(jump.signature())
+            if parent is None:
+                self.dangling.append(index)
+                self.roots.append(index)
+                continue
+            self.children.setdefault(parent, []).append(index)
+        Log.debug("Jump graph has {n} roots...", n=len(self.roots))
+
+    def walk(self, start, visited):
+        """Depth-first walk from an entry through its dependents.
+
+        Args:
+            start     (int): Index of entry to start from.
+            visited (bytearray): Visited flags for every entry.
+
+        Yields:
+            int: Index of each entry reached.
+        """
+
+        stack = [start]
+        while len(stack) > 0:
+            index = stack.pop()
+            if visited[index]:
+                continue
+            visited[index] = 1
+            yield index
+            stack.extend(reversed(self.children.get(index, ())))
+
+    def find_cycles(self, visited):
+        """Find cycles among entries unreachable from roots.
+
+        Every unreachable entry either sits on a cycle or descends from one.
+
+        Args:
+            visited (bytearray): Visited flags for every entry.
+        """
+
+        parent_of = {}
+        for parent, children in self.children.iteritems():
+            for child in children:
+                parent_of[child] = parent
+        seen = bytearray(len(self.rows))
+        for index in xrange(len(self.rows)):
+            if visited[index] or seen[index]:
+                continue
+            path, position = [], {}
+            while not seen[index]:
+                seen[index] = 1
+                position[index] = len(path)
+                path.append(index)
+                index = parent_of[index]
+            if index in position:
+                self.cycles.append(path[position[index]:])
+
+    def order(self):
+        """Order entries so each jump server precedes its dependents.
+
+        Entries caught in cycles are placed at the end.
+
+        Returns:
+            list: Entries as (name, auth, host, jump) tuples.
+        """
+
+        visited = bytearray(len(self.rows))
+        ordered = []
+        for root in self.roots:
+            ordered.extend(self.walk(root, visited))
+        if len(ordered) < len(self.rows):
+            self.find_cycles(visited)
+            for cycle in self.cycles:
+                ordered.extend(self.walk(cycle[0], visited))
+        return [self.rows[index] for index in ordered]
+
+    def get_dangling_names(self):
+        """Names of entries bouncing through missing jump servers.
+
+        Returns:
+            list: Names of entries.
+        """
+
+        return [self.rows[index][0] for index in self.dangling]
+
+    def get_cycles_names(self):
+        """Names of entries jumping through each other in cycles.
+
+        Returns:
+            list: Lists of names for each cycle.
+        """
+
+        return [[self.rows[i][0] for i in cycle] for cycle in self.cycles]
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from os import path, remove, fsync, fdopen, open as open_fd
+from os import O_WRONLY, O_CREAT, O_TRUNC
+from base64 import b64encode, b64decode
+
+from unlocker.util.log import Log
+
+
+class Journal(object):
+    """Write-ahead journal of keychain changes.
+
+    Staged changes are written to the journal before they are applied to
+    storage, and the journal is removed once storage is synced. A journal
+    left behind by a crash is replayed on the next open. A journal without
+    its trailer was not fully written, so storage was never touched and the
+    journal is dropped.
+
+    Each change is a line with the base64 encoded key and the stored value,
+    or "-" for removed keys, followed by a trailer with the number of
+    changes:
+      a2V5 eJzLSM3JyQcABiwCFQ==
+      b3RoZXI= -
+      END 2
+
+    Arguments:
+        journal_path (str): Path to the journal file.
+
+    Args:
+        journal_path (str): Path to the journal file.
+    """
+
+    REMOVED = "-"
+    TRAILER = "END"
+
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+
+    def exists(self):
+        """Tests whether a journal was left behind.
+
+        Returns:
+            bool: True if journal file exists, otherwise False.
+        """
+
+        return path.exists(self.journal_path)
+
+    def write(self, changes):
+        """Write changes to journal and flush them to disk.
+
+        Args:
+            changes (dict): Keys and stored values (None if removed).
+        """
+
+        fd = open_fd(self.journal_path, O_WRONLY | O_CREAT | O_TRUNC, 0600)
+        with fdopen(fd, "wb") as journal:
+            for key, value in changes.iteritems():
+                if isinstance(key, unicode):
+                    key = key.encode("utf-8")
+                journal.write("{} {}\n".format(
+                    b64encode(key), self.REMOVED if value is None else value))
+            journal.write("{} {}\n".format(self.TRAILER, len(changes)))
+            journal.flush()
+            fsync(journal.fileno())
+
+    def read(self):
+        """Read changes from journal.
+
+        Returns:
+            dict: Keys and stored values or None if journal is incomplete.
+        """
+
+        changes = {}
+        with open(self.journal_path, "rb") as journal:
+            for line in journal:
+                key, _, value = line.rstrip("\n").partition(" ")
+                if key == self.TRAILER:
+                    return changes if value == str(len(changes)) else None
+                changes[b64decode(key)] = \
+                    None if value == self.REMOVED else value
+        return None
+
+    def replay(self, holder):
+        """Apply changes left in journal to storage.
+
+        Args:
+            holder (object): Storage dict-like object.
+
+        Returns:
+            int: Number of changes applied.
+        """
+
+        if not self.exists():
+            return 0
+        changes = self.read()
+        if changes is None:
+            Log.warn("Dropping incomplete journal: {p}", p=self.journal_path)
+            self.clear()
+            return 0
+        for key, value in changes.iteritems():
+            if value is not None:
+                holder[key] = value
+            elif key in holder:
+                del holder[key]
+        if hasattr(holder, "sync"):
+            holder.sync()
+        self.clear()
+        return len(changes)
+
+    def clear(self):
+        """Remove journal file.
+        """
+
+        if self.exists():
+            remove(self.journal_path)
@@ -23,15 +23,60 @@
 import os
 import logging
 
+from time import time
+from collections import OrderedDict
+
+
+class Span(object):
+    """Wall time of an operation, recorded by Log when it ends.
+
+    Args:
+        name (str): Name of operation.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = None
+
+    def __enter__(self):
+        self.started = time()
+        return self
+
+    def __exit__(self, *args):
+        Log.record(self.name, time() - self.started)
+
+
+class NullSpan(object):
+    """Span that records nothing, used when debugging is disabled.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
 
 class Log(object):
     """Log wrapper. That's it...
+
+    Messages are formatted only if their level is enabled, so arguments are
+    converted to strings only when the message is actually logged.
+
+    Operations can be timed with spans while debugging; the wall time of
+    every span is summed up by name and reported with report_spans.
+
+    Arguments:
+        spans (OrderedDict): Name of span to number of calls and wall time.
     """
 
     config = {
         r"format": r"%(message)s"
     }
 
+    spans = OrderedDict()
+    null_span = NullSpan()
+
     @classmethod
     def configure(cls, verbose=False):
         if "DEBUG" in os.environ or verbose:
@@ -40,6 +85,19 @@ class Log(object):
             cls.config["level"] = logging.WARNING
         logging.basicConfig(**cls.config)
 
+    @classmethod
+    def is_enabled(cls, level):
+        """Tests whether messages of a level are logged.
+
+        Args:
+            level (int): Logging level.
+
+        Returns:
+            bool: True if level is enabled, otherwise False.
+        """
+
+        return logging.getLogger().isEnabledFor(level)
+
     @classmethod
     def text_fmt(cls, message, params=None):
         if isinstance(params, dict):
@@ -51,19 +109,23 @@ class Log(object):
 
     @classmethod
     def info(cls, message, **kwargs):
-        logging.info(cls.text_fmt(message, kwargs))
+        if cls.is_enabled(logging.INFO):
+            logging.info(cls.text_fmt(message, kwargs))
 
     @classmethod
     def debug(cls, message, **kwargs):
-        logging.debug(cls.text_fmt(message, kwargs))
+        if cls.is_enabled(logging.DEBUG):
+            logging.debug(cls.text_fmt(message, kwargs))
 
     @classmethod
     def warn(cls, message, **kwargs):
-        logging.warning(cls.text_fmt(message, kwargs))
+        if cls.is_enabled(logging.WARNING):
+            logging.warning(cls.text_fmt(message, kwargs))
 
     @classmethod
     def error(cls, message, **kwargs):
-        logging.error(cls.text_fmt(message, kwargs))
+        if cls.is_enabled(logging.ERROR):
+            logging.error(cls.text_fmt(message, kwargs))
 
     @classmethod
     def fatal(cls, message, **kwargs):
@@ -73,3 +135,47 @@ class Log(object):
         else:
             throw = SystemExit
         raise throw(error)
+
+    @classmethod
+    def span(cls, name):
+        """Time an operation while debugging.
+
+        Usage:
+            with Log.span("query_all"):
+                rows = list(database.query_all())
+
+        Args:
+            name (str): Name of operation.
+
+        Returns:
+            object: Context manager recording wall time of the block.
+        """
+
+        if cls.is_enabled(logging.DEBUG):
+            return Span(name)
+        return cls.null_span
+
+    @classmethod
+    def record(cls, name, elapsed):
+        """Add wall time of a call to the total of a span.
+
+        Args:
+            name     (str): Name of span.
+            elapsed (float): Wall time in seconds.
+        """
+
+        calls, total = cls.spans.get(name, (0, 0.0))
+        cls.spans[name] = (calls + 1, total + elapsed)
+
+    @classmethod
+    def report_spans(cls):
+        """Log wall time of all spans recorded so far and reset them.
+        """
+
+        if len(cls.spans) == 0:
+            return
+        cls.debug("Timing breakdown:")
+        for name, (calls, total) in cls.spans.iteritems():
+            cls.debug("  {span}", span="{:<16} {:>6} call(s) {:>10.3f} ms"
+                      .format(name, calls, total * 1000))
+        cls.spans.clear()
@@ -49,11 +49,12 @@ class Passkey(object):
         self.passfix = self.SUPPORTED_TYPES.get(auth_type)
 
     @classmethod
-    def resolve(cls, auth):
+    def resolve(cls, auth, answer=None):
         """Returns the final version of a passkey with its appropriate type.
 
         Args:
-            auth (str): Authentification method.
+            auth   (str): Authentification method.
+            answer (str): Prepared answer to use instead of user input.
 
         Raises:
             Exception: If unsupported authentification or cannot resolve pin.
@@ -63,7 +64,10 @@ class Passkey(object):
         """
 
         pk = cls(auth)
-        pk.read()
+        if answer is None:
+            pk.read()
+        else:
+            pk.answer(answer)
         return pk.pin()
 
     @classmethod
@@ -123,6 +127,18 @@ class Passkey(object):
             Log.fatal("Unsupported read method: {m}", m=self.read_method)
         self.passkey = getattr(self, self.__read_method)()
 
+    def answer(self, value):
+        """Retrieve passkey from a prepared answer instead of user input.
+
+        Args:
+            value (str): Password or path to private key, as typed on prompt.
+        """
+
+        if self.passfix == self.SUPPORTED_TYPES.get("privatekey"):
+            self.passkey = self.load_privatekey(value)
+        else:
+            self.passkey = value
+
     def read_password(self, prompt="Password: "):
         """Get password from user input.
 
@@ -142,7 +158,18 @@ class Passkey(object):
             Exception: If path to private key does not exist or cannot open.
         """
 
-        filepath = raw_input(prompt)
+        return self.load_privatekey(raw_input(prompt))
+
+    def load_privatekey(self, filepath):
+        """Read private key from file.
+
+        Args:
+            filepath (str): Path to private key.
+
+        Raises:
+            Exception: If path to private key does not exist or cannot open.
+        """
+
         if not path.exists(filepath):
             Log.fatal("Path to private key does not exists")
         try:
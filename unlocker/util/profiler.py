@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from os import environ
+from sys import argv, stderr
+
+from unlocker.util.log import Log
+
+
+class Profiler(object):
+    """Profile a whole command run.
+
+    Profiling is requested with global options, accepted anywhere on the
+    command line and removed before the command is parsed:
+      --profile[=path]      Write profile to path (default per mode).
+      --profile-mode=mode   Profile CPU time ("cpu") or allocations ("alloc").
+      --profile-summary     Print a short summary to stderr.
+
+    Or with the UNLOCKER_PROFILE (path or "1"), UNLOCKER_PROFILE_MODE and
+    UNLOCKER_PROFILE_SUMMARY environment variables. Empty, "0" and "false"
+    values turn profiling or summary off.
+
+    CPU profiles are written as pstats files (read them with "python -m
+    pstats"). Allocation profiles are written as text reports with the top
+    allocation sites and peak memory, traced with tracemalloc if available,
+    otherwise with the top object types created by the command and the peak
+    resident memory of the process.
+
+    Arguments:
+        path     (str): Path to write profile to.
+        mode     (str): Profiling mode.
+        summary (bool): Whether to print a summary to stderr.
+
+    Args:
+        path     (str): Path to write profile to (optional).
+        mode     (str): Profiling mode (optional).
+        summary (bool): Whether to print a summary to stderr (optional).
+    """
+
+    OPTION, MODE_OPTION, SUMMARY_OPTION = \
+        "--profile", "--profile-mode", "--profile-summary"
+    ENV, MODE_ENV, SUMMARY_ENV = \
+        "UNLOCKER_PROFILE", "UNLOCKER_PROFILE_MODE", "UNLOCKER_PROFILE_SUMMARY"
+
+    # environment values turning a flag on or off, besides a path
+    ON_VALUES, OFF_VALUES = ("1", "true"), ("", "0", "false")
+
+    CPU, ALLOC = "cpu", "alloc"
+    DEFAULT_PATHS = {CPU: "unlocker.pstats", ALLOC: "unlocker.alloc"}
+
+    # number of functions, allocation sites or object types in summaries
+    TOP = 20
+
+    def __init__(self, path=None, mode=CPU, summary=False):
+        if mode not in self.DEFAULT_PATHS:
+            Log.fatal("Unsupported profile mode {m} (expected one of: {s})",
+                      m=mode, s=", ".join(sorted(self.DEFAULT_PATHS)))
+        self.path = path or self.DEFAULT_PATHS.get(mode)
+        self.mode = mode
+        self.summary = summary
+        self.profile = None
+        self.baseline = None
+
+    @classmethod
+    def from_argv(cls):
+        """Build profiler from global options and environment.
+
+        Global options are removed from command line arguments.
+
+        Returns:
+            Profiler: Profiler if profiling is requested, otherwise None.
+        """
+
+        path = environ.get(cls.ENV, "")
+        mode = environ.get(cls.MODE_ENV) or cls.CPU
+        summary = environ.get(cls.SUMMARY_ENV, "").lower() \
+            not in cls.OFF_VALUES
+        enabled = path.lower() not in cls.OFF_VALUES
+        if not enabled or path.lower() in cls.ON_VALUES:
+            path = None
+        rest = []
+        for arg in argv[1:]:
+            option, _, value = arg.partition("=")
+            if option == cls.OPTION:
+                enabled, path = True, value or None
+            elif option == cls.MODE_OPTION:
+                enabled, mode = True, value
+            elif arg == cls.SUMMARY_OPTION:
+                enabled, summary = True, True
+            else:
+                rest.append(arg)
+        argv[1:] = rest
+        if not enabled:
+            return None
+        return cls(path, mode, summary)
+
+    def start(self):
+        """Start profiling.
+        """
+
+        Log.debug("Profiling {m} to {p}...", m=self.mode, p=self.path)
+        if self.mode == self.CPU:
+            from cProfile import Profile
+            self.profile = Profile()
+            self.profile.enable()
+            return
+        try:
+            import tracemalloc
+        except ImportError:
+            self.baseline = self.count_objects()
+        else:
+            tracemalloc.start()
+
+    def stop(self):
+        """Stop profiling, write profile and print summary.
+        """
+
+        if self.mode == self.CPU:
+            self.profile.disable()
+            self.profile.dump_stats(self.path)
+            if self.summary:
+                from pstats import Stats
+                stats = Stats(self.profile, stream=stderr)
+                stats.sort_stats("cumulative").print_stats(self.TOP)
+            return
+        report = self.get_alloc_report()
+        with open(self.path, "w") as fd:
+            fd.write("\n".join(report) + "\n")
+        if self.summary:
+            stderr.write("\n".join(report[:self.TOP + 2]) + "\n")
+
+    def run(self, func, *args, **kwargs):
+        """Profile a callable, including one that exits.
+
+        Args:
+            func (callable): Function to profile.
+
+        Returns:
+            object: Return value of func.
+        """
+
+        self.start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.stop()
+
+    def count_objects(self):
+        """Count live objects by type.
+
+        Returns:
+            dict: Name of type to number of objects.
+        """
+
+        from gc import collect, get_objects
+        collect()
+        counts = {}
+        for each in get_objects():
+            name = type(each).__name__
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    def get_alloc_report(self):
+        """Build allocation report.
+
+        Returns:
+            list: Lines of report, starting with peak memory.
+        """
+
+        try:
+            import tracemalloc
+        except ImportError:
+            return self.get_objects_report()
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        report = ["Peak traced memory: {} KiB".format(peak // 1024),
+                  "Top allocation sites:"]
+        for stat in snapshot.statistics("lineno"):
+            report.append("  {}".format(stat))
+        return report
+
+    def get_objects_report(self):
+        """Build allocation report without tracemalloc.
+
+        Returns:
+            list: Lines of report, starting with peak memory.
+        """
+
+        from resource import getrusage, RUSAGE_SELF
+        counts = self.count_objects()
+        growth = sorted(((counts.get(k, 0) - self.baseline.get(k, 0), k)
+                         for k in counts), reverse=True)
+        report = ["Peak resident memory: {} KiB".format(
+                      getrusage(RUSAGE_SELF).ru_maxrss),
+                  "Top object types created (tracemalloc not available):"]
+        for count, name in growth:
+            if count <= 0:
+                break
+            report.append("  {:<32} {:>8}".format(name, count))
+        return report
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+#
+# Copyright 2018 Alexandru Catrina
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from collections import deque
+from threading import Thread, Condition, current_thread
+from time import time
+
+from ipaddress import ip_address
+
+from unlocker.authority import gethostbyname
+
+from unlocker.util.secret import Secret
+from unlocker.util.log import Log
+
+
+class Resolver(object):
+    """Resolve many hostnames concurrently through a bounded pool of threads.
+
+    Each hostname is resolved once, no matter how many times it's requested,
+    and IP addresses are answered as they are. Lookups run in the workers
+    of the pool. A lookup slower than the timeout is given up on, although
+    its worker keeps blocking until the call returns since it cannot be
+    interrupted. Such workers still count as outstanding, so there are never
+    more threads than workers, and hostnames waiting longer than the timeout
+    for a free worker are given up on too. Answers are looked up in the DNS
+    cache first, if any, and stored in it afterwards.
+
+    Arguments:
+        workers   (int): Maximum number of concurrent lookups.
+        timeout (float): Seconds to wait for each lookup.
+        lookup   (func): Blocking resolver of hostname to IPv4 address.
+        cache (DnsCache): Cache of resolved hostnames or None.
+        lookups   (int): Number of lookups started so far.
+        outstanding (int): Number of workers alive, including those blocked
+                           in lookups given up on.
+        cond (Condition): Guards outstanding workers and lookup progress.
+
+    Args:
+        workers   (int): Maximum number of concurrent lookups.
+        timeout (float): Seconds to wait for each lookup.
+        lookup   (func): Blocking resolver (defaults to system resolver).
+        cache (DnsCache): Cache of resolved hostnames (defaults to none).
+    """
+
+    SECTION = "resolver"
+    WORKERS = 16
+    TIMEOUT = 5.0
+
+    def __init__(self, workers=WORKERS, timeout=TIMEOUT, lookup=None,
+                 cache=None):
+        if workers < 1 or timeout <= 0:
+            Log.fatal("Resolver needs at least a worker and a timeout")
+        self.workers = workers
+        self.timeout = timeout
+        self.lookup = lookup or gethostbyname
+        self.cache = cache
+        self.lookups = 0
+        self.outstanding = 0
+        self.cond = Condition()
+
+    @classmethod
+    def from_config(cls, lookup=None):
+        """Create a resolver configured in the "resolver" section, backed by
+        the DNS cache.
+
+        Args:
+            lookup (func): Blocking resolver (defaults to system resolver).
+
+        Raises:
+            Exception: If configuration is invalid.
+
+        Returns:
+            Resolver: Configured resolver.
+        """
+
+        try:
+            workers = int(Secret.get_config(cls.SECTION, "workers",
+                                            cls.WORKERS))
+            timeout = float(Secret.get_config(cls.SECTION, "timeout",
+                                              cls.TIMEOUT))
+        except ValueError as e:
+            Log.fatal("Invalid resolver configuration: {e}", e=str(e))
+        from unlocker.util.dnscache import DnsCache
+        return cls(workers, timeout, lookup, DnsCache.get_instance())
+
+    def is_address(self, host):
+        """Tests whether a host is already an IP address.
+
+        Args:
+            host (str): Hostname or IP address.
+
+        Returns:
+            bool: True if host is an IP address, otherwise False.
+        """
+
+        try:
+            ip_address(unicode(host))
+        except ValueError:
+            return False
+        return True
+
+    def resolve(self, host):
+        """Resolve a hostname, waiting no longer than the timeout.
+
+        Args:
+            host (str): Hostname to resolve.
+
+        Returns:
+            str: IPv4 address or None if hostname cannot be resolved.
+        """
+
+        return self.resolve_all([host])[host]
+
+    def lookup_host(self, host):
+        """Resolve a hostname with a blocking lookup.
+
+        Args:
+            host (str): Hostname to resolve.
+
+        Returns:
+            str: IPv4 address or None if hostname cannot be resolved.
+        """
+
+        try:
+            return self.lookup(host)
+        except Exception as e:
+            Log.warn("Cannot resolve hostname {h}: {e}", h=host, e=str(e))
+            return None
+
+    def resolve_all(self, hosts):
+        """Resolve unique hostnames concurrently.
+
+        Lookups that time out are not cached, as the hostname may still
+        exist.
+
+        Args:
+            hosts (iter): Hostnames or IP addresses, possibly repeated.
+
+        Returns:
+            dict: IPv4 address, or None if it cannot be resolved, of each
+                  hostname.
+        """
+
+        answers, pending, pending_hosts = {}, deque(), []
+        for host in hosts:
+            if host in answers:
+                continue
+            if self.is_address(host):
+                answers[host] = host
+                continue
+            cached = self.cache.get(host) if self.cache else None
+            if cached is not None:
+                answers[host] = cached[0]
+                continue
+            answers[host] = None
+            pending.append(host)
+            pending_hosts.append(host)
+        total = len(pending)
+        self.lookups += total
+        timeouts = self.run_lookups(pending, answers)
+        if self.cache is not None:
+            for host in pending_hosts:
+                if host not in timeouts:
+                    self.cache.put(host, answers[host])
+            self.cache.save()
+        Log.debug("Resolved {n} hostnames with {w} workers...", n=total,
+                  w=min(self.workers, total))
+        return answers
+
+    def run_lookups(self, pending, answers):
+        """Resolve pending hostnames in a bounded pool of workers.
+
+        Workers take hostnames from the queue until it's empty. A worker
+        blocked in a lookup for longer than the timeout is left behind and
+        its hostname is answered None, while a new worker is started only if
+        fewer than the maximum number of workers are outstanding.
+
+        Args:
+            pending (deque): Hostnames to resolve.
+            answers  (dict): IPv4 address of each hostname (updated).
+
+        Returns:
+            set: Hostnames given up on after the timeout.
+        """
+
+        running, timeouts = {}, set()
+        live = [0]  # workers alive and not given up on
+
+        def work():
+            worker = current_thread()
+            try:
+                while True:
+                    with self.cond:
+                        if len(pending) == 0:
+                            live[0] -= 1
+                            return
+                        host = pending.popleft()
+                        running[worker] = host, time()
+                    address = self.lookup_host(host)
+                    with self.cond:
+                        if running.pop(worker, None) is None:
+                            return  # given up on
+                        answers[host] = address
+                        self.cond.notify_all()
+            finally:
+                with self.cond:
+                    self.outstanding -= 1
+                    self.cond.notify_all()
+
+        waiting_since = None
+        with self.cond:
+            while len(pending) > 0 or len(running) > 0:
+                while len(pending) > live[0] - len(running) and \
+                        self.outstanding < self.workers:
+                    self.outstanding += 1
+                    live[0] += 1
+                    thread = Thread(target=work)
+                    thread.daemon = True
+                    thread.start()
+                now = time()
+                if len(pending) > 0 and live[0] == 0:
+                    waiting_since = waiting_since or now
+                    if now - waiting_since >= self.timeout:
+                        Log.warn("Cannot resolve {n} hostnames: no worker "
+                                 "available after {t}s", n=len(pending),
+                                 t=self.timeout)
+                        timeouts.update(pending)
+                        pending.clear()
+                        continue
+                else:
+                    waiting_since = None
+                deadline = min([started for _, started in running.values()] +
+                               [waiting_since or now]) + self.timeout
+                self.cond.wait(max(deadline - now, 0.001))
+                now = time()
+                for worker, (host, started) in running.items():
+                    if now - started >= self.timeout:
+                        Log.warn("Cannot resolve hostname {h}: timed out "
+                                 "after {t}s", h=host, t=self.timeout)
+                        del running[worker]
+                        timeouts.add(host)
+                        live[0] -= 1
+        return timeouts
@@ -20,14 +20,12 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-try:
-    from gdbm import open as read_secrets
-except ImportError:
-    raise SystemExit("Missing dependency: gdbm module")
-
-from os import path, makedirs, environ, chmod
+from os import path, makedirs, environ, chmod, remove
 from os.path import expanduser
+from time import sleep
 
+from unlocker.backend.base import get_backend
+from unlocker.util.journal import Journal
 from unlocker.util.log import Log
 
 from unlocker import __version__
@@ -36,6 +34,9 @@ from unlocker import __version__
 def confidential(func):
     """Adds confidentiality to as arguments.
 
+    The wrapped callable gets the opened secrets and whether they were
+    requested for reading only, and its result is returned.
+
     Args:
         func (callable): Function or class to pass secrets to.
 
@@ -43,20 +44,21 @@ def confidential(func):
         callable: Wrapper on top of func.
     """
 
-    def wrapper(**kwargs):
+    def wrapper(read_only=False, **kwargs):
 
-        # Initialize secrets
-        db = Secret.get_secret_file()
+        # Initialize secrets (shared open for readers)
+        with Log.span("keychain open"):
+            db = Secret.get_secret_file(read_only)
 
         # Launch callable with secret arguments
         try:
             if "DEBUG" not in environ:
                 try:
-                    func(db, **kwargs)
+                    result = func(db, read_only=read_only, **kwargs)
                 except Exception as e:
                     raise SystemExit("\nCrashing... {}".format(e))
             else:
-                func(db, **kwargs)
+                result = func(db, read_only=read_only, **kwargs)
 
         # capture ^C and clean close...
         except KeyboardInterrupt:
@@ -64,6 +66,7 @@ def confidential(func):
 
         # Finally close secret files
         db.close()
+        return result
 
     return wrapper
 
@@ -71,6 +74,10 @@ def confidential(func):
 class Secret(object):
     """Unlocker key holder wrapper.
 
+    The keychain backend is read from the "backend" option of the
+    "keychain" section in the configuration file, and can be overridden by
+    the UNLOCKER_KEYCHAIN_BACKEND environment variable.
+
     Arguments:
         unlocker_dir (str): Unlocker directory inside user's home directory.
         secrets_file (str): Key holder filename.
@@ -80,6 +87,20 @@ class Secret(object):
     UNLOCKER_DIR = ".unlocker"
     SECRETS_FILE = ".secrets"
     SECRETS_LOCK = ".secrets.lock"
+    SECRETS_JOURNAL = ".secrets.journal"
+    CONFIG_FILE = "config"
+
+    # keychain backend configuration and default backend
+    BACKEND_SECTION, BACKEND_OPTION = "keychain", "backend"
+    DEFAULT_BACKEND = "gdbm"
+
+    # open modes for readers (shared) and writers (exclusive)
+    READER, WRITER = "r", "c"
+
+    # attempts to open secrets while locked by another process and delays
+    LOCK_RETRIES, LOCK_BACKOFF, LOCK_BACKOFF_MAX = 12, 0.01, 0.5
+    AGENT_SOCKET = ".agent.sock"
+    DNS_CACHE = ".dns-cache"
 
     @classmethod
     def get_secret_dir(cls):
@@ -106,9 +127,193 @@ class Secret(object):
         return unicode(secret_dir)
 
     @classmethod
-    def get_secret_file(cls):
+    def get_config_path(cls):
+        """Configuration file path getter.
+
+        Returns:
+            unicode: Path to configuration file inside secret directory.
+        """
+
+        return u"{}/{}".format(cls.get_secret_dir(), cls.CONFIG_FILE)
+
+    @classmethod
+    def get_config(cls, section, option, default=None):
+        """Read an option from environment or configuration file.
+
+        Environment variables are named after section and option, e.g.
+        UNLOCKER_KEYCHAIN_BACKEND for option "backend" of "keychain".
+
+        Args:
+            section (str): Section of configuration file.
+            option  (str): Option to read.
+            default (str): Value to return if option is not set.
+
+        Returns:
+            str: Value of option.
+        """
+
+        env = "UNLOCKER_{}_{}".format(section, option).upper()
+        if env in environ:
+            return environ.get(env)
+        config_path = cls.get_config_path()
+        if not path.exists(config_path):
+            return default
+        from ConfigParser import SafeConfigParser
+        config = SafeConfigParser()
+        config.read(config_path)
+        if not config.has_option(section, option):
+            return default
+        return config.get(section, option)
+
+    @classmethod
+    def set_config(cls, section, option, value):
+        """Write an option to configuration file.
+
+        Args:
+            section (str): Section of configuration file.
+            option  (str): Option to write.
+            value   (str): Value of option.
+        """
+
+        from ConfigParser import SafeConfigParser
+        config_path = cls.get_config_path()
+        config = SafeConfigParser()
+        config.read(config_path)
+        if not config.has_section(section):
+            config.add_section(section)
+        config.set(section, option, value)
+        with open(config_path, "wb") as fd:
+            config.write(fd)
+
+    @classmethod
+    def get_backend_name(cls):
+        """Configured keychain backend name getter.
+
+        Returns:
+            str: Name of keychain backend.
+        """
+
+        return cls.get_config(cls.BACKEND_SECTION, cls.BACKEND_OPTION,
+                              cls.DEFAULT_BACKEND)
+
+    @classmethod
+    def get_secret_path(cls, backend=None):
+        """Keychain file path getter.
+
+        Args:
+            backend (str): Name of backend (defaults to configured one).
+
+        Returns:
+            unicode: Path to keychain file of backend.
+        """
+
+        if backend is None:
+            backend = cls.get_backend_name()
+        return u"{}/{}".format(cls.get_secret_dir(),
+                               get_backend(backend).SECRETS_FILE)
+
+    @classmethod
+    def get_sidecar_paths(cls, backend=None):
+        """Paths of files kept by backend next to keychain file.
+
+        Args:
+            backend (str): Name of backend (defaults to configured one).
+
+        Returns:
+            list: Paths to sidecar files (e.g. SQLite write-ahead log).
+        """
+
+        if backend is None:
+            backend = cls.get_backend_name()
+        fullpath = cls.get_secret_path(backend)
+        return [fullpath + each
+                for each in get_backend(backend).SIDECAR_SUFFIXES]
+
+    @classmethod
+    def get_lock_path(cls):
+        """Encrypted keychain file path getter.
+
+        Returns:
+            unicode: Path to file of secrets locked by lock script.
+        """
+
+        return u"{}/{}".format(cls.get_secret_dir(), cls.SECRETS_LOCK)
+
+    @classmethod
+    def get_journal(cls):
+        """Write-ahead journal getter.
+
+        Returns:
+            Journal: Journal of keychain commits inside secret directory.
+        """
+
+        return Journal(u"{}/{}".format(cls.get_secret_dir(),
+                                       cls.SECRETS_JOURNAL))
+
+    @classmethod
+    def get_agent_socket(cls):
+        """Agent socket path getter.
+
+        Returns:
+            unicode: Path to the agent Unix socket inside secret directory.
+        """
+
+        return u"{}/{}".format(cls.get_secret_dir(), cls.AGENT_SOCKET)
+
+    @classmethod
+    def get_dns_cache_path(cls):
+        """DNS cache path getter.
+
+        Returns:
+            unicode: Path to cache of resolved hostnames inside secret
+                     directory.
+        """
+
+        return u"{}/{}".format(cls.get_secret_dir(), cls.DNS_CACHE)
+
+    @classmethod
+    def open_secret_file(cls, fullpath, mode, backend=None):
+        """Open secrets file, waiting for other processes to release it.
+
+        Readers share the file with other readers, while writers wait for
+        exclusive access. Opening a file locked by another process is retried
+        with exponential backoff, while any other error is raised at once.
+
+        Args:
+            fullpath (str): Path to secrets file.
+            mode     (str): Open mode for readers or writers.
+            backend  (str): Name of backend (defaults to configured one).
+
+        Raises:
+            Exception: If file cannot be opened after all retries.
+
+        Returns:
+            object: Instance of opened secrets file.
+        """
+
+        if backend is None:
+            backend = cls.get_backend_name()
+        backend = get_backend(backend)
+        delay = cls.LOCK_BACKOFF
+        for attempt in xrange(cls.LOCK_RETRIES):
+            try:
+                return backend.open(fullpath, mode)
+            except Exception as e:
+                if not backend.is_locked(e) or \
+                        attempt + 1 == cls.LOCK_RETRIES:
+                    raise
+                Log.debug("Secrets busy ({e}), retrying in {d}s...",
+                          e=str(e), d=delay)
+                sleep(delay)
+                delay = min(delay * 2, cls.LOCK_BACKOFF_MAX)
+
+    @classmethod
+    def get_secret_file(cls, read_only=False):
         """Return or make a sample keys holder.
 
+        Args:
+            read_only (bool): Open secrets for reading only (shared).
+
         Raises:
             Exception: If application cannot read or write file.
 
@@ -116,27 +321,44 @@ class Secret(object):
             object: Instance of opened secrets file.
         """
 
-        secret_dir = cls.get_secret_dir()
-        lockpath = "{}/{}".format(secret_dir, cls.SECRETS_LOCK)
-        if path.exists(lockpath):
+        if path.exists(cls.get_lock_path()):
             Log.fatal("Secrets are locked!\nClosing...")
-        fullpath = "{}/{}".format(secret_dir, cls.SECRETS_FILE)
+        fullpath = cls.get_secret_path()
+        if read_only and not path.exists(fullpath):
+            Log.debug("Secret storage file is missing, creating it...")
+            read_only = False
+        if read_only and cls.get_journal().exists():
+            Log.debug("Found journal of an unfinished commit...")
+            read_only = False
         try:
-            secret_file = read_secrets(fullpath, "c")
-            chmod(fullpath, 0600)
+            if read_only:
+                secret_file = cls.open_secret_file(fullpath, cls.READER)
+            else:
+                secret_file = cls.open_secret_file(fullpath, cls.WRITER)
+                chmod(fullpath, 0600)
         except Exception as e:
             Log.fatal("Cannot create secret storage file: {e}", e=str(e))
         try:
             assert secret_file[cls.VERSION]
         except KeyError:
+            if read_only:
+                secret_file.close()
+                return cls.get_secret_file()
             secret_file[cls.VERSION] = __version__
         except Exception as e:
             Log.fatal("Unsupported secrets driver or {e}", e=str(e))
         if secret_file[cls.VERSION] != __version__:
             error = "Secrets have been stored with a different version " \
                     "of Unlocker (current version {cv}; secrets {vs})\n" \
+                    "Run \"unlocker migrate\" and then \"unlocker migrate " \
+                    "--convert\" to upgrade secrets of older versions\n" \
                     "Closing..."
             Log.fatal(error, cv=__version__, vs=secret_file[cls.VERSION])
+        if not read_only:
+            recovered = cls.get_journal().replay(secret_file)
+            if recovered > 0:
+                Log.warn("Recovered {n} change(s) of an unfinished commit",
+                         n=recovered)
         return secret_file
 
     @classmethod
@@ -147,10 +369,71 @@ class Secret(object):
             Exception: If secrets cannot be migrated.
         """
 
-        fullpath = "{}/{}".format(cls.get_secret_dir(), cls.SECRETS_FILE)
+        fullpath = cls.get_secret_path()
         try:
-            secret_file = read_secrets(fullpath, "c")
+            secret_file = cls.open_secret_file(fullpath, cls.WRITER)
             secret_file[cls.VERSION] = __version__
             secret_file.close()
         except Exception as e:
             Log.fatal("Cannot migrate secrets because {e}", e=str(e))
+
+    @classmethod
+    def convert_secrets(cls, secrets, backend, derived=None, rebuild=None):
+        """Copy all keys to another backend and switch to it.
+
+        Keys are copied as they are stored and compared after the copy, so
+        the conversion is lossless. Derived keys (e.g. indexes) are not
+        copied but rebuilt on the new keychain, as each backend may store
+        them its own way. The old keychain file and its sidecar files are
+        closed and removed once the copy is verified, so they are not left
+        unencrypted by the lock script.
+
+        Args:
+            secrets   (object): Dict-like storage of current backend.
+            backend      (str): Name of backend to convert to.
+            derived (callable): Tests whether a key is derived from others.
+            rebuild (callable): Rebuild derived keys in the new storage.
+
+        Raises:
+            Exception: If target exists or copied keys do not match.
+
+        Returns:
+            int: Number of keys copied.
+        """
+
+        source = cls.get_backend_name()
+        if backend == source:
+            Log.fatal("Secrets are already stored with {b}", b=backend)
+        fullpath = cls.get_secret_path(backend)
+        if path.exists(fullpath):
+            Log.fatal("Cannot convert secrets: {p} already exists",
+                      p=fullpath)
+        target = cls.open_secret_file(fullpath, cls.WRITER, backend)
+        chmod(fullpath, 0600)
+        try:
+            keys = [key for key in secrets.keys()
+                    if derived is None or not derived(key)]
+            for key in keys:
+                target[key] = secrets[key]
+            target.sync()
+            for key in keys:
+                if target[key] != secrets[key]:
+                    Log.fatal("Converted key {k} does not match", k=key)
+            if len(target) != len(keys):
+                Log.fatal("Converted keychain has unexpected keys")
+            if rebuild is not None:
+                rebuild(target)
+                target.sync()
+        except BaseException:
+            target.close()
+            remove(fullpath)
+            raise
+        target.close()
+        cls.set_config(cls.BACKEND_SECTION, cls.BACKEND_OPTION, backend)
+        secrets.close()
+        for each in [cls.get_secret_path(source)] + \
+                cls.get_sidecar_paths(source):
+            if path.exists(each):
+                remove(each)
+                Log.debug("Removed old keychain file {p}", p=each)
+        return len(keys)
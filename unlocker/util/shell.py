@@ -24,11 +24,12 @@ from __future__ import print_function
 
 from os import environ
 from sys import argv
-from argparse import ArgumentParser
+from argparse import ArgumentParser, Namespace, REMAINDER
 
 from unlocker.util.log import Log
 from unlocker.util.secret import Secret
-from unlocker.util.helper import deploy_unlock_script, deploy_lock_script
+from unlocker.backend.base import BACKENDS
+from unlocker.display import STREAM_LIST_FORMATS
 
 from unlocker import __version__
 
@@ -54,6 +55,19 @@ Usage:
   lookup        Find password for provided host, port and user
   install       Install helper scripts
   migrate       Migrate secrets to current unlocker version
+  agent         Serve read-only requests from memory (faster lookups)
+  index         Rebuild or verify keychain indexes
+  dependents    Show servers bouncing off a server
+  compact       Reclaim space of removed entries (log keychain)
+  stats         Show counts and sizes of stored keys
+  batch         Run many commands read as JSON lines from STDIN
+  dns-cache     Show or flush cache of resolved hostnames
+  keychain      Show paths to files of keychain (used by helper scripts)
+
+Global options:
+  --profile[=path]          Profile command and write profile to path
+  --profile-mode=cpu|alloc  Profile CPU time (default) or allocations
+  --profile-summary         Print a profile summary to STDERR
 """.format(__version__)
 
 SCRIPTS_CREATED = """OK
@@ -222,6 +236,10 @@ def get_list_shell(self, header="List known hosts from keychain"):
     psr.add_argument(
         "-v", "--vertical", action="store_true", dest="vertical",
         help="Display list of hosts vertically (80 columns compatibility)")
+    psr.add_argument(
+        "-f", "--format", dest="format", default="table",
+        choices=("table",) + STREAM_LIST_FORMATS,
+        help="Stream one host per line in a machine-readable format")
     return psr.parse_args(argv[2:])
 
 
@@ -241,6 +259,7 @@ def get_install_shell(self):
     """Shell getter for "install" option.
     """
 
+    from unlocker.util.helper import deploy_unlock_script, deploy_lock_script
     try:
         deploy_unlock_script() and deploy_lock_script()
         print(SCRIPTS_CREATED)
@@ -265,6 +284,21 @@ def get_migrate_shell(self):
                          dest="export_secrets",
                          help="Export secrets to STDOUT",
                          nargs="*")
+        grp.add_argument("--convert",
+                         action="store_true",
+                         dest="convert_records",
+                         help="Convert stored secrets to single records")
+        grp.add_argument("--backend",
+                         action="store",
+                         dest="convert_backend",
+                         choices=sorted(BACKENDS),
+                         help="Copy stored secrets to another backend")
+        psr.add_argument("--batch-size",
+                         action="store",
+                         dest="batch_size",
+                         type=int,
+                         help="Number of imported secrets written at once "
+                              "(default: 1000)")
         return psr.parse_args(argv[2:])
     try:
         Secret.migrate_secrets()
@@ -274,6 +308,96 @@ def get_migrate_shell(self):
     raise SystemExit
 
 
+def get_agent_shell(self):
+    """Shell getter for "agent" option.
+
+    Runs the agent in foreground until interrupted.
+    """
+
+    from unlocker.agent import Agent
+    psr = ArgumentParser(description="Serve read-only requests from memory")
+    psr.parse_args(argv[2:])
+    Agent().serve()
+    raise SystemExit
+
+
+def get_dependents_shell(self, header="Show servers bouncing off a server"):
+    """Shell getter for "dependents" option.
+
+    Args:
+        header (str): Description header to display on help message.
+
+    Returns:
+        Namespace: Parsed arguments namespace for "dependents" option.
+    """
+
+    psr = ArgumentParser(description=header)
+    psr.add_argument("signature", help="Name or signature of jump server")
+    return psr.parse_args(argv[2:])
+
+
+def get_index_shell(self, header="Rebuild or verify keychain indexes"):
+    """Shell getter for "index" option.
+
+    Args:
+        header (str): Description header to display on help message.
+
+    Returns:
+        Namespace: Parsed arguments namespace for "index" option.
+    """
+
+    psr = ArgumentParser(description=header)
+    grp = psr.add_mutually_exclusive_group(required=True)
+    grp.add_argument("--rebuild", action="store_true", dest="rebuild",
+                     help="Drop and rebuild all indexes")
+    grp.add_argument("--verify", action="store_true", dest="verify",
+                     help="Compare indexes with stored entries")
+    return psr.parse_args(argv[2:])
+
+
+def get_compact_shell(self, header="Reclaim space of removed entries"):
+    """Shell getter for "compact" option.
+
+    Args:
+        header (str): Description header to display on help message.
+
+    Returns:
+        Namespace: Parsed arguments namespace for "compact" option.
+    """
+
+    psr = ArgumentParser(description=header)
+    return psr.parse_args(argv[2:])
+
+
+def get_stats_shell(self, header="Show counts and sizes of stored keys"):
+    """Shell getter for "stats" option.
+
+    Args:
+        header (str): Description header to display on help message.
+
+    Returns:
+        Namespace: Parsed arguments namespace for "stats" option.
+    """
+
+    psr = ArgumentParser(description=header)
+    return psr.parse_args(argv[2:])
+
+
+def get_batch_shell(self):
+    """Shell getter for "batch" option.
+
+    Runs commands from STDIN until the end of input.
+    """
+
+    from unlocker.batch import Batch
+    psr = ArgumentParser(description="Run commands read as JSON lines")
+    psr.add_argument("--transaction", action="store_true", dest="transaction",
+                     help="Write all changes at once or none on failure")
+    args = psr.parse_args(argv[2:])
+    Batch(args.transaction).start()
+    raise SystemExit
+
+
 def get_dump_shell(self):
     """Shell getter for "dump" option.
 
@@ -296,6 +420,67 @@ def get_purge_shell(self):
     return psr.parse_args(argv[2:])
 
 
+def get_metrics_shell(self):
+    """Shell getter for "metrics" option.
+
+    Option available only in debug mode. The option to measure is parsed
+    by its own shell.
+    """
+
+    psr = ArgumentParser(description="Count keychain operations of an "
+                                     "option (debug mode)")
+    psr.add_argument("option", help="Option to run (e.g. lookup)")
+    psr.add_argument("arguments", nargs=REMAINDER,
+                     help="Arguments of option")
+    args = psr.parse_args(argv[2:])
+    argv[1:] = [args.option] + args.arguments
+    option, namespace = ShellParser().get_args()
+    return Namespace(option=option, args=vars(namespace))
+
+
+def get_dns_cache_shell(self):
+    """Shell getter for "dns-cache" option.
+
+    Prints cache statistics or flushes the cache.
+    """
+
+    from unlocker.util.dnscache import DnsCache
+    psr = ArgumentParser(description="Show or flush cache of resolved "
+                                     "hostnames")
+    grp = psr.add_mutually_exclusive_group()
+    grp.add_argument("--stats", action="store_true", dest="stats",
+                     help="Show entries, hits and misses (default)")
+    grp.add_argument("--flush", action="store_true", dest="flush",
+                     help="Forget all resolved hostnames")
+    args = psr.parse_args(argv[2:])
+    cache = DnsCache.get_instance()
+    if args.flush:
+        print("Flushed {} hostnames".format(cache.flush()))
+        raise SystemExit
+    stats = cache.get_stats()
+    print("Entries: {entries} ({negative} negative, {expired} expired)\n"
+          "Hits: {hits}, misses: {misses}, hit rate: {hit_rate:.1f}%"
+          .format(**stats))
+    raise SystemExit
+
+
+def get_keychain_shell(self):
+    """Shell getter for "keychain" option.
+
+    Prints paths to the keychain file, the encrypted keychain file and the
+    sidecar files of the configured backend, one per line, without opening
+    the keychain. Helper scripts read them to lock and unlock secrets.
+    """
+
+    psr = ArgumentParser(description="Show paths to files of keychain: "
+                                     "keychain file, encrypted keychain "
+                                     "file, then sidecar files")
+    psr.parse_args(argv[2:])
+    print("\n".join([Secret.get_secret_path(), Secret.get_lock_path()] +
+                    Secret.get_sidecar_paths()))
+    raise SystemExit
+
+
 methods = {
     "get_init_shell": get_init_shell,
     "get_list_shell": get_list_shell,
@@ -307,17 +492,27 @@ methods = {
     "get_lookup_shell": get_lookup_shell,
     "get_install_shell": get_install_shell,
     "get_migrate_shell": get_migrate_shell,
+    "get_agent_shell": get_agent_shell,
+    "get_index_shell": get_index_shell,
+    "get_dependents_shell": get_dependents_shell,
+    "get_compact_shell": get_compact_shell,
+    "get_stats_shell": get_stats_shell,
+    "get_batch_shell": get_batch_shell,
+    "get_dns-cache_shell": get_dns_cache_shell,
+    "get_keychain_shell": get_keychain_shell,
 }
 
 if "DEBUG" in environ:
     methods.update({
         "get_dump_shell": get_dump_shell,
-        "get_purge_shell": get_purge_shell
+        "get_purge_shell": get_purge_shell,
+        "get_metrics_shell": get_metrics_shell
     })
     HELP_MESSAGE += """
 Debug:
   dump          Dump all entries from keychain
   purge         Force delete key from keychain (can corrupt entire keychain!)
+  metrics       Count keychain operations of another option
 """
 
 OptionParser = type("OptionParser", (object,), methods)